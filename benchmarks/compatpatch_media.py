@@ -0,0 +1,185 @@
+import copy
+import json
+import random
+import timeit
+import os.path
+import argparse
+import multiprocessing
+try:
+    from instagram_private_api.compatpatch import ClientCompatPatch
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from instagram_private_api.compatpatch import ClientCompatPatch
+from legacy_compatpatch import LegacyClientCompatPatch
+
+
+def _user(pk):
+    return {
+        'pk': pk,
+        'username': 'user%d' % pk,
+        'full_name': 'User %d' % pk,
+        'profile_pic_url': 'https://scontent.cdninstagram.com/t51.2885-19/s150x150/%d_a.jpg' % pk,
+        'profile_pic_id': '%d_%d' % (pk * 7, pk),
+        'is_private': False,
+        'is_verified': False,
+        'friendship_status': {'following': False, 'outgoing_request': False},
+        'has_anonymous_profile_picture': False,
+    }
+
+
+def _comment(pk):
+    return {
+        'pk': pk,
+        'user_id': pk % 1000,
+        'text': 'Nice one! ' * 3,
+        'type': 0,
+        'created_at': 1490000000 + pk % 10000,
+        'created_at_utc': 1490028800 + pk % 10000,
+        'content_type': 'comment',
+        'status': 'Active',
+        'bit_flags': 0,
+        'media_id': pk * 3,
+        'user': _user(pk % 1000),
+    }
+
+
+def _candidates(pk):
+    return [
+        {'url': 'https://scontent.cdninstagram.com/t51.2885-15/s%dx%d/%d.jpg' % (w, w, pk), 'width': w, 'height': w}
+        for w in (1080, 750, 640, 480, 320, 240, 150)]
+
+
+def _media(pk, media_type, rng):
+    media = {
+        'pk': pk,
+        'id': '%d_%d' % (pk, pk % 1000),
+        'code': 'BS%dxYz' % pk,
+        'taken_at': 1490000000 + pk % 100000,
+        'device_timestamp': 1490000000000,
+        'media_type': media_type,
+        'client_cache_key': 'MTQ5MDAwMDAwMA==.2',
+        'filter_type': rng.choice([0, 0, 0, 108, 612, 615]),
+        'image_versions2': {'candidates': _candidates(pk)},
+        'original_width': 1080,
+        'original_height': 1080,
+        'user': _user(pk % 1000),
+        'organic_tracking_token': 'eyJ2ZXJzaW9uIjo1fQ==',
+        'like_count': rng.randint(0, 5000),
+        'has_liked': rng.random() < 0.1,
+        'has_more_comments': True,
+        'max_num_visible_preview_comments': 2,
+        'comment_count': rng.randint(0, 200),
+        'preview_comments': [_comment(pk * 10 + i) for i in range(2)],
+        'caption': dict(_comment(pk * 10 + 9), has_translation=False),
+        'caption_is_edited': False,
+        'photo_of_you': False,
+    }
+    if rng.random() < 0.3:
+        media['location'] = {
+            'pk': pk, 'name': 'Somewhere', 'address': '', 'city': '', 'lat': 1.3, 'lng': 103.8,
+            'external_source': 'facebook_places', 'facebook_places_id': pk}
+    if rng.random() < 0.3:
+        media['usertags'] = {'in': [
+            {'position': [rng.random(), rng.random()], 'user': _user(pk % 997 + i)} for i in range(2)]}
+    if media_type == 2:
+        media['video_versions'] = [
+            {'type': t, 'width': w, 'height': w, 'url': 'https://scontent.cdninstagram.com/%d_%d.mp4' % (pk, w)}
+            for t, w in ((101, 640), (102, 480), (103, 480))]
+        media['video_duration'] = 12.5
+        media['view_count'] = rng.randint(0, 20000)
+        media['has_audio'] = True
+    if media_type == 8:
+        media['carousel_media'] = []
+        for i in range(rng.randint(2, 5)):
+            child = _media(pk * 10 + i, rng.choice([1, 1, 2]), rng)
+            for k in ('caption', 'preview_comments', 'user', 'comment_count', 'like_count'):
+                child.pop(k, None)
+            media['carousel_media'].append(child)
+    return media
+
+
+def synthetic_items(count, seed=1):
+    rng = random.Random(seed)
+    return [_media(1400000000000000000 + i, rng.choice([1, 1, 1, 2, 8]), rng) for i in range(count)]
+
+
+def load_fixtures(path):
+    """Load recorded responses: a feed response, a list of them, or a list of media items"""
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [data]
+    items = []
+    for entry in data:
+        if 'media_type' in entry:
+            items.append(entry)
+            continue
+        for item in entry.get('items', []) + entry.get('ranked_items', []):
+            items.append(item.get('media') or item)
+        for item in entry.get('feed_items', []):
+            if item.get('media_or_ad'):
+                items.append(item['media_or_ad'])
+    return items
+
+
+if __name__ == '__main__':
+
+    # Example command:
+    #   python benchmarks/compatpatch_media.py -n 1000
+    #   python benchmarks/compatpatch_media.py --fixtures feed_timeline.json
+    parser = argparse.ArgumentParser(
+        description='Benchmark ClientCompatPatch.media against the json parse and the legacy patch')
+    parser.add_argument('-n', '--count', dest='count', type=int, default=1000,
+                        help='number of synthetic items when no fixtures are given')
+    parser.add_argument('-r', '--rounds', dest='rounds', type=int, default=20)
+    parser.add_argument('-fixtures', '--fixtures', dest='fixtures',
+                        help='JSON file of recorded responses or media items')
+    parser.add_argument('-p', '--processes', dest='processes', type=int, default=0,
+                        help='also time media_many() across this many processes')
+    args = parser.parse_args()
+
+    items = load_fixtures(args.fixtures) if args.fixtures else synthetic_items(args.count)
+    raw = json.dumps({'items': items, 'status': 'ok'})
+    print('items: %d, payload: %d bytes' % (len(items), len(raw)))
+
+    parse = min(timeit.repeat(lambda: json.loads(raw), number=1, repeat=args.rounds))
+    print('%-22s %10.2f ms' % ('json.loads', parse * 1e3))
+    for drop in (False, True):
+        # the same output as before the patch plans
+        assert ([ClientCompatPatch.media(m, drop_incompat_keys=drop) for m in json.loads(raw)['items']] ==
+                [LegacyClientCompatPatch.media(m, drop_incompat_keys=drop) for m in json.loads(raw)['items']])
+        # interleaved so that both get the same machine conditions, on fresh items every time
+        timings = {ClientCompatPatch: [], LegacyClientCompatPatch: []}
+        for _ in range(args.rounds):
+            for patcher in (LegacyClientCompatPatch, ClientCompatPatch):
+                batch = json.loads(raw)['items']
+                timings[patcher].append(timeit.timeit(
+                    lambda: [patcher.media(m, drop_incompat_keys=drop) for m in batch], number=1))
+        legacy, patch = min(timings[LegacyClientCompatPatch]), min(timings[ClientCompatPatch])
+        print('%-22s %10.2f ms %8.2fx parse' % ('legacy(drop=%s)' % drop, legacy * 1e3, legacy / parse))
+        print('%-22s %10.2f ms %8.2fx parse %8.2fx legacy' % (
+            'media(drop=%s)' % drop, patch * 1e3, patch / parse, legacy / patch))
+
+    if args.processes > 1:
+        pool = multiprocessing.Pool(args.processes)
+        batch_size = max(1, len(items) // (args.processes * 4))
+        many = min(timeit.repeat(
+            lambda: ClientCompatPatch.media_many(json.loads(raw)['items'], pool=pool, batch_size=batch_size),
+            number=1, repeat=args.rounds)) - parse
+        pool.terminate()
+        print('%-22s %10.2f ms %8.2fx parse' % ('media_many(p=%d)' % args.processes, many * 1e3, many / parse))
+
+    # lazy views: parse with the hook, then read a few keys (or all of them)
+    lazy = min(timeit.repeat(
+        lambda: [(m['pk'], m['code']) for m in json.loads(raw, object_hook=ClientCompatPatch.lazy_hook)['items']],
+        number=1, repeat=args.rounds))
+    print('%-22s %10.2f ms %8.2fx parse' % ('lazy (pk, code)', (lazy - parse) * 1e3, (lazy - parse) / parse))
+    lazy = min(timeit.repeat(
+        lambda: [m.materialize() for m in json.loads(raw, object_hook=ClientCompatPatch.lazy_hook)['items']],
+        number=1, repeat=args.rounds))
+    print('%-22s %10.2f ms %8.2fx parse' % ('lazy (materialize)', (lazy - parse) * 1e3, (lazy - parse) / parse))
+
+    # sanity check that the items were patched
+    patched = ClientCompatPatch.media(copy.deepcopy(items[0]))
+    assert patched['link'] and patched['images']
@@ -0,0 +1,68 @@
+import gc
+import json
+import os.path
+import argparse
+import tracemalloc
+try:
+    from instagram_private_api.compatpatch import ClientCompatPatch
+    from instagram_private_api.models import Media, User, Comment, IdentityMap
+    from compatpatch_media import synthetic_items, _user, _comment
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    sys.path.append(os.path.dirname(__file__))
+    from instagram_private_api.compatpatch import ClientCompatPatch
+    from instagram_private_api.models import Media, User, Comment, IdentityMap
+    from compatpatch_media import synthetic_items, _user, _comment
+
+
+def measure(build):
+    """Memory held by the result of build(), in bytes"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+if __name__ == '__main__':
+
+    # Example command:
+    #   python benchmarks/models_memory.py -n 20000
+    # Requires python 3 (tracemalloc)
+    parser = argparse.ArgumentParser(description='Compare memory used by the response dicts and the slotted models')
+    parser.add_argument('-n', '--count', dest='count', type=int, default=10000)
+    args = parser.parse_args()
+
+    fixtures = [
+        ('media', json.dumps(synthetic_items(args.count)), Media.from_app, ClientCompatPatch.media),
+        ('user', json.dumps([_user(i) for i in range(args.count)]), User.from_app, ClientCompatPatch.list_user),
+        ('comment', json.dumps([_comment(i) for i in range(args.count)]), Comment.from_app, ClientCompatPatch.comment),
+    ]
+    print('%-8s %8s %12s %12s %12s %8s' % ('type', 'count', 'dict B/obj', 'patched', 'model', 'ratio'))
+    for name, raw, model, patch in fixtures:
+        dicts = measure(lambda: json.loads(raw))
+        patched = measure(lambda: [patch(o) for o in json.loads(raw)])
+        models = measure(lambda: [model(o) for o in json.loads(raw)])
+        print('%-8s %8d %12.0f %12.0f %12.0f %7.1fx' % (
+            name, args.count, dicts / args.count, patched / args.count, models / args.count, dicts / float(models)))
+
+    # the synthetic media and comments reuse 1000 distinct users, so share them
+    def with_identity_map(build):
+        identity_map = IdentityMap()
+        return identity_map, build(identity_map)
+
+    print('\nwith an IdentityMap')
+    print('%-8s %8s %12s %12s %12s %8s' % ('type', 'count', 'dict B/obj', 'patched', 'model', 'ratio'))
+    for name, raw, model, patch in fixtures:
+        if name == 'user':
+            continue
+        dicts = measure(lambda: with_identity_map(lambda m: json.loads(raw, object_hook=m.hook)))
+        patched = measure(lambda: with_identity_map(
+            lambda m: [patch(o) for o in json.loads(raw, object_hook=m.hook)]))
+        models = measure(lambda: with_identity_map(lambda m: [model(o, m) for o in json.loads(raw)]))
+        print('%-8s %8d %12.0f %12.0f %12.0f %7.1fx' % (
+            name, args.count, dicts / args.count, patched / args.count, models / args.count, dicts / float(models)))
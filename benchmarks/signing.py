@@ -0,0 +1,111 @@
+import json
+import hmac
+import hashlib
+import timeit
+import os.path
+import argparse
+try:
+    from instagram_private_api.compat import compat_urllib_parse
+    from instagram_private_api.constants import Constants
+    from instagram_private_api.http import SignedBodyEncoder
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from instagram_private_api.compat import compat_urllib_parse
+    from instagram_private_api.constants import Constants
+    from instagram_private_api.http import SignedBodyEncoder
+
+
+def authenticated_params():
+    return {
+        '_csrftoken': 'a4bd6b0e1a1a6e3b4f1cdaa4cfd82ad5',
+        '_uuid': '6b2f1a5e-8e3c-4d4b-9c6a-2b5e1f0d9a7c',
+        '_uid': '2958144170',
+    }
+
+
+def payloads():
+    """Request params roughly the size of what the app sends for common write calls"""
+    like = authenticated_params()
+    like.update({'media_id': '1470654893538426156_25025320'})
+
+    comment = authenticated_params()
+    comment.update({
+        'comment_text': 'Such a lovely shot, where was this taken? ' * 8,
+        'user_breadcrumb': 'NWY4YjY1ZTQ3ZGFhYjg1OGE2MTc0MzA3N2UwYzMxNmI0OTI1YzU2YjAwMWQ=\nMjcgMTgyMjEgMSAxNDkw\n',
+        'idempotence_token': 'c4b8e5a0-7c5b-4b5a-9b0f-1b6f6f3b3c2d',
+        'containermodule': 'comments_feed_timeline',
+        'radio_type': 'wifi-none',
+    })
+
+    configure = authenticated_params()
+    configure.update({
+        'caption': 'Weekend in the mountains #travel #nature #hiking ' * 6,
+        'media_folder': 'Instagram',
+        'source_type': '4',
+        'upload_id': '1490874237591',
+        'device': {
+            'manufacturer': Constants.PHONE_MANUFACTURER,
+            'model': Constants.PHONE_DEVICE,
+            'android_version': Constants.ANDROID_VERSION,
+            'android_release': Constants.ANDROID_RELEASE,
+        },
+        'edits': {'crop_original_size': [1080.0, 1080.0], 'crop_center': [0.0, -0.0], 'crop_zoom': 1.0},
+        'extra': {'source_width': 1080, 'source_height': 1080},
+    })
+
+    sidecar = authenticated_params()
+    sidecar.update({
+        'caption': configure['caption'],
+        'client_sidecar_id': '1490874237591',
+        'children_metadata': [
+            dict(configure, upload_id=str(1490874237591 + i), caption='')
+            for i in range(10)],
+    })
+    return [('like', like), ('comment', comment), ('configure', configure), ('sidecar', sidecar)]
+
+
+def legacy_encode(signature_key, key_version, params):
+    json_params = json.dumps(params, separators=(',', ':'))
+    hash_sig = hmac.new(
+        signature_key.encode('ascii'), json_params.encode('ascii'),
+        digestmod=hashlib.sha256).hexdigest()
+    post_params = {
+        'ig_sig_key_version': key_version,
+        'signed_body': hash_sig + '.' + json_params
+    }
+    return compat_urllib_parse.urlencode(post_params).encode('ascii')
+
+
+if __name__ == '__main__':
+
+    # Example command:
+    #   python benchmarks/signing.py -n 20000
+    parser = argparse.ArgumentParser(description='Benchmark signed body encoding')
+    parser.add_argument('-n', '--number', dest='number', type=int, default=10000)
+    parser.add_argument('-batch', '--batch', dest='batch', type=int, default=100)
+    args = parser.parse_args()
+
+    encoder = SignedBodyEncoder(Constants.IG_SIG_KEY, Constants.SIG_KEY_VERSION)
+
+    print('%-10s %8s %12s %12s %8s' % ('payload', 'bytes', 'legacy us', 'encoder us', 'speedup'))
+    for name, params in payloads():
+        assert legacy_encode(Constants.IG_SIG_KEY, Constants.SIG_KEY_VERSION, params) == encoder.encode(params)
+        legacy = timeit.timeit(
+            lambda: legacy_encode(Constants.IG_SIG_KEY, Constants.SIG_KEY_VERSION, params),
+            number=args.number)
+        current = timeit.timeit(lambda: encoder.encode(params), number=args.number)
+        print('%-10s %8d %12.2f %12.2f %7.2fx' % (
+            name, len(encoder.encode(params)),
+            legacy * 1e6 / args.number, current * 1e6 / args.number, legacy / current))
+
+    batch = [params for _, params in payloads()] * max(1, args.batch // 4)
+    rounds = max(1, args.number // len(batch))
+    legacy = timeit.timeit(
+        lambda: [legacy_encode(Constants.IG_SIG_KEY, Constants.SIG_KEY_VERSION, p) for p in batch],
+        number=rounds)
+    current = timeit.timeit(lambda: encoder.encode_many(batch), number=rounds)
+    # batch row: size of the batch, then per-payload timings
+    print('%-10s %8d %12.2f %12.2f %7.2fx' % (
+        'batch', len(batch),
+        legacy * 1e6 / (rounds * len(batch)), current * 1e6 / (rounds * len(batch)), legacy / current))
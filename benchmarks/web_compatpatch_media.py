@@ -0,0 +1,51 @@
+import json
+import timeit
+import os.path
+import argparse
+try:
+    from instagram_web_api.compatpatch import ClientCompatPatch
+except ImportError:
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from instagram_web_api.compatpatch import ClientCompatPatch
+
+
+def _media(i):
+    display_src = (
+        'https://scontent.cdninstagram.com/t51.2885-15/s1080x1080/e35/%d_n.jpg' % i if i % 2 else
+        'https://scontent.cdninstagram.com/t51.2885-15/e35/%d_n.jpg' % i)
+    return {
+        'id': str(1470654893538426156 + i),
+        'code': 'BRo0NV0jD%d' % i,
+        'date': 1489984000 + i,
+        'caption': 'caption %d' % i,
+        'owner': {'id': '25025320', 'username': 'instagram', 'full_name': 'Instagram',
+                  'profile_pic_url': 'https://scontent.cdninstagram.com/t51.2885-19/s150x150/a.jpg'},
+        'is_video': False,
+        'display_src': display_src,
+        'thumbnail_src': display_src,
+        'dimensions': {'width': 1080, 'height': 1080},
+        'likes': {'count': i},
+        'comments': {'count': i % 10},
+    }
+
+
+if __name__ == '__main__':
+
+    # Example command:
+    #   python benchmarks/web_compatpatch_media.py -n 5000
+    parser = argparse.ArgumentParser(description='Benchmark the web api ClientCompatPatch.media')
+    parser.add_argument('-n', '--count', dest='count', type=int, default=2000)
+    parser.add_argument('-r', '--rounds', dest='rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    raw = json.dumps([_media(i) for i in range(args.count)])
+    print('items: %d' % args.count)
+    for name, clear_cache in (('media (new urls)', True), ('media (seen urls)', False)):
+        timings = []
+        for _ in range(args.rounds):
+            items = json.loads(raw)
+            if clear_cache:
+                ClientCompatPatch._image_urls.clear()
+            timings.append(timeit.timeit(lambda: [ClientCompatPatch.media(m) for m in items], number=1))
+        print('%-22s %10.2f ms' % (name, min(timings) * 1e3))
@@ -1,13 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import hmac
 import hashlib
 import uuid
 import json
 import re
 import time
 import random
+import socket
+import threading
 from datetime import datetime
 import gzip
 from io import BytesIO
@@ -19,7 +20,9 @@ from .errors import (
     ClientErrorCodes, ClientError, ClientLoginError, ClientLoginRequiredError,
     ClientCookieExpiredError, ClientThrottledError)
 from .constants import Constants
-from .http import ClientCookieJar
+from .http import ClientCookieJar, SignedBodyEncoder
+from .compatpatch import ClientCompatPatch, Projection
+from .models import IdentityMap
 from .endpoints import (
     AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
     FriendshipsEndpointsMixin, LiveEndpointsMixin, MediaEndpointsMixin,
@@ -43,6 +46,9 @@ class Client(AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
     IG_CAPABILITIES = Constants.IG_CAPABILITIES
     SIG_KEY_VERSION = Constants.SIG_KEY_VERSION
 
+    # Post-login calls made by the app, used for the optional session warmup
+    WARMUP_ENDPOINTS = ('sync', 'autocomplete_user_list', 'direct_v2_inbox')
+
     def __init__(self, username, password, **kwargs):
         """
 
@@ -53,22 +59,44 @@ class Client(AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
         :Keyword Arguments:
             - **auto_patch**: Patch the api objects to match the public API. Default: False
             - **drop_incompat_key**: Remove api object keys that is not in the public API. Default: False
+            - **lazy_patch**: With **auto_patch**, return media, comments and users as
+              :class:`compatpatch.CompatPatchView` objects that compute the public API keys only
+              when they are accessed. **drop_incompat_keys** does not apply to these. Default: False
+            - **identity_map**: ``True`` or a :class:`models.IdentityMap` (to share it between clients).
+              Users in the responses are replaced by one shared dict per user pk. Cannot be used with
+              **auto_patch** and **drop_incompat_keys**, since the keys dropped from a shared user would
+              be missing everywhere else it appears. Default: None
             - **timeout**: Timeout interval in seconds. Default: 15
             - **api_url**: Override the default api url base
             - **cookie**: Saved cookie string from a previous session
             - **settings**: A dict of settings from a previous session
             - **on_login**: Callback after successful login
             - **proxy**: Specify a proxy ex: 'http://127.0.0.1:8888' (ALPHA)
+            - **lazy_login**: Do not login on init. Login is deferred until the first api call
+              or access to a session value such as :attr:`csrftoken`. Default: False
+            - **warmup**: After login, make the app's post-login calls (see :attr:`WARMUP_ENDPOINTS`)
+              concurrently in the background. Default: False
         :return:
         """
         self.username = username
         self.password = password
         self.auto_patch = kwargs.pop('auto_patch', False)
         self.drop_incompat_keys = kwargs.pop('drop_incompat_keys', False)
+        self.lazy_patch = kwargs.pop('lazy_patch', False)
+        self.identity_map = kwargs.pop('identity_map', None)
+        if self.identity_map is True:
+            self.identity_map = IdentityMap()
+        if self.identity_map is not None and self.auto_patch and self.drop_incompat_keys:
+            raise ValueError('identity_map cannot be used with auto_patch and drop_incompat_keys')
         self.api_url = kwargs.pop('api_url', None) or self.API_URL
         self.timeout = kwargs.pop('timeout', 15)
         self.on_login = kwargs.pop('on_login', None)
+        self.lazy_login = kwargs.pop('lazy_login', False)
+        self.warmup = kwargs.pop('warmup', False)
         self.logger = logger
+        self._login_pending = False
+        self._login_lock = threading.RLock()
+        self._login_thread = None
 
         user_settings = kwargs.pop('settings', None) or {}
         self.uuid = (
@@ -83,6 +111,7 @@ class Client(AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
         self.key_version = (
             kwargs.pop('key_version', None) or user_settings.get('key_version') or
             self.SIG_KEY_VERSION)
+        self._signer = None
         self.ig_capabilities = (
             kwargs.pop('ig_capabilities', None) or user_settings.get('ig_capabilities') or
             self.IG_CAPABILITIES)
@@ -128,6 +157,7 @@ class Client(AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
 
         proxy_handler = None
         proxy = kwargs.pop('proxy', None)
+        self.proxy = proxy
         if proxy:
             warnings.warn('Proxy support is alpha.', UserWarning)
             parsed_url = compat_urllib_parse_urlparse(proxy)
@@ -159,7 +189,49 @@ class Client(AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
         if not cookie_string:   # [TODO] There's probably a better way than to depend on cookie_string
             if not self.username or not self.password:
                 raise ClientLoginRequiredError('login_required', code=400)
-            self.login()
+            if self.lazy_login:
+                self._login_pending = True
+            else:
+                self.login()
+
+    def _ensure_login(self):
+        """Complete a deferred login. Other threads wait until the login has completed."""
+        if not self._login_pending or self._login_thread is threading.current_thread():
+            # login() itself makes requests and reads cookies
+            return
+        with self._login_lock:
+            if self._login_pending:
+                self.login()
+
+    def login(self):
+        """Login. With **lazy_login**, this also completes the deferred login."""
+        with self._login_lock:
+            login_thread, self._login_thread = self._login_thread, threading.current_thread()
+            try:
+                super(Client, self).login()
+                self._login_pending = False
+            finally:
+                self._login_thread = login_thread
+
+    def _warmup(self):
+        """
+        Make the post-login calls in :attr:`WARMUP_ENDPOINTS` concurrently in background threads
+
+        :return: list of started threads
+        """
+        threads = []
+        for endpoint in self.WARMUP_ENDPOINTS:
+            thread = threading.Thread(target=self._warmup_call, args=(endpoint, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _warmup_call(self, endpoint):
+        try:
+            getattr(self, endpoint)()
+        except (ClientError, compat_urllib_error.URLError, socket.error) as e:
+            self.logger.warning('Warmup call %s failed: %s' % (endpoint, e))
 
     @property
     def settings(self):
@@ -272,6 +344,7 @@ class Client(AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
         }
 
     def get_cookie_value(self, key):
+        self._ensure_login()
         for cookie in self.cookie_jar:
             if cookie.name.lower() == key.lower():
                 return cookie.value
@@ -339,10 +412,18 @@ class Client(AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
             'X-IG-Connection-Speed': '%dkbps' % random.randint(1000, 5000),
         }
 
+    @property
+    def signer(self):
+        """The :class:`SignedBodyEncoder` for the current signature key and version."""
+        signer = self._signer
+        if (not signer or signer.signature_key != self.signature_key or
+                signer.key_version != self.key_version):
+            signer = SignedBodyEncoder(self.signature_key, self.key_version)
+            self._signer = signer
+        return signer
+
     def _generate_signature(self, input):
-        return hmac.new(
-            self.signature_key.encode('ascii'), input.encode('ascii'),
-            digestmod=hashlib.sha256).hexdigest()
+        return self.signer.signature(input)
 
     @classmethod
     def generate_uuid(cls, return_hex=False, seed=None):
@@ -381,7 +462,28 @@ class Client(AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
             res = response.read().decode('utf8')
         return res
 
+    def _object_hook(self):
+        """The json ``object_hook`` for the lazy_patch and identity_map options, if any"""
+        lazy = self.auto_patch and self.lazy_patch
+        if self.identity_map is None:
+            return ClientCompatPatch.lazy_hook if lazy else None
+        if not lazy:
+            return self.identity_map.hook
+        lazy_hook = ClientCompatPatch.lazy_hook
+        identity_hook = self.identity_map.hook
+
+        def hook(obj):
+            return identity_hook(lazy_hook(obj))
+        return hook
+
     def _call_api(self, endpoint, params=None, query=None, return_response=False, unsigned=False):
+        self._ensure_login()
+        # endpoints pass their kwargs on in the query or params, so a projection arrives here
+        projection = None
+        if query and 'projection' in query:
+            projection = Projection.of(query.pop('projection'))
+        elif isinstance(params, dict) and 'projection' in params:
+            projection = Projection.of(params.pop('projection'))
         url = self.api_url + endpoint
         if query:
             url += ('?' if '?' not in endpoint else '&') + compat_urllib_parse.urlencode(query)
@@ -392,18 +494,11 @@ class Client(AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
             headers['Content-type'] = 'application/x-www-form-urlencoded; charset=UTF-8'
             if params == '':    # force post if empty string
                 data = ''.encode('ascii')
+            elif not unsigned:
+                data = self.signer.encode(params)
             else:
-                if not unsigned:
-                    json_params = json.dumps(params, separators=(',', ':'))
-                    hash_sig = self._generate_signature(json_params)
-                    post_params = {
-                        'ig_sig_key_version': self.key_version,
-                        'signed_body': hash_sig + '.' + json_params
-                    }
-                else:
-                    # direct form post
-                    post_params = params
-                data = compat_urllib_parse.urlencode(post_params).encode('ascii')
+                # direct form post
+                data = compat_urllib_parse.urlencode(params).encode('ascii')
 
         req = compat_urllib_request.Request(url, data, headers=headers)
         try:
@@ -438,7 +533,7 @@ class Client(AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
 
         response_content = self._read_response(response)
         self.logger.debug('RESPONSE: %d %s' % (response.code, response_content))
-        json_response = json.loads(response_content)
+        json_response = json.loads(response_content, object_hook=self._object_hook())
 
         if json_response.get('message', '') == 'login_required':
             raise ClientLoginRequiredError(
@@ -451,4 +546,6 @@ class Client(AccountsEndpointsMixin, DiscoverEndpointsMixin, FeedEndpointsMixin,
                 json_response.get('message', 'Unknown error'),
                 error_response=json.dumps(json_response))
 
+        if projection is not None:
+            projection.apply(json_response)
         return json_response
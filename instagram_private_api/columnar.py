@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Collect paginated results into typed columns instead of lists of dicts.
+
+.. code-block:: python
+
+    from instagram_private_api.columnar import ColumnarCollector, USER_COLUMNS
+    from instagram_private_api.pagination import Paginator
+
+    followers = ColumnarCollector(USER_COLUMNS)
+    followers.consume(Paginator(api.user_followers, user_id), key='users')
+    columns = followers.to_numpy()     # or followers.to_arrow()
+    columns['is_private'].sum()
+"""
+from array import array
+
+try:
+    array('q')
+    INT64 = 'q'
+except ValueError:  # Python 2
+    INT64 = 'l'
+
+# column type -> array typecode
+TYPECODES = {
+    'int64': INT64,
+    'timestamp': INT64,     # unix time in seconds
+    'float64': 'd',
+    'bool': 'b',
+    'str': 'i',             # index into the column's string table
+}
+
+# stored for missing values
+NULLS = {
+    'int64': -1,
+    'timestamp': -1,
+    'float64': float('nan'),
+    'bool': -1,
+    'str': -1,
+}
+
+USER_COLUMNS = (
+    ('pk', 'pk|id', 'int64'),
+    ('username', 'username', 'str'),
+    ('full_name', 'full_name', 'str'),
+    ('is_private', 'is_private', 'bool'),
+    ('is_verified', 'is_verified', 'bool'),
+)
+
+MEDIA_COLUMNS = (
+    ('pk', 'pk', 'int64'),
+    ('code', 'code', 'str'),
+    ('media_type', 'media_type', 'int64'),
+    ('taken_at', 'taken_at|created_time', 'timestamp'),
+    ('like_count', 'like_count|likes.count', 'int64'),
+    ('comment_count', 'comment_count|comments.count', 'int64'),
+    ('user_pk', 'user.pk|user.id', 'int64'),
+    ('username', 'user.username', 'str'),
+)
+
+
+def _getter(path):
+    """Compile a dotted path, with ``|`` separated alternatives, into a value getter"""
+    alternatives = [alternative.split('.') for alternative in path.split('|')]
+
+    def get(obj):
+        for parts in alternatives:
+            value = obj
+            for part in parts:
+                if not isinstance(value, dict):
+                    value = None
+                    break
+                value = value.get(part)
+            if value is not None:
+                return value
+        return None
+    return get
+
+
+class StringTable(object):
+    """Interned strings for a column, stored as indices"""
+
+    def __init__(self):
+        self.strings = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def index(self, value):
+        i = self._index.get(value)
+        if i is None:
+            i = self._index[value] = len(self.strings)
+            self.strings.append(value)
+        return i
+
+
+class ColumnarCollector(object):
+    """
+    Append api objects into growable typed arrays (``array.array``), one per column.
+    String columns are stored as int32 indices into a per-column :class:`StringTable`.
+    Missing values are stored as :data:`NULLS` (-1, or NaN for floats).
+
+    :meth:`to_numpy` and :meth:`to_arrow` share the array buffers instead of copying them
+    (except for the arrow ``bool`` columns).
+    A column cannot grow while a view of it is alive, so appending after a handoff can raise
+    ``BufferError``: collect first, then hand off.
+    """
+
+    def __init__(self, columns):
+        """
+        :param columns: list of ``(name, path, type)``. path is a dotted path into the object,
+            with ``|`` separated alternatives (e.g. for raw and patched objects). type is one of
+            ``int64``, ``timestamp``, ``float64``, ``bool`` or ``str``.
+        """
+        self.columns = tuple(columns)
+        self._arrays = {}
+        self._tables = {}
+        self._appenders = []
+        for name, path, column_type in self.columns:
+            if column_type not in TYPECODES:
+                raise ValueError('Unknown column type for %s: %s' % (name, column_type))
+            column = self._arrays[name] = array(TYPECODES[column_type])
+            table = self._tables[name] = StringTable() if column_type == 'str' else None
+            self._appenders.append(
+                (_getter(path), column.append, self._converter(column_type, table), NULLS[column_type]))
+        self._count = 0
+
+    @staticmethod
+    def _converter(column_type, table):
+        if column_type == 'str':
+            return table.index
+        if column_type in ('int64', 'timestamp'):
+            return int
+        if column_type == 'float64':
+            return float
+        return lambda value: 1 if value else 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, obj):
+        """Append one object"""
+        for get, append, convert, null in self._appenders:
+            value = get(obj)
+            append(null if value is None else convert(value))
+        self._count += 1
+
+    def extend(self, objs):
+        """Append a list of objects"""
+        for obj in objs:
+            self.append(obj)
+
+    def consume(self, pages, key=None):
+        """
+        Append the items of every page
+
+        :param pages: iterable of pages, for example a :class:`pagination.Paginator`
+        :param key: key of the page's items list. Default: the items of a :class:`pagination.Paginator`
+        :return: the number of objects appended
+        """
+        count = self._count
+        if key is None and hasattr(pages, 'items'):
+            self.extend(pages.items())
+        else:
+            for page in pages:
+                self.extend(page.get(key or 'items', []))
+        return self._count - count
+
+    def column(self, name):
+        """The ``array.array`` for a column"""
+        return self._arrays[name]
+
+    def strings(self, name):
+        """The string table (list) that a ``str`` column's indices refer to"""
+        return self._tables[name].strings
+
+    def decode(self, name):
+        """A ``str`` column as a list of strings (None for missing)"""
+        strings = self._tables[name].strings
+        return [strings[i] if i >= 0 else None for i in self._arrays[name]]
+
+    def to_numpy(self):
+        """
+        Get the columns as numpy arrays that share the collector's buffers.
+        ``str`` columns are int32 indices, see :meth:`strings`.
+
+        :return: dict of name -> ``numpy.ndarray``
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError('to_numpy() requires numpy')
+
+        dtypes = {'int64': numpy.int64, 'timestamp': numpy.int64, 'float64': numpy.float64,
+                  'bool': numpy.int8, 'str': numpy.int32}
+        return dict(
+            (name, numpy.frombuffer(self._arrays[name], dtype=dtypes[column_type]))
+            for name, _, column_type in self.columns)
+
+    def to_arrow(self):
+        """
+        Get the columns as a ``pyarrow.Table``. Its value buffers are the collector's buffers,
+        with a validity bitmap for the missing values, except for ``bool`` columns, which are
+        converted to arrow's bit-packed booleans. ``str`` columns become dictionary arrays
+        over the string table.
+
+        :return: ``pyarrow.Table``
+        """
+        try:
+            import pyarrow
+            import pyarrow.compute
+        except ImportError:
+            raise ImportError('to_arrow() requires pyarrow')
+
+        storage_types = {'int64': pyarrow.int64(), 'timestamp': pyarrow.int64(),
+                         'float64': pyarrow.float64(), 'bool': pyarrow.int8(), 'str': pyarrow.int32()}
+        arrays = []
+        for name, _, column_type in self.columns:
+            column = self._arrays[name]
+            buffer = pyarrow.py_buffer(column)
+            values = pyarrow.Array.from_buffers(storage_types[column_type], len(column), [None, buffer])
+            if column_type == 'float64':
+                valid = pyarrow.compute.invert(pyarrow.compute.is_nan(values))
+            else:
+                valid = pyarrow.compute.not_equal(values, pyarrow.scalar(NULLS[column_type], type=values.type))
+            validity = None if valid.true_count == len(column) else valid.buffers()[1]
+            if column_type == 'str':
+                values = pyarrow.DictionaryArray.from_arrays(
+                    pyarrow.Array.from_buffers(pyarrow.int32(), len(column), [validity, buffer]),
+                    pyarrow.array(self._tables[name].strings, type=pyarrow.string()))
+            elif column_type == 'bool':
+                flags = pyarrow.compute.not_equal(values, pyarrow.scalar(0, type=pyarrow.int8()))
+                values = pyarrow.Array.from_buffers(pyarrow.bool_(), len(column), [validity, flags.buffers()[1]])
+            elif column_type == 'timestamp':
+                values = pyarrow.Array.from_buffers(pyarrow.timestamp('s'), len(column), [validity, buffer])
+            else:
+                values = pyarrow.Array.from_buffers(values.type, len(column), [validity, buffer])
+            arrays.append(values)
+        return pyarrow.Table.from_arrays(arrays, names=[name for name, _, _ in self.columns])
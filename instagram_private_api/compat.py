@@ -32,3 +32,13 @@ try:
     import cPickle as compat_pickle
 except ImportError:
     import pickle as compat_pickle
+
+try:
+    from sys import intern as compat_intern
+except ImportError:  # Python 2
+    compat_intern = intern  # noqa: F821
+
+try:
+    compat_text_type = unicode  # noqa: F821
+except NameError:  # Python 3
+    compat_text_type = str
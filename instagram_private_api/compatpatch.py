@@ -1,7 +1,280 @@
 # -*- coding: utf-8 -*-
+import multiprocessing
+from bisect import bisect_left
 
 
-class ClientCompatPatch():
+class CandidateIndex(object):
+    """
+    Resolution index over a media's ``image_versions2.candidates`` or ``video_versions``,
+    built once and shared by all the size lookups for that media.
+
+    .. code-block:: python
+
+        index = ClientCompatPatch.candidate_index(media, video=True)
+        index.closest(640)
+        index.best(max_pixels=480 * 480)
+        index.best(max_bandwidth=500000)
+    """
+    # Used to estimate a variant's bandwidth (bits/s) if the payload does not include it
+    BITS_PER_PIXEL = 2.0
+
+    def __init__(self, candidates):
+        """
+        :param candidates: list of image/video objects with ``width`` and ``height``
+        """
+        self.candidates = candidates or []
+        by_width = {}
+        for position, candidate in enumerate(self.candidates):
+            by_width.setdefault(candidate['width'], []).append(position)
+        self._by_width = by_width
+        self.widths = sorted(by_width)
+        # smallest to largest
+        self.variants = sorted(
+            self.candidates, key=lambda c: (c['width'] * c['height'], c['width']))
+        self._closest = {}
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def closest(self, width, height=0):
+        """
+        Get the candidate nearest to the width (and height), with the same
+        result as :meth:`ClientCompatPatch._get_closest_size`
+
+        :param width: desired width
+        :param height: desired height
+        :return:
+        """
+        key = (width, height)
+        if key in self._closest:
+            return self._closest[key]
+
+        widths = self.widths
+        current = None
+        if widths:
+            i = bisect_left(widths, width)
+            if i == len(widths) or (i > 0 and widths[i] != width and width - widths[i - 1] <= widths[i] - width):
+                i -= 1
+            positions = self._by_width[widths[i]]
+            if i + 1 < len(widths) and widths[i + 1] - width == width - widths[i]:
+                # equidistant widths either side, the first one seen wins
+                positions = sorted(positions + self._by_width[widths[i + 1]])
+            current = self.candidates[positions[0]]
+            for position in positions[1:]:
+                media = self.candidates[position]
+                if (media['width'] == current['width'] and (
+                        abs(media['height'] - height) < abs(current['height'] - height) if height
+                        else not media['height'] == current['width'])):
+                    current = media
+
+        self._closest[key] = current
+        return current
+
+    @classmethod
+    def bandwidth(cls, candidate):
+        """Bandwidth in bits/s, from the payload if available or else estimated from the pixel count"""
+        return candidate.get('bandwidth') or candidate['width'] * candidate['height'] * cls.BITS_PER_PIXEL
+
+    def best(self, max_pixels=None, max_bandwidth=None):
+        """
+        Get the largest variant within the budget, or the smallest variant if none fits
+
+        :param max_pixels: maximum width x height
+        :param max_bandwidth: maximum bandwidth in bits/s, see :meth:`bandwidth`
+        :return:
+        """
+        for candidate in reversed(self.variants):
+            if max_pixels is not None and candidate['width'] * candidate['height'] > max_pixels:
+                continue
+            if max_bandwidth is not None and self.bandwidth(candidate) > max_bandwidth:
+                continue
+            return candidate
+        return self.variants[0] if self.variants else None
+
+
+class Projection(object):
+    """
+    Keep (``include``) or remove (``exclude``) dotted key paths in an api response, in place.
+    Lists are traversed transparently and ``*`` matches any key.
+
+    Endpoints that pass their kwargs on to the request accept a ``projection`` (a :class:`Projection`
+    or a list of paths to include), which is applied to the response right after it is decoded.
+    This is before any ``auto_patch``, which then only adds the public API keys that can be
+    derived from the keys that were kept, e.g. ``id`` from ``pk``.
+
+    .. code-block:: python
+
+        # keep only the pk and username of each follower (and the pagination keys)
+        projection = Projection(['users.pk', 'users.username'])
+        api.user_followers(user_id, projection=projection)
+
+        # drop the image candidates from each item
+        api.feed_tag('cats', projection=Projection(exclude=['items.image_versions2']))
+    """
+    # top-level keys kept by an include projection so that pagination still works
+    ROOT_KEYS = (
+        'status', 'message', 'more_available', 'next_max_id', 'max_id',
+        'big_list', 'page_size', 'num_results', 'auto_load_more_enabled')
+
+    def __init__(self, include=None, exclude=None, root_keys=None):
+        """
+        :param include: list of paths to keep, everything else is removed
+        :param exclude: list of paths to remove
+        :param root_keys: top-level keys always kept with ``include``. Default: :attr:`ROOT_KEYS`
+        """
+        self.include = self._compile(include) if include is not None else None
+        self.exclude = self._compile_exclude(self._compile(exclude)) if exclude else None
+        if self.include is not None:
+            for key in (self.ROOT_KEYS if root_keys is None else root_keys):
+                self.include.setdefault(key, True)
+
+    @classmethod
+    def of(cls, spec):
+        """Get a :class:`Projection` from a projection or a list of paths to include"""
+        if spec is None or isinstance(spec, Projection):
+            return spec
+        return cls(include=spec)
+
+    @staticmethod
+    def _compile(paths):
+        tree = {}
+        for path in paths:
+            node = tree
+            parts = path.split('.')
+            for part in parts[:-1]:
+                child = node.setdefault(part, {})
+                if child is True:
+                    break
+                node = child
+            else:
+                node[parts[-1]] = True
+        return tree
+
+    @classmethod
+    def _compile_exclude(cls, tree):
+        # (keys to remove, ((key, nested node), ...), node for any key / True to clear)
+        wildcard = tree.pop('*', None)
+        return (
+            tuple(k for k, v in tree.items() if v is True),
+            tuple((k, cls._compile_exclude(v)) for k, v in tree.items() if v is not True),
+            cls._compile_exclude(wildcard) if isinstance(wildcard, dict) else wildcard,
+        )
+
+    def apply(self, obj):
+        """
+        Apply the projection to obj in place
+
+        :param obj: dict or list
+        :return: obj
+        """
+        if self.include is not None:
+            self._include(obj, self.include)
+        if self.exclude is not None:
+            self._exclude(obj, self.exclude)
+        return obj
+
+    def _include(self, obj, tree):
+        if isinstance(obj, list):
+            for o in obj:
+                self._include(o, tree)
+            return
+        if not isinstance(obj, dict):
+            return
+        wildcard = tree.get('*')
+        for key in list(obj.keys()):
+            sub_tree = tree.get(key, wildcard)
+            if sub_tree is None:
+                del obj[key]
+            elif sub_tree is not True:
+                self._include(obj[key], sub_tree)
+
+    def _exclude(self, obj, node):
+        if isinstance(obj, list):
+            for o in obj:
+                self._exclude(o, node)
+            return
+        if not isinstance(obj, dict):
+            return
+        keys, nested, wildcard = node
+        pop = obj.pop
+        for key in keys:
+            pop(key, None)
+        for key, sub_node in nested:
+            value = obj.get(key)
+            if value:
+                self._exclude(value, sub_node)
+        if wildcard is True:
+            obj.clear()
+        elif wildcard is not None:
+            for value in list(obj.values()):
+                self._exclude(value, wildcard)
+
+
+class BatchPatchMixin(object):
+    """
+    Batch patching for the app and web API ``ClientCompatPatch`` classes,
+    which provide the ``media()`` and ``comment()`` patches
+    """
+
+    # Objects per batch for media_many() and comment_many()
+    BATCH_SIZE = 500
+
+    @classmethod
+    def _patch_many(cls, patch, objs, drop_incompat_keys, processes, pool, batch_size):
+        objs = list(objs)
+        batch_size = batch_size or cls.BATCH_SIZE
+        if (pool is None and (processes or 0) <= 1) or len(objs) <= batch_size:
+            return _patch_batch((cls, patch, objs, drop_incompat_keys))
+        batches = [
+            (cls, patch, objs[i:i + batch_size], drop_incompat_keys)
+            for i in range(0, len(objs), batch_size)]
+        if pool is not None:
+            results = pool.map(_patch_batch, batches)
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_patch_batch, batches)
+                pool.close()
+            finally:
+                pool.terminate()
+        # the workers patched copies, so update the originals with them
+        patched = [obj for batch in results for obj in batch]
+        for obj, patched_obj in zip(objs, patched):
+            obj.clear()
+            obj.update(patched_obj)
+        return objs
+
+    @classmethod
+    def media_many(cls, medias, drop_incompat_keys=False, processes=None, pool=None, batch_size=None):
+        """
+        Patch a list of media objects in place, like :meth:`media`.
+        The objects are patched in place whether or not they are sent to worker
+        processes, so the results are the same objects, in the same order.
+
+        :param medias: list of media objects
+        :param drop_incompat_keys:
+        :param processes: Spread the batches across this many worker processes
+        :param pool: Use an existing pool instead, e.g. a :class:`multiprocessing.pool.Pool`
+        :param batch_size: Objects per batch. Default: :attr:`BATCH_SIZE`. Lists that fit in
+            one batch are always patched in the current process.
+        :return: list of patched media
+        """
+        return cls._patch_many('media', medias, drop_incompat_keys, processes, pool, batch_size)
+
+    @classmethod
+    def comment_many(cls, comments, drop_incompat_keys=False, processes=None, pool=None, batch_size=None):
+        """Patch a list of comment objects in place, see :meth:`media_many`"""
+        return cls._patch_many('comment', comments, drop_incompat_keys, processes, pool, batch_size)
+
+
+def _patch_batch(task):
+    # module level so that it can be sent to worker processes
+    patch_cls, patch, objs, drop_incompat_keys = task
+    patch = getattr(patch_cls, patch)
+    return [patch(obj, drop_incompat_keys) for obj in objs]
+
+
+class ClientCompatPatch(BatchPatchMixin):
     """Utility to make entities from the private api similar to the ones
     from the public one by adding the necessary properties, and if required,
     remove any incompatible properties (to save storage space for example).
@@ -64,17 +337,164 @@ class ClientCompatPatch():
         """
         current = None
         for media in medias:
-            if not current:
-                current = media
-            if (abs(media['width'] - width) < abs(current['width'] - width) or
-                    (media['width'] == current['width'] and not height and
-                     not media['height'] == current['width']) or
-                    (media['width'] == current['width'] and height and
+            media_width = media['width']
+            diff = abs(media_width - width)
+            if current is None:
+                current, current_width, current_diff = media, media_width, diff
+            elif (diff < current_diff or
+                    (media_width == current_width and not height and
+                     not media['height'] == current_width) or
+                    (media_width == current_width and height and
                      abs(media['height'] - height) < abs(current['height'] - height))):
-                current = media
+                current, current_width, current_diff = media, media_width, diff
 
         return current
 
+    MEDIA_TYPES = {
+        1: 'image',
+        2: 'video',
+        8: 'carousel',
+    }
+
+    COMMENT_INCOMPAT_KEYS = (
+        'bit_flags',
+        'content_type',
+        'created_at',
+        'created_at_utc',
+        'media_id',
+        'pk',
+        'status',
+        'type',
+        'user',
+        'user_id',
+    )
+
+    CAPTION_INCOMPAT_KEYS = (
+        'bit_flags',
+        'content_type',
+        'created_at',
+        'created_at_utc',
+        'has_translation',
+        'media_id',
+        'pk',
+        'status',
+        'type',
+        'user',
+    )
+
+    USERTAG_USER_INCOMPAT_KEYS = ('profile_pic_url', 'pk', 'is_private')
+
+    REEL_MENTION_USER_INCOMPAT_KEYS = ('profile_pic_id', 'profile_pic_url', 'pk', 'is_private')
+
+    MEDIA_INCOMPAT_KEYS = (
+        'caption_is_edited',
+        'client_cache_key',
+        'code',
+        'comment_count',
+        'comments_disabled'
+        'device_timestamp',
+        'filter_type',
+        'has_audio',
+        'has_liked',
+        'has_more_comments',
+        'image_versions2',
+        'is_reel_media',
+        'lat',
+        'like_count',
+        'lng',
+        'max_num_visible_preview_comments',
+        'media_type',
+        'next_max_id',
+        'organic_tracking_token',
+        'original_height',
+        'original_width',
+        'photo_of_you',
+        'pk',
+        'preview_comments',
+        'reel_mentions',
+        'taken_at',
+        'video_duration',
+        'video_versions',
+        'view_count',
+    )
+
+    LOCATION_INCOMPAT_KEYS = (
+        'address',
+        'city',
+        'external_id',
+        'external_source',
+        'facebook_places_id',
+        'foursquare_v2_id',
+        'lat',
+        'lng',
+        'pk',
+        'state',
+    )
+
+    USER_INCOMPAT_KEYS = (
+        'auto_expand_chaining',
+        'biography',
+        'external_lynx_url',
+        'external_url',
+        'follower_count',
+        'following_count',
+        'geo_media_count',
+        'has_anonymous_profile_picture',
+        'has_chaining',
+        'hd_profile_pic_url_info',
+        'hd_profile_pic_versions',
+        'include_direct_blacklist_status',
+        'is_business',
+        'is_favorite',
+        'is_private',
+        'is_unpublished',
+        'is_verified',
+        'media_count',
+        'pk',
+        'profile_context',
+        'profile_pic_id',
+        'profile_pic_url',
+        'usertags_count',
+    )
+
+    LIST_USER_INCOMPAT_KEYS = (
+        'byline',
+        'follower_count',
+        'friendship_status',
+        'has_anonymous_profile_picture',
+        'has_chaining',
+        'is_favorite',
+        'is_private',
+        'is_unpublished',
+        'is_verified',
+        'mutual_followers_count',
+        'pk',
+        'profile_pic_url',
+        'social_context',
+        'unseen_count',
+    )
+
+    # Compiled media patch plans, keyed by (class, shape, drop_incompat_keys)
+    _media_plans = {}
+
+    @classmethod
+    def lazy_hook(cls, obj):
+        """
+        ``object_hook`` for :func:`json.loads` that wraps media, comment and user
+        objects in lazily patched views instead of patching them in place
+
+        :param obj: decoded dict
+        :return:
+        """
+        if 'media_type' in obj and ('image_versions2' in obj or 'carousel_media' in obj):
+            return MediaView(obj)
+        if 'pk' in obj:
+            if 'created_at' in obj and 'text' in obj and 'user' in obj:
+                return CommentView(obj)
+            if 'username' in obj and 'profile_pic_url' in obj:
+                return UserView(obj)
+        return obj
+
     @classmethod
     def _drop_keys(cls, obj, keys):
         """
@@ -84,282 +504,352 @@ class ClientCompatPatch():
         :param keys:
         :return:
         """
+        pop = obj.pop
         for k in keys:
-            obj.pop(k, None)
+            pop(k, None)
 
     @classmethod
-    def comment(cls, comment, drop_incompat_keys=False):
-        """Patch a comment object"""
-        comment['created_time'] = str(int(comment.get('created_at')))
-        from_user = {
-            'username': comment['user']['username'],
-            'profile_picture': comment['user']['profile_pic_url'],
-            'id': str(comment['user']['pk']),
-            'full_name': comment['user']['full_name'],
+    def _from_user(cls, user):
+        """Public API style ``from`` object for a comment/caption user"""
+        pk = user.get('pk')
+        return {
+            'username': user.get('username'),
+            'profile_picture': user.get('profile_pic_url'),
+            'id': str(pk) if pk is not None else None,
+            'full_name': user.get('full_name'),
         }
-        comment['from'] = from_user
-        comment['id'] = str(comment['pk'])
+
+    @classmethod
+    def comment(cls, comment, drop_incompat_keys=False, inplace=True):
+        """Patch a comment object"""
+        if isinstance(comment, CompatPatchView):
+            return comment
+        if not inplace:
+            comment = dict(comment)
+        # a projection may have removed any of the keys
+        if 'created_at' in comment:
+            comment['created_time'] = str(int(comment['created_at']))
+        if 'user' in comment:
+            comment['from'] = cls._from_user(comment['user'])
+        if 'pk' in comment:
+            comment['id'] = str(comment['pk'])
         if drop_incompat_keys:
-            cls._drop_keys(
-                comment,
-                [
-                    'bit_flags',
-                    'content_type',
-                    'created_at',
-                    'created_at_utc',
-                    'media_id',
-                    'pk',
-                    'status',
-                    'type',
-                    'user',
-                    'user_id',
-                ]
-            )
+            cls._drop_keys(comment, cls.COMMENT_INCOMPAT_KEYS)
         return comment
 
     @classmethod
-    def media(cls, media, drop_incompat_keys=False):
-        """Patch a media object"""
-        media['link'] = 'https://www.instagram.com/p/%s/' % media['code']
-        media['created_time'] = str(int(media.get('taken_at') or media.get('device_timestamp')))
-
-        if media['media_type'] == 1:
-            media['type'] = 'image'
-        elif media['media_type'] == 2:
-            media['type'] = 'video'
-        elif media['media_type'] == 8:
-            media['type'] = 'carousel'  # will be patched over below
-
-        if media['caption']:
-            media['caption']['id'] = str(media['caption']['pk'])
-            media['caption']['created_time'] = str(int(media['caption']['created_at']))
-            caption_from = {
-                'username': media['caption']['user']['username'],
-                'profile_picture': media['caption']['user']['profile_pic_url'],
-                'id': str(media['caption']['user']['pk']),
-                'full_name': media['caption']['user']['full_name'],
+    def _images(cls, media, standard_width, index=None):
+        if index is not None:
+            return {
+                'low_resolution': index.closest(320),
+                'thumbnail': index.closest(150, 150),
+                'standard_resolution': index.closest(standard_width),
             }
-            media['caption']['from'] = caption_from
-            if drop_incompat_keys:
-                cls._drop_keys(
-                    media['caption'],
-                    [
-                        'bit_flags',
-                        'content_type',
-                        'created_at',
-                        'created_at_utc',
-                        'has_translation',
-                        'media_id',
-                        'pk',
-                        'status',
-                        'type',
-                        'user',
-                    ]
-                )
-        media['user'] = cls.list_user(media['user'], drop_incompat_keys=drop_incompat_keys)
-        if media['media_type'] == 8 and media.get('carousel_media', []):
-            # patch carousel media
-            for carousel_media in media.get('carousel_media', []):
-                if carousel_media['media_type'] == 1:
-                    carousel_media['type'] = 'image'
-                elif carousel_media['media_type'] == 2:
-                    carousel_media['type'] = 'video'
-                image_versions2 = carousel_media.get('image_versions2', {}).get('candidates', [])
-                images = {
-                    'low_resolution': cls._get_closest_size(image_versions2, 320),
-                    'thumbnail': cls._get_closest_size(image_versions2, 150, 150),
-                    'standard_resolution': cls._get_closest_size(image_versions2, media.get('original_width', 1000)),
-                }
-                carousel_media['images'] = images
-                if carousel_media['media_type'] == 2:
-                    video_versions = carousel_media.get('video_versions', [])
-                    videos = {
-                        'low_bandwidth': cls._get_closest_size(video_versions, 480),
-                        'standard_resolution': cls._get_closest_size(video_versions, media.get('original_width', 640)),
-                        'low_resolution': cls._get_closest_size(video_versions, 640),
-                    }
-                    if drop_incompat_keys:
-                        [cls._drop_keys(i, ['type']) for i in list(videos.values())]
-                    carousel_media['videos'] = videos
-
-                # patch user tags
-                if carousel_media.get('usertags', {}).get('in', []):
-                    usertags = carousel_media['usertags']['in']
-                    user_tags = []
-                    for ut in usertags:
-                        pos = {'y': ut['position'][1], 'x': ut['position'][0]}
-                        user = ut['user']
-                        user['id'] = str(ut['user']['pk'])
-                        user['profile_picture'] = ut['user']['profile_pic_url']
-                        if drop_incompat_keys:
-                            cls._drop_keys(user, ['profile_pic_url', 'pk', 'is_private'])
-
-                        user_tags.append({
-                            'position': pos,
-                            'user': user,
-                        })
-                    carousel_media['users_in_photo'] = user_tags
-                # patch location
-                if 'location' not in carousel_media or not carousel_media['location'].get('lat'):
-                    carousel_media['location'] = None
-                else:
-                    carousel_media['location']['latitude'] = carousel_media['location']['lat']
-                    carousel_media['location']['longitude'] = carousel_media['location']['lng']
-                    carousel_media['location']['id'] = carousel_media['location']['pk']
-
-            first_carousel_media = media['carousel_media'][0]
-            media['images'] = first_carousel_media['images']
-            media['type'] = first_carousel_media['type']
-            if first_carousel_media['media_type'] == 2:
-                media['videos'] = first_carousel_media['videos']
-        else:
-            image_versions2 = media.get('image_versions2', {}).get('candidates', [])
-            images = {
-                'low_resolution': cls._get_closest_size(image_versions2, 320),
-                'thumbnail': cls._get_closest_size(image_versions2, 150, 150),
-                'standard_resolution': cls._get_closest_size(image_versions2, media.get('original_width', 1000)),
-            }
-            media['images'] = images
+        image_versions2 = media.get('image_versions2', {}).get('candidates', [])
+        return {
+            'low_resolution': cls._get_closest_size(image_versions2, 320),
+            'thumbnail': cls._get_closest_size(image_versions2, 150, 150),
+            'standard_resolution': cls._get_closest_size(image_versions2, standard_width),
+        }
 
-        if media['media_type'] == 2:
+    @classmethod
+    def _videos(cls, media, standard_width, drop_incompat_keys=False, index=None):
+        if index is not None:
+            videos = {
+                'low_bandwidth': index.closest(480),
+                'standard_resolution': index.closest(standard_width),
+                'low_resolution': index.closest(640),
+            }
+        else:
             video_versions = media.get('video_versions', [])
             videos = {
                 'low_bandwidth': cls._get_closest_size(video_versions, 480),
-                'standard_resolution': cls._get_closest_size(video_versions, media.get('original_width', 640)),
+                'standard_resolution': cls._get_closest_size(video_versions, standard_width),
                 'low_resolution': cls._get_closest_size(video_versions, 640),
             }
+        if drop_incompat_keys:
+            for video in videos.values():
+                if video:
+                    video.pop('type', None)
+        return videos
+
+    @classmethod
+    def candidate_index(cls, media, video=False):
+        """
+        Get a :class:`CandidateIndex` for the media's image candidates or video versions.
+        For a carousel, the first carousel item is used. The index is kept on
+        :class:`MediaView` objects, so repeated lookups on a view reuse it.
+
+        :param media: raw or patched media object
+        :param video: index the video versions instead of the images
+        :return:
+        """
+        if media.get('media_type') == 8 and media.get('carousel_media'):
+            media = media['carousel_media'][0]
+        if isinstance(media, MediaView):
+            return media.candidate_index(video)
+        if video:
+            return CandidateIndex(media.get('video_versions', []))
+        return CandidateIndex(media.get('image_versions2', {}).get('candidates', []))
+
+    @classmethod
+    def best_variant(cls, media, max_pixels=None, max_bandwidth=None, video=False):
+        """
+        Get the largest image or video of a media within a pixel and/or bandwidth budget
+
+        :param media: raw or patched media object
+        :param max_pixels: maximum width x height
+        :param max_bandwidth: maximum bandwidth in bits/s, see :meth:`CandidateIndex.bandwidth`
+        :param video: choose from the video versions instead of the images
+        :return: the image/video object, or None if the media has none
+        """
+        return cls.candidate_index(media, video=video).best(max_pixels=max_pixels, max_bandwidth=max_bandwidth)
+
+    @classmethod
+    def _users_in_photo(cls, usertags, drop_keys=None):
+        user_tags = []
+        for ut in usertags:
+            user = ut['user']
+            user['id'] = str(user['pk'])
+            user['profile_picture'] = user['profile_pic_url']
+            if drop_keys:
+                cls._drop_keys(user, drop_keys)
+            user_tags.append({
+                'position': {'y': ut['position'][1], 'x': ut['position'][0]},
+                'user': user,
+            })
+        return user_tags
+
+    @classmethod
+    def _location(cls, location):
+        if not location or not location.get('lat'):
+            return None
+        location['latitude'] = location['lat']
+        location['longitude'] = location['lng']
+        location['id'] = location['pk']
+        return location
+
+    @classmethod
+    def _patch_media_base(cls, media, drop_incompat_keys):
+        # a projection may have removed any of the keys that the steps read
+        if 'code' in media:
+            media['link'] = 'https://www.instagram.com/p/%s/' % media['code']
+        timestamp = media.get('taken_at') or media.get('device_timestamp')
+        if timestamp:
+            media['created_time'] = str(int(timestamp))
+        media_type = cls.MEDIA_TYPES.get(media.get('media_type'))
+        if media_type:
+            media['type'] = media_type   # carousel will be patched over later
+
+    @classmethod
+    def _patch_media_caption(cls, media, drop_incompat_keys):
+        caption = media.get('caption')
+        if caption:
+            cls.comment(caption)
             if drop_incompat_keys:
-                [cls._drop_keys(i, ['type']) for i in list(videos.values())]
-            media['videos'] = videos
+                cls._drop_keys(caption, cls.CAPTION_INCOMPAT_KEYS)
+
+    @classmethod
+    def _patch_media_user(cls, media, drop_incompat_keys):
+        if 'user' in media:
+            media['user'] = cls.list_user(media['user'], drop_incompat_keys=drop_incompat_keys)
+
+    @classmethod
+    def _patch_media_carousel(cls, media, drop_incompat_keys):
+        standard_width = media.get('original_width', 1000)
+        standard_video_width = media.get('original_width', 640)
+        usertag_drop_keys = cls.USERTAG_USER_INCOMPAT_KEYS if drop_incompat_keys else None
+        for carousel_media in media['carousel_media']:
+            media_type = carousel_media.get('media_type')
+            if media_type == 1:
+                carousel_media['type'] = 'image'
+            elif media_type == 2:
+                carousel_media['type'] = 'video'
+            carousel_media['images'] = cls._images(carousel_media, standard_width)
+            if media_type == 2:
+                carousel_media['videos'] = cls._videos(carousel_media, standard_video_width, drop_incompat_keys)
 
-        likes = {
+            # patch user tags
+            usertags = carousel_media.get('usertags', {}).get('in', [])
+            if usertags:
+                carousel_media['users_in_photo'] = cls._users_in_photo(usertags, usertag_drop_keys)
+            # patch location
+            carousel_media['location'] = cls._location(carousel_media.get('location'))
+
+        first_carousel_media = media['carousel_media'][0]
+        media['images'] = first_carousel_media['images']
+        if 'type' in first_carousel_media:
+            media['type'] = first_carousel_media['type']
+        if first_carousel_media.get('media_type') == 2:
+            media['videos'] = first_carousel_media['videos']
+
+    @classmethod
+    def _patch_media_images(cls, media, drop_incompat_keys):
+        media['images'] = cls._images(media, media.get('original_width', 1000))
+
+    @classmethod
+    def _patch_media_videos(cls, media, drop_incompat_keys):
+        media['videos'] = cls._videos(media, media.get('original_width', 640), drop_incompat_keys)
+
+    @classmethod
+    def _patch_media_counts(cls, media, drop_incompat_keys):
+        media['likes'] = {
             'count': media.get('like_count', 0),
             'data': []
         }
-        media['likes'] = likes
-        comments = {
+        comment = cls.comment
+        media['comments'] = {
             'count': media.get('comment_count', 0),
             # Patch comment too
             'data': [
-                cls.comment(c, drop_incompat_keys=drop_incompat_keys)
+                comment(c, drop_incompat_keys=drop_incompat_keys)
                 for c in media.get('comments', [])
             ]
         }
-        media['comments'] = comments
-        if media.get('preview_comments'):
-            [
-                cls.comment(c, drop_incompat_keys=drop_incompat_keys)
-                for c in media.get('preview_comments', [])
-            ]
+        for c in media.get('preview_comments') or []:
+            comment(c, drop_incompat_keys=drop_incompat_keys)
 
+    @classmethod
+    def _patch_media_misc(cls, media, drop_incompat_keys):
         media['attribution'] = None
-        if media.get('filter_type') is not None and media.get('filter_type') in cls.FILTERS:
-            media['filter'] = cls.FILTERS[media.get('filter_type')]
+        filter_type = media.get('filter_type')
+        if filter_type is not None and filter_type in cls.FILTERS:
+            media['filter'] = cls.FILTERS[filter_type]
         else:
             media['filter'] = ''
         media['user_has_liked'] = media.get('has_liked', False)
-        if 'location' not in media or not media['location'].get('lat'):
-            media['location'] = None
-        else:
-            media['location']['latitude'] = media['location']['lat']
-            media['location']['longitude'] = media['location']['lng']
-            media['location']['id'] = media['location']['pk']
+        media['location'] = cls._location(media.get('location'))
 
+    @classmethod
+    def _patch_media_usertags(cls, media, drop_incompat_keys):
         media['tags'] = []
-        if media.get('usertags', {}).get('in', []):
-            usertags = media['usertags']['in']
-            user_tags = []
-            for ut in usertags:
-                pos = {'y': ut['position'][1], 'x': ut['position'][0]}
-                user = ut['user']
-                user['id'] = str(ut['user']['pk'])
-                user['profile_picture'] = ut['user']['profile_pic_url']
-                if drop_incompat_keys:
-                    cls._drop_keys(user, ['profile_pic_url', 'pk', 'is_private'])
-
-                user_tags.append({
-                    'position': pos,
-                    'user': user,
-                })
-            media['users_in_photo'] = user_tags
+        usertags = media.get('usertags', {}).get('in', [])
+        if usertags:
+            media['users_in_photo'] = cls._users_in_photo(
+                usertags, cls.USERTAG_USER_INCOMPAT_KEYS if drop_incompat_keys else None)
         elif media.get('reel_mentions'):
-            reel_mentions = media['reel_mentions']
             user_tags = []
-            for rm in reel_mentions:
-                pos = {'y': rm['y'], 'x': rm['x']}
+            for rm in media['reel_mentions']:
                 user = rm['user']
-                user['id'] = str(rm['user']['pk'])
-                user['profile_picture'] = rm['user']['profile_pic_url']
+                user['id'] = str(user['pk'])
+                user['profile_picture'] = user['profile_pic_url']
                 if drop_incompat_keys:
-                    cls._drop_keys(user, ['profile_pic_id', 'profile_pic_url', 'pk', 'is_private'])
+                    cls._drop_keys(user, cls.REEL_MENTION_USER_INCOMPAT_KEYS)
                 user_tags.append({
-                    'position': pos,
+                    'position': {'y': rm['y'], 'x': rm['x']},
                     'user': user,
                 })
             media['users_in_photo'] = user_tags
         else:
             media['users_in_photo'] = []
 
+    @classmethod
+    def _drop_media_keys(cls, media, drop_incompat_keys):
+        cls._drop_keys(media, cls.MEDIA_INCOMPAT_KEYS)
+        if media['location']:
+            cls._drop_keys(media['location'], cls.LOCATION_INCOMPAT_KEYS)
+
+    @classmethod
+    def _media_shape(cls, media):
+        media_type = media.get('media_type')
+        if media_type == 8 and media.get('carousel_media', []):
+            return 'carousel'
+        if media_type == 2:
+            return 'video'
+        return 'image'
+
+    @classmethod
+    def _compile_media_plan(cls, shape, drop_incompat_keys):
+        """
+        Build the list of patch steps for a media shape
+
+        :param shape: 'image', 'video' or 'carousel'
+        :param drop_incompat_keys:
+        :return: tuple of steps, each called as ``step(media, drop_incompat_keys)``
+        """
+        plan = [cls._patch_media_base, cls._patch_media_caption, cls._patch_media_user]
+        if shape == 'carousel':
+            plan.append(cls._patch_media_carousel)
+        else:
+            plan.append(cls._patch_media_images)
+        if shape == 'video':
+            plan.append(cls._patch_media_videos)
+        plan.extend([cls._patch_media_counts, cls._patch_media_misc, cls._patch_media_usertags])
         if drop_incompat_keys:
-            cls._drop_keys(
-                media,
-                [
-                    'caption_is_edited',
-                    'client_cache_key',
-                    'code',
-                    'comment_count',
-                    'comments_disabled'
-                    'device_timestamp',
-                    'filter_type',
-                    'has_audio',
-                    'has_liked',
-                    'has_more_comments',
-                    'image_versions2',
-                    'is_reel_media',
-                    'lat',
-                    'like_count',
-                    'lng',
-                    'max_num_visible_preview_comments',
-                    'media_type',
-                    'next_max_id',
-                    'organic_tracking_token',
-                    'original_height',
-                    'original_width',
-                    'photo_of_you',
-                    'pk',
-                    'preview_comments',
-                    'reel_mentions',
-                    'taken_at',
-                    'video_duration',
-                    'video_versions',
-                    'view_count',
-                ]
-            )
-            if media['location']:
-                cls._drop_keys(
-                    media['location'],
-                    [
-                        'address',
-                        'city',
-                        'external_id',
-                        'external_source',
-                        'facebook_places_id',
-                        'foursquare_v2_id',
-                        'lat',
-                        'lng',
-                        'pk',
-                        'state',
-                    ]
-                )
+            plan.append(cls._drop_media_keys)
+        return tuple(plan)
+
+    @classmethod
+    def _media_plan(cls, shape, drop_incompat_keys):
+        key = (cls, shape, bool(drop_incompat_keys))
+        plan = cls._media_plans.get(key)
+        if plan is None:
+            plan = cls._compile_media_plan(shape, bool(drop_incompat_keys))
+            cls._media_plans[key] = plan
+        return plan
+
+    @classmethod
+    def _copy_media(cls, media, drop_incompat_keys):
+        """
+        Shallow copy a media and the sub-objects that the patch steps write to,
+        so that the patch leaves the original untouched. Everything else,
+        e.g. the image candidates, stays shared with the original.
+        """
+        media = dict(media)
+        for key in ('caption', 'user', 'location'):
+            if media.get(key):
+                media[key] = dict(media[key])
+        for key in ('comments', 'preview_comments'):
+            if media.get(key):
+                media[key] = [dict(c) for c in media[key]]
+        if media.get('usertags', {}).get('in'):
+            usertags = media['usertags'] = dict(media['usertags'])
+            usertags['in'] = [dict(ut, user=dict(ut['user'])) for ut in usertags['in']]
+        if media.get('reel_mentions'):
+            media['reel_mentions'] = [dict(rm, user=dict(rm['user'])) for rm in media['reel_mentions']]
+        if drop_incompat_keys and media.get('video_versions'):
+            # _videos() removes the type from the chosen versions
+            media['video_versions'] = [dict(v) for v in media['video_versions']]
+        if media.get('carousel_media'):
+            media['carousel_media'] = [
+                cls._copy_media(carousel_media, drop_incompat_keys) for carousel_media in media['carousel_media']]
+        return media
+
+    @classmethod
+    def media(cls, media, drop_incompat_keys=False, inplace=True):
+        """
+        Patch a media object
+
+        :param media:
+        :param drop_incompat_keys:
+        :param inplace: If False, leave media unchanged and return a patched copy that
+            shares the unchanged sub-objects with it
+        :return:
+        """
+        if isinstance(media, CompatPatchView):
+            return media
+        if not inplace:
+            media = cls._copy_media(media, drop_incompat_keys)
+        for step in cls._media_plan(cls._media_shape(media), drop_incompat_keys):
+            step(media, drop_incompat_keys)
         return media
 
     @classmethod
-    def user(cls, user, drop_incompat_keys=False):
+    def user(cls, user, drop_incompat_keys=False, inplace=True):
         """Patch a user object """
-        user['id'] = str(user['pk'])
-        user['bio'] = user['biography']
-        user['profile_picture'] = user['profile_pic_url']
-        user['website'] = user['external_url']
+        if isinstance(user, CompatPatchView):
+            return user
+        if not inplace:
+            user = dict(user)
+        # a projection may have removed any of the keys
+        if 'pk' in user:
+            user['id'] = str(user['pk'])
+        if 'biography' in user:
+            user['bio'] = user['biography']
+        if 'profile_pic_url' in user:
+            user['profile_picture'] = user['profile_pic_url']
+        if 'external_url' in user:
+            user['website'] = user['external_url']
         if 'media_count' in user and 'follower_count' in user and 'following_count' in user:
             counts = {
                 'media': user['media_count'],
@@ -368,62 +858,289 @@ class ClientCompatPatch():
             }
             user['counts'] = counts
         if drop_incompat_keys:
-            cls._drop_keys(
-                user,
-                [
-                    'auto_expand_chaining',
-                    'biography',
-                    'external_lynx_url',
-                    'external_url',
-                    'follower_count',
-                    'following_count',
-                    'geo_media_count',
-                    'has_anonymous_profile_picture',
-                    'has_chaining',
-                    'hd_profile_pic_url_info',
-                    'hd_profile_pic_versions',
-                    'include_direct_blacklist_status',
-                    'is_business',
-                    'is_favorite',
-                    'is_private',
-                    'is_unpublished',
-                    'is_verified',
-                    'media_count',
-                    'pk',
-                    'profile_context',
-                    'profile_pic_id',
-                    'profile_pic_url',
-                    'usertags_count',
-                ]
-            )
+            cls._drop_keys(user, cls.USER_INCOMPAT_KEYS)
         return user
 
     @classmethod
-    def list_user(cls, user, drop_incompat_keys=False):
+    def list_user(cls, user, drop_incompat_keys=False, inplace=True):
         """
         Patch a list user object, example in
         :meth:`Client.user_following`, :meth:`Client.user_followers`, :meth:`Client.search_users`
         """
-        user['id'] = str(user['pk'])
-        user['profile_picture'] = user['profile_pic_url']
+        if isinstance(user, CompatPatchView):
+            return user
+        if not inplace:
+            user = dict(user)
+        # a projection may have removed any of the keys
+        if 'pk' in user:
+            user['id'] = str(user['pk'])
+        if 'profile_pic_url' in user:
+            user['profile_picture'] = user['profile_pic_url']
         if drop_incompat_keys:
-            cls._drop_keys(
-                user,
-                [
-                    'byline',
-                    'follower_count',
-                    'friendship_status',
-                    'has_anonymous_profile_picture',
-                    'has_chaining',
-                    'is_favorite',
-                    'is_private',
-                    'is_unpublished',
-                    'is_verified',
-                    'mutual_followers_count',
-                    'pk',
-                    'profile_pic_url',
-                    'social_context',
-                    'unseen_count',
-                ]
-            )
+            cls._drop_keys(user, cls.LIST_USER_INCOMPAT_KEYS)
         return user
+
+
+class CompatPatchView(dict):
+    """
+    A raw api object with the public API compatible keys computed on first
+    access (and then stored), instead of being patched in on receipt.
+
+    Lazy keys are available through ``[]``, :meth:`get` and ``in`` but do not show up
+    in ``keys()``, iteration or ``json.dumps()`` until they have been accessed.
+    Use :meth:`materialize` to compute all of them. Keys that already exist in the
+    raw object are patched on receipt instead, see :class:`MediaView`.
+    """
+    # lazy key -> name of the method that computes it, or returns NOT_APPLICABLE
+    LAZY_KEYS = {}
+    # keys that hold the views that are patched along with this one
+    NESTED_KEYS = ()
+    NOT_APPLICABLE = object()
+
+    def _compute(self, key):
+        value = getattr(self, self.LAZY_KEYS[key])()
+        if value is not self.NOT_APPLICABLE:
+            self[key] = value
+        return value
+
+    def __missing__(self, key):
+        if key not in self.LAZY_KEYS:
+            raise KeyError(key)
+        value = self._compute(key)
+        if value is self.NOT_APPLICABLE:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        if key not in self.LAZY_KEYS:
+            return default
+        value = self._compute(key)
+        return default if value is self.NOT_APPLICABLE else value
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        return key in self.LAZY_KEYS and self._compute(key) is not self.NOT_APPLICABLE
+
+    def materialize(self):
+        """Compute all the lazy keys, including those of the nested views in :attr:`NESTED_KEYS`"""
+        stack = [self]
+        while stack:
+            view = stack.pop()
+            for key in view.LAZY_KEYS:
+                if not dict.__contains__(view, key):
+                    view._compute(key)
+            for key in view.NESTED_KEYS:
+                value = dict.get(view, key)
+                if isinstance(value, dict) and not isinstance(value, CompatPatchView):
+                    # a patched collection, e.g. the media comments
+                    value = value.get('data')
+                if isinstance(value, CompatPatchView):
+                    stack.append(value)
+                elif isinstance(value, list):
+                    stack.extend([v for v in value if isinstance(v, CompatPatchView)])
+        return self
+
+
+class MediaView(CompatPatchView):
+    """
+    Lazily patched media object, see :meth:`ClientCompatPatch.media`.
+    The raw ``location`` and ``comments``, which the patch replaces, are patched on receipt.
+    """
+    LAZY_KEYS = {
+        'link': '_link',
+        'created_time': '_created_time',
+        'type': '_type',
+        'images': '_images',
+        'videos': '_videos',
+        'likes': '_likes',
+        'comments': '_comments',
+        'users_in_photo': '_users_in_photo',
+        'tags': '_tags',
+        'filter': '_filter',
+        'user_has_liked': '_user_has_liked',
+        'attribution': '_attribution',
+        'location': '_location',
+    }
+    NESTED_KEYS = ('caption', 'user', 'comments', 'preview_comments', 'carousel_media')
+    # carousel children take their standard resolution widths from the parent
+    _width_from = None
+    _image_index = None
+    _video_index = None
+
+    def __init__(self, *args, **kwargs):
+        super(MediaView, self).__init__(*args, **kwargs)
+        if dict.__contains__(self, 'location'):
+            self['location'] = ClientCompatPatch._location(dict.__getitem__(self, 'location'))
+        comments = dict.get(self, 'comments')
+        if isinstance(comments, list):
+            self['comments'] = {'count': dict.get(self, 'comment_count', 0), 'data': comments}
+        if dict.get(self, 'media_type') == 8:
+            carousel_media = dict.get(self, 'carousel_media') or []
+            for i, child in enumerate(carousel_media):
+                if isinstance(child, MediaView):
+                    # the children were decoded before the parent, as ordinary media
+                    if not isinstance(child, CarouselMediaView):
+                        child = carousel_media[i] = CarouselMediaView(child)
+                    child._width_from = self
+
+    def candidate_index(self, video=False):
+        """Get the (cached) :class:`CandidateIndex` for this media's images or videos"""
+        if video:
+            if self._video_index is None:
+                self._video_index = CandidateIndex(dict.get(self, 'video_versions', []))
+            return self._video_index
+        if self._image_index is None:
+            self._image_index = CandidateIndex(dict.get(self, 'image_versions2', {}).get('candidates', []))
+        return self._image_index
+
+    def _standard_width(self, default):
+        return dict.get(self._width_from if self._width_from is not None else self, 'original_width', default)
+
+    def _first_carousel_media(self):
+        if dict.get(self, 'media_type') == 8:
+            carousel_media = dict.get(self, 'carousel_media')
+            if carousel_media:
+                return carousel_media[0]
+        return None
+
+    def _link(self):
+        code = dict.get(self, 'code')
+        if not code:
+            return self.NOT_APPLICABLE
+        return 'https://www.instagram.com/p/%s/' % code
+
+    def _created_time(self):
+        timestamp = dict.get(self, 'taken_at') or dict.get(self, 'device_timestamp')
+        if not timestamp:
+            return self.NOT_APPLICABLE
+        return str(int(timestamp))
+
+    def _type(self):
+        first_carousel_media = self._first_carousel_media()
+        if first_carousel_media is not None:
+            return first_carousel_media.get('type', self.NOT_APPLICABLE)
+        media_type = ClientCompatPatch.MEDIA_TYPES.get(dict.get(self, 'media_type'))
+        return media_type or self.NOT_APPLICABLE
+
+    def _images(self):
+        first_carousel_media = self._first_carousel_media()
+        if first_carousel_media is not None:
+            return first_carousel_media['images']
+        return ClientCompatPatch._images(self, self._standard_width(1000), index=self.candidate_index())
+
+    def _videos(self):
+        first_carousel_media = self._first_carousel_media()
+        if first_carousel_media is not None:
+            return first_carousel_media.get('videos', self.NOT_APPLICABLE)
+        if dict.get(self, 'media_type') != 2:
+            return self.NOT_APPLICABLE
+        return ClientCompatPatch._videos(self, self._standard_width(640), index=self.candidate_index(video=True))
+
+    def _likes(self):
+        return {'count': dict.get(self, 'like_count', 0), 'data': []}
+
+    def _comments(self):
+        # only computed when the raw object has no comments
+        return {'count': dict.get(self, 'comment_count', 0), 'data': []}
+
+    def _users_in_photo(self):
+        usertags = dict.get(self, 'usertags', {}).get('in', [])
+        if usertags:
+            return ClientCompatPatch._users_in_photo(usertags)
+        user_tags = []
+        for rm in dict.get(self, 'reel_mentions') or []:
+            user = rm['user']
+            user['id'] = str(user['pk'])
+            user['profile_picture'] = user['profile_pic_url']
+            user_tags.append({
+                'position': {'y': rm['y'], 'x': rm['x']},
+                'user': user,
+            })
+        return user_tags
+
+    def _tags(self):
+        return []
+
+    def _filter(self):
+        return ClientCompatPatch.FILTERS.get(dict.get(self, 'filter_type'), '')
+
+    def _user_has_liked(self):
+        return dict.get(self, 'has_liked', False)
+
+    def _attribution(self):
+        return None
+
+    def _location(self):
+        # only computed when the raw object has no location
+        return None
+
+
+class CarouselMediaView(MediaView):
+    """Lazily patched carousel child, with only the keys that :meth:`ClientCompatPatch.media` adds to it"""
+    LAZY_KEYS = {
+        'type': '_type',
+        'images': '_images',
+        'videos': '_videos',
+        'users_in_photo': '_users_in_photo',
+        'location': '_location',
+    }
+    NESTED_KEYS = ()
+
+    def _users_in_photo(self):
+        usertags = dict.get(self, 'usertags', {}).get('in', [])
+        if not usertags:
+            return self.NOT_APPLICABLE
+        return ClientCompatPatch._users_in_photo(usertags)
+
+
+class CommentView(CompatPatchView):
+    """Lazily patched comment or caption, see :meth:`ClientCompatPatch.comment`"""
+    LAZY_KEYS = {
+        'id': '_id',
+        'created_time': '_created_time',
+        'from': '_from',
+    }
+
+    def _id(self):
+        return str(dict.__getitem__(self, 'pk'))
+
+    def _created_time(self):
+        return str(int(dict.__getitem__(self, 'created_at')))
+
+    def _from(self):
+        return ClientCompatPatch._from_user(dict.__getitem__(self, 'user'))
+
+
+class UserView(CompatPatchView):
+    """Lazily patched user, see :meth:`ClientCompatPatch.user` and :meth:`ClientCompatPatch.list_user`"""
+    LAZY_KEYS = {
+        'id': '_id',
+        'profile_picture': '_profile_picture',
+        'bio': '_bio',
+        'website': '_website',
+        'counts': '_counts',
+    }
+
+    def _id(self):
+        return str(dict.__getitem__(self, 'pk'))
+
+    def _profile_picture(self):
+        return dict.__getitem__(self, 'profile_pic_url')
+
+    def _bio(self):
+        return dict.get(self, 'biography', self.NOT_APPLICABLE)
+
+    def _website(self):
+        return dict.get(self, 'external_url', self.NOT_APPLICABLE)
+
+    def _counts(self):
+        if not ('media_count' in self and 'follower_count' in self and 'following_count' in self):
+            return self.NOT_APPLICABLE
+        return {
+            'media': dict.__getitem__(self, 'media_count'),
+            'followed_by': dict.__getitem__(self, 'follower_count'),
+            'follows': dict.__getitem__(self, 'following_count'),
+        }
@@ -54,6 +54,9 @@ class AccountsEndpointsMixin(object):
             on_login_callback = self.on_login
             on_login_callback(self)
 
+        if self.warmup:
+            self._warmup()
+
         # # Post-login calls in client
         # self.sync()
         # self.autocomplete_user_list()
@@ -116,7 +119,7 @@ class AccountsEndpointsMixin(object):
         """
         Change profile picture
 
-        :param photo_data: byte string of image
+        :param photo_data: byte string of image, a file object or a file path
         :return:
         """
         endpoint = 'accounts/change_profile_picture/'
@@ -130,7 +133,7 @@ class AccountsEndpointsMixin(object):
             ('profile_pic', 'profile_pic', 'application/octet-stream', photo_data)
         ]
 
-        content_type, body = MultipartFormDataEncoder(self.uuid).encode(fields, files)
+        content_type, body = MultipartFormDataEncoder(self.uuid).stream(fields, files)
 
         headers = self.default_headers
         headers['Content-Type'] = content_type
@@ -1,13 +1,19 @@
 import json
 import time
+import socket
+import itertools
+from multiprocessing.pool import ThreadPool
 from random import randint
 import warnings
 
 from ..compat import compat_urllib_error, compat_urllib_request
 from ..errors import ClientError
 from ..http import MultipartFormDataEncoder
-from ..utils import max_chunk_count_generator
+from ..utils import (
+    max_chunk_count_generator, max_chunk_size_generator, mapped_file, ByteRanges, Chunk, gen_upload_id
+)
 from ..compatpatch import ClientCompatPatch
+from ..uploads import UploadState, AdaptiveChunker, ConfigureTask
 
 
 class UploadEndpointsMixin(object):
@@ -174,7 +180,7 @@ class UploadEndpointsMixin(object):
         :param upload_id:
         :param size: tuple of (width, height)
         :param duration: in seconds
-        :param thumbnail_data: byte string of thumbnail photo
+        :param thumbnail_data: byte string of thumbnail photo, or None if it has already been posted
         :param caption:
         :param location: a dict of venue/location information,
                          from :meth:`location_search` or :meth:`location_fb_search`
@@ -186,8 +192,9 @@ class UploadEndpointsMixin(object):
             raise ClientError('Incompatible aspect ratio.')
 
         # upload video thumbnail
-        self.post_photo(thumbnail_data, size, caption, upload_id, location=location,
-                        disable_comments=disable_comments, is_sidecar=is_sidecar)
+        if thumbnail_data is not None:
+            self.post_photo(thumbnail_data, size, caption, upload_id, location=location,
+                            disable_comments=disable_comments, is_sidecar=is_sidecar)
 
         width, height = size
         params = {
@@ -289,13 +296,14 @@ class UploadEndpointsMixin(object):
         :param upload_id:
         :param size: tuple of (width, height)
         :param duration: in seconds
-        :param thumbnail_data: byte string of thumbnail photo
+        :param thumbnail_data: byte string of thumbnail photo, or None if it has already been posted
         :return:
         """
         if not self.reel_compatible_aspect_ratio(size):
             raise ClientError('Incompatible aspect ratio.')
 
-        res = self.post_photo(thumbnail_data, size, '', upload_id=upload_id, to_reel=True)
+        if thumbnail_data is not None:
+            self.post_photo(thumbnail_data, size, '', upload_id=upload_id, to_reel=True)
 
         width, height = size
         params = {
@@ -339,7 +347,7 @@ class UploadEndpointsMixin(object):
 
         [CAUTION] FLAKY, IG is very finicky about sizes, etc, needs testing.
 
-        :param photo_data: byte string of the image
+        :param photo_data: byte string of the image, a file object or a file path
         :param size: tuple of (width, height)
         :param caption:
         :param upload_id:
@@ -348,6 +356,11 @@ class UploadEndpointsMixin(object):
             - **location**: a dict of venue/location information, from :meth:`location_search`
               or :meth:`location_fb_search`
             - **disable_comments**: bool to disable comments
+            - **metrics**: an :class:`uploads.UploadMetrics` to record the transfer and configure timings to
+            - **progress**: a callable called with a dict after the photo has been sent,
+              see :meth:`post_video`
+            - **on_configure**: a callable called with the upload_id just before the configure
+              request, after which the photo may be posted even if the call fails
         :return:
         """
         warnings.warn('This endpoint has not been fully tested.', UserWarning)
@@ -370,9 +383,44 @@ class UploadEndpointsMixin(object):
         disable_comments = True if kwargs.pop('disable_comments', False) else False
 
         is_sidecar = kwargs.pop('is_sidecar', False)
+        metrics = kwargs.pop('metrics', None)
+        progress = kwargs.pop('progress', None)
+        on_configure = kwargs.pop('on_configure', None)
         if not upload_id:
-            upload_id = str(int(time.time() * 1000))
+            upload_id = gen_upload_id()
+
+        json_response = self._upload_photo(
+            photo_data, upload_id, for_video=for_video, is_sidecar=is_sidecar, metrics=metrics, progress=progress)
+
+        if for_video and is_sidecar:
+            return json_response
+
+        upload_id = json_response['upload_id']
+
+        # # NOTES: Logging traffic doesn't seem to indicate any additional "configure" after upload
+        # # BUT not doing a "configure" causes a video post to fail with a
+        # # "Other media configure error: b'yEmZkUpAj4'" error
+        # if for_video:
+        #     logger.debug('Skip photo configure.')
+        #     return json_response
+        started = time.time()
+        if on_configure is not None:
+            on_configure(upload_id)
+        if to_reel:
+            res = self.configure_to_reel(upload_id, size)
+        else:
+            res = self.configure(upload_id, size, caption=caption, location=location,
+                                 disable_comments=disable_comments, is_sidecar=is_sidecar)
+        if metrics is not None:
+            metrics.phases['configure'] = time.time() - started
+        return res
 
+    def _upload_photo(self, photo_data, upload_id, for_video=False, is_sidecar=False, metrics=None, progress=None):
+        """
+        Send a photo, or a video thumbnail, without configuring it. See :meth:`post_photo`.
+
+        :return: the upload response
+        """
         endpoint = 'upload/photo/'
         fields = [
             ('upload_id', upload_id),
@@ -390,12 +438,13 @@ class UploadEndpointsMixin(object):
              'application/octet-stream', photo_data)
         ]
 
-        content_type, body = MultipartFormDataEncoder(self.uuid).encode(fields, files)
+        content_type, body = MultipartFormDataEncoder(self.uuid).stream(fields, files)
         headers = self.default_headers
         headers['Content-Type'] = content_type
         headers['Content-Length'] = len(body)
 
         req = compat_urllib_request.Request(self.api_url + endpoint, body, headers=headers)
+        started = time.time()
         try:
             self.logger.debug('POST %s' % self.api_url + endpoint)
             response = self.opener.open(req, timeout=self.timeout)
@@ -416,22 +465,269 @@ class UploadEndpointsMixin(object):
         self.logger.debug('RESPONSE: %d %s' % (response.code, post_response))
         json_response = json.loads(post_response)
 
-        if for_video and is_sidecar:
-            return json_response
+        # the photo is sent as a single chunk
+        seconds = time.time() - started
+        chunk = Chunk(0, 0, len(body), 1)
+        ranges = ByteRanges(len(body), [(0, len(body))])
+        ranges.acknowledged = len(body)
+        if metrics is not None:
+            metrics.upload_id = upload_id
+            metrics.total = len(body)
+            metrics.add_chunk(chunk, seconds)
+            metrics.phases['transfer'] = seconds
+        self._upload_progress(progress, upload_id, chunk, seconds, 1, ranges)
+        return json_response
+
+    def _upload_video_chunk(self, upload_url, upload_job, upload_id, chunk, data, total_len, is_sidecar=False):
+        """
+        Upload a video chunk
 
-        upload_id = json_response['upload_id']
+        :return: tuple of (response text, True if the response is json)
+        """
+        headers = self.default_headers
+        headers['Connection'] = 'keep-alive'
+        headers['Content-Type'] = 'application/octet-stream'
+        headers['Content-Disposition'] = 'attachment; filename="video.mov"'
+        headers['Session-ID'] = upload_id
+        if is_sidecar:
+            headers['Cookie'] = 'sessionid=' + self.get_cookie_value('sessionid')
+        headers['job'] = upload_job
+        headers['Content-Length'] = chunk.length
+        headers['Content-Range'] = 'bytes %d-%d/%d' % (chunk.start, chunk.end - 1, total_len)
+        self.logger.debug('POST %s' % upload_url)
+        self.logger.debug('Uploading Content-Range: %s' % headers['Content-Range'])
 
-        # # NOTES: Logging traffic doesn't seem to indicate any additional "configure" after upload
-        # # BUT not doing a "configure" causes a video post to fail with a
-        # # "Other media configure error: b'yEmZkUpAj4'" error
-        # if for_video:
-        #     logger.debug('Skip photo configure.')
-        #     return json_response
-        if to_reel:
-            return self.configure_to_reel(upload_id, size)
+        req = compat_urllib_request.Request(
+            str(upload_url), data=data, headers=headers)
+
+        try:
+            res = self.opener.open(req, timeout=self.timeout)
+            post_response = self._read_response(res)
+            self.logger.debug('RESPONSE: %d %s' % (res.code, post_response))
+            return post_response, res.info().get('Content-Type') == 'application/json'
+
+        except compat_urllib_error.HTTPError as e:
+            error_msg = e.reason
+            error_response = e.read()
+            self.logger.debug('RESPONSE: %d %s' % (e.code, error_response))
+            try:
+                error_obj = json.loads(error_response)
+                if error_obj.get('message'):
+                    error_msg = '%s: %s' % (e.reason, error_obj['message'])
+            except:
+                # do nothing, prob can't parse json
+                pass
+            raise ClientError(error_msg, e.code, error_response)
+
+    def _upload_progress(self, progress, upload_id, chunk, seconds, attempts, ranges):
+        """Call an upload progress callback, see :meth:`post_video`"""
+        if progress is None:
+            return
+        try:
+            progress({
+                'upload_id': upload_id,
+                'index': chunk.index,
+                'start': chunk.start,
+                'end': chunk.end,
+                'seconds': seconds,
+                'attempts': attempts,
+                'sent': ranges.sent,
+                'acknowledged': ranges.acknowledged,
+                'total': ranges.total,
+            })
+        except Exception as e:
+            self.logger.error('Upload progress callback failed: %s' % e)
+
+    def _upload_video_chunk_with_retry(self, retries, *args, **kwargs):
+        """
+        Upload a video chunk, re-sending it on server and connection errors
+
+        :param retries: max. number of times the chunk is re-sent
+        :param on_retry: optional callable, called with the error before the chunk is re-sent
+        """
+        on_retry = kwargs.pop('on_retry', None)
+        attempt = 0
+        while True:
+            try:
+                return self._upload_video_chunk(*args, **kwargs)
+            except (ClientError, compat_urllib_error.URLError, socket.error) as e:
+                if attempt >= retries or (isinstance(e, ClientError) and e.code and e.code < 500):
+                    raise
+                attempt += 1
+                self.logger.warning('Retrying chunk upload (%d/%d) after error: %s' % (attempt, retries, e))
+                if on_retry is not None:
+                    on_retry(e)
+
+    def _upload_video(self, video_data, size, duration, is_sidecar=False, concurrency=1, chunk_retries=0,
+                      state=None, chunk_size=None, metrics=None, progress=None):
+        """
+        Upload the video data in chunks. Use :meth:`post_video` instead.
+
+        :param video_data: bytes or a mapped file from :func:`utils.mapped_file`
+        :param size: tuple of (width, height)
+        :param duration: in seconds
+        :param is_sidecar: bool flag for album upload
+        :param concurrency: number of chunks to upload at the same time after the first one
+        :param chunk_retries: number of times a failed chunk is re-sent
+        :param state: :class:`uploads.UploadState` to save the progress to, and to resume from
+        :param chunk_size: None to split the video into a fixed number of chunks, a size in bytes,
+            or ``'auto'`` to size the chunks from the measured throughput (:class:`uploads.AdaptiveChunker`)
+        :param metrics: :class:`uploads.UploadMetrics` to record the timings to
+        :param progress: callable called with a dict after each chunk, see :meth:`post_video`
+        :return: tuple of (upload_id, seconds to wait before the configure call)
+        """
+        if metrics is not None:
+            metrics.total = len(video_data)
+
+        if state is not None and state.is_started:
+            self.logger.debug('Resuming upload %s from %s' % (state.upload_id, state.ranges))
+            if metrics is not None:
+                metrics.upload_id = state.upload_id
+            return self._upload_video_chunks(
+                video_data, state.upload_id, state.upload_url, state.upload_job, state.chunk_count,
+                is_sidecar=is_sidecar, concurrency=concurrency, chunk_retries=chunk_retries, state=state,
+                chunk_size=state.chunk_size, metrics=metrics, progress=progress)
+
+        endpoint = 'upload/video/'
+        upload_id = gen_upload_id()
+
+        width, height = size
+        params = {
+            '_csrftoken': self.csrftoken,
+            '_uuid': self.uuid,
+            'upload_id': upload_id,
+        }
+        if is_sidecar:
+            params['is_sidecar'] = '1'
         else:
-            return self.configure(upload_id, size, caption=caption, location=location,
-                                  disable_comments=disable_comments, is_sidecar=is_sidecar)
+            params.update({
+                'media_type': '2',
+                'upload_media_duration_ms': int(duration * 1000),
+                'upload_media_width': width,
+                'upload_media_height': height
+            })
+
+        started = time.time()
+        res = self._call_api(endpoint, params=params, unsigned=True)
+        rtt = time.time() - started
+        upload_url = res['video_upload_urls'][-1]['url']
+        upload_job = res['video_upload_urls'][-1]['job']
+        if metrics is not None:
+            metrics.upload_id = upload_id
+            metrics.phases['negotiate'] = rtt
+
+        chunk_count = max(4, concurrency + 1)
+        if state is not None:
+            state.start(upload_id, upload_url, upload_job, chunk_count, chunk_size=chunk_size)
+        return self._upload_video_chunks(
+            video_data, upload_id, upload_url, upload_job, chunk_count,
+            is_sidecar=is_sidecar, concurrency=concurrency, chunk_retries=chunk_retries, state=state,
+            chunk_size=chunk_size, metrics=metrics, rtt=rtt, progress=progress)
+
+    def _upload_video_chunks(self, video_data, upload_id, upload_url, upload_job, chunk_count,
+                             is_sidecar=False, concurrency=1, chunk_retries=0, state=None,
+                             chunk_size=None, metrics=None, rtt=None, progress=None):
+        """Upload the chunks that have not been sent yet, see :meth:`_upload_video`"""
+        total_len = len(video_data)
+        ranges = state.ranges if state is not None else ByteRanges(total_len)
+        try:
+            view = memoryview(video_data)
+        except TypeError:   # Python 2 mmap, slices are copied
+            view = video_data
+
+        chunker = None
+        if chunk_size == 'auto':
+            # the chunks are sized as they are sent, starting with a small probe chunk
+            chunker = AdaptiveChunker(ranges, rtt=rtt)
+            chunks = iter(chunker)
+        else:
+            if chunk_size:
+                generator = max_chunk_size_generator(int(chunk_size), video_data)
+            else:
+                generator = max_chunk_count_generator(chunk_count, video_data)
+            chunks = iter([chunk for chunk, _ in generator if not ranges.contains(chunk.start, chunk.end)])
+
+        def upload_chunk(chunk):
+            # [start time of the current attempt, attempts]
+            timer = [time.time(), 1]
+
+            def on_retry(_):
+                timer[:] = [time.time(), timer[1] + 1]
+
+            result = self._upload_video_chunk_with_retry(
+                chunk_retries, upload_url, upload_job, upload_id, chunk, view[chunk.start:chunk.end], total_len,
+                is_sidecar=is_sidecar, on_retry=on_retry)
+            return chunk, result, time.time() - timer[0], timer[1]
+
+        def chunk_sent(chunk, post_response, is_json, seconds, attempts):
+            ranges.add(chunk.start, chunk.end)
+            if not is_json:
+                ranges.acknowledge(post_response)
+            else:
+                # the json response comes when the server has received everything
+                ranges.acknowledged = total_len
+            if state is not None:
+                state.update(ranges, uploaded=ranges.is_complete)
+            if metrics is not None:
+                metrics.add_chunk(chunk, seconds, attempts)
+            self._upload_progress(progress, upload_id, chunk, seconds, attempts, ranges)
+            if chunker is not None:
+                if attempts > 1:
+                    chunker.record_failure()
+                chunker.record(chunk.length, seconds)
+
+        def chunk_done(result):
+            chunk, (post_response, is_json), seconds, attempts = result
+            chunk_sent(chunk, post_response, is_json, seconds, attempts)
+            if is_json:
+                return json.loads(post_response)
+            if ranges.parse(post_response) is None:
+                self.logger.error('Received chunk upload response: %s' % post_response)
+                raise ClientError('Upload has unexpectedly failed', code=500)
+            return None
+
+        upload_res = None
+        started = time.time()
+        first_chunk = next(chunks, None)
+        if concurrency > 1 and first_chunk is not None:
+            if chunker is not None or not ranges.sent:
+                # the first chunk starts the upload session, and measures the throughput
+                # for 'auto', the rest are sent concurrently
+                upload_res = chunk_done(upload_chunk(first_chunk))
+                remaining = chunker.plan(concurrency) if chunker is not None else list(chunks)
+            else:
+                remaining = [first_chunk] + list(chunks)
+            pool = ThreadPool(max(1, min(concurrency, len(remaining))))
+            try:
+                for result in pool.imap_unordered(upload_chunk, remaining):
+                    upload_res = chunk_done(result) or upload_res
+            finally:
+                pool.terminate()
+            self.logger.debug('Uploaded: %s' % ranges)
+        elif first_chunk is not None:
+            for chunk in itertools.chain([first_chunk], chunks):
+                chunk, (post_response, is_json), seconds, attempts = upload_chunk(chunk)
+                chunk_sent(chunk, post_response, is_json, seconds, attempts)
+                if is_json:
+                    # last chunk
+                    upload_res = json.loads(post_response)
+                elif not ranges.is_complete and not post_response.startswith('0-'):
+                    # A correct response will look like 0-199999/4062266 where
+                    # 199999 is the cumulated count of uploaded bytes
+                    # If a non-zero range start value is received, the upload will
+                    # eventually 'Transcode timeout' at configure
+                    self.logger.error('Received chunk upload response: %s' % post_response)
+                    raise ClientError('Upload has unexpectedly failed', code=500)
+        if metrics is not None:
+            metrics.phases['transfer'] = time.time() - started
+            self.logger.debug('Upload metrics: %s' % {
+                k: v for k, v in metrics.to_dict().items() if k != 'chunks'})
+
+        configure_delay = 0
+        if upload_res is not None:
+            configure_delay = int(upload_res.get('configure_delay_ms', 0)) / 1000.0
+            self.logger.debug('Configure delay: %s' % configure_delay)
+        return upload_id, configure_delay
 
     def post_video(self, video_data, size, duration, thumbnail_data, caption='', to_reel=False, **kwargs):
         """
@@ -439,16 +735,39 @@ class UploadEndpointsMixin(object):
 
         [CAUTION] FLAKY, IG is very picky about sizes, etc, needs testing.
 
-        :param video_data: byte string of the video content
+        :param video_data: byte string of the video content, or a file path or file object
+            that is memory-mapped instead of read into memory (a file object from its current position)
         :param size: tuple of (width, height)
         :param duration: in seconds
-        :param thumbnail_data: byte string of the video thumbnail content
+        :param thumbnail_data: byte string of the video thumbnail content, a file object or a file path
         :param caption:
         :param to_reel: post to reel as Story
         :param kwargs:
              - **location**: a dict of venue/location information, from :meth:`location_search`
                or :meth:`location_fb_search`
              - **disable_comments**: bool to disable comments
+             - **concurrency**: number of chunks to upload at the same time. Default: 1
+             - **chunk_retries**: number of times a chunk is re-sent after a server or
+               connection error, without restarting the upload. Default: 0
+             - **state_file**: path of a file to save the upload progress to, so that an interrupted
+               upload can be resumed with the same call or :meth:`resume_video_upload`.
+               It is removed after the video has been configured.
+             - **chunk_size**: chunk size in bytes, or ``'auto'`` to size the chunks from the
+               measured round trip and throughput. Default: a fixed number of chunks
+             - **metrics**: an :class:`uploads.UploadMetrics` to record the timings of the negotiate,
+               transfer, processing (configure delay) and configure phases to. With a scheduler,
+               the last two are recorded when the task is done.
+             - **progress**: a callable called after each chunk with a dict of the upload_id,
+               chunk ``index``, ``start`` and ``end``, ``seconds`` taken, ``attempts``,
+               bytes ``sent``, bytes ``acknowledged`` by the server and ``total`` bytes
+             - **scheduler**: an :class:`uploads.UploadScheduler` to run the configure step in the
+               background after the server's configure delay. A :class:`uploads.ConfigureTask`
+               is returned instead of the response, get the response with ``task.result()``.
+               The video and thumbnail have been sent when it is returned.
+             - **configure_policy**: an :class:`uploads.ConfigurePolicy` for retrying the configure
+               while the server is still processing the video
+             - **on_configure**: a callable called with the upload_id just before the first configure
+               request, after which the video may be posted even if the call fails
         :return:
         """
         warnings.warn('This endpoint has not been fully tested.', UserWarning)
@@ -472,124 +791,121 @@ class UploadEndpointsMixin(object):
         if to_reel and duration > 15.0:
             raise ClientError('Duration is more than 15s')
 
-        if len(video_data) > 50 * 1024 * 1000:
-            raise ClientError('Video file is too big')
-
         location = kwargs.pop('location', None)
         if location:
             self._validate_location(location)
         disable_comments = True if kwargs.pop('disable_comments', False) else False
-
-        endpoint = 'upload/video/'
-        upload_id = str(int(time.time() * 1000))
-
-        width, height = size
-        params = {
-            '_csrftoken': self.csrftoken,
-            '_uuid': self.uuid,
-            'upload_id': upload_id,
-        }
         is_sidecar = kwargs.pop('is_sidecar', False)
-        if is_sidecar:
-            params['is_sidecar'] = '1'
-        else:
-            params.update({
-                'media_type': '2',
-                'upload_media_duration_ms': int(duration * 1000),
-                'upload_media_width': width,
-                'upload_media_height': height
-            })
-
-        res = self._call_api(endpoint, params=params, unsigned=True)
-        upload_url = res['video_upload_urls'][-1]['url']
-        upload_job = res['video_upload_urls'][-1]['job']
-
-        chunk_count = 4
-        total_len = len(video_data)
-
-        # Alternatively, can use max_chunk_size_generator(20480, video_data)
-        # [TODO] We can be a little smart about using either generators
-        # depending on the file size, or other factors
-        # for chunk, data in max_chunk_size_generator(200000, video_data):
-        for chunk, data in max_chunk_count_generator(chunk_count, video_data):
-            headers = self.default_headers
-            headers['Connection'] = 'keep-alive'
-            headers['Content-Type'] = 'application/octet-stream'
-            headers['Content-Disposition'] = 'attachment; filename="video.mov"'
-            headers['Session-ID'] = upload_id
-            if is_sidecar:
-                headers['Cookie'] = 'sessionid=' + self.get_cookie_value('sessionid')
-            headers['job'] = upload_job
-            headers['Content-Length'] = chunk.length
-            headers['Content-Range'] = 'bytes %d-%d/%d' % (chunk.start, chunk.end - 1, total_len)
-            self.logger.debug('POST %s' % upload_url)
-            self.logger.debug('Uploading Content-Range: %s' % headers['Content-Range'])
-
-            req = compat_urllib_request.Request(
-                str(upload_url), data=data, headers=headers)
-
-            try:
-                res = self.opener.open(req, timeout=self.timeout)
-                post_response = self._read_response(res)
-                self.logger.debug('RESPONSE: %d %s' % (res.code, post_response))
-                if chunk.is_last and res.info().get('Content-Type') == 'application/json':
-                    # last chunk
-                    upload_res = json.loads(post_response)
-                    configure_delay = int(upload_res.get('configure_delay_ms', 0)) / 1000.0
-                    self.logger.debug('Configure delay: %s' % configure_delay)
-                    time.sleep(configure_delay)
-                elif not chunk.is_last and not post_response.startswith('0-'):
-                    # A correct response will look like 0-199999/4062266 where
-                    # 199999 is the cumulated count of uploaded bytes
-                    # If a non-zero range start value is received, the upload will
-                    # eventually 'Transcode timeout' at configure
-                    self.logger.error('Received chunk upload response: %s' % post_response)
-                    raise ClientError('Upload has unexpectedly failed', code=500)
-
-            except compat_urllib_error.HTTPError as e:
-                error_msg = e.reason
-                error_response = e.read()
-                self.logger.debug('RESPONSE: %d %s' % (e.code, error_response))
-                try:
-                    error_obj = json.loads(error_response)
-                    if error_obj.get('message'):
-                        error_msg = '%s: %s' % (e.reason, error_obj['message'])
-                except:
-                    # do nothing, prob can't parse json
-                    pass
-                raise ClientError(error_msg, e.code, error_response)
-
-        if not to_reel:
-            return self.configure_video(
-                upload_id, size, duration, thumbnail_data, caption=caption, location=location,
-                disable_comments=disable_comments, is_sidecar=is_sidecar)
-        else:
-            return self.configure_video_to_reel(upload_id, size, duration, thumbnail_data)
+        concurrency = kwargs.pop('concurrency', 1)
+        chunk_retries = kwargs.pop('chunk_retries', 0)
+        state_file = kwargs.pop('state_file', None)
+        chunk_size = kwargs.pop('chunk_size', None)
+        metrics = kwargs.pop('metrics', None)
+        scheduler = kwargs.pop('scheduler', None)
+        configure_policy = kwargs.pop('configure_policy', None)
+        progress = kwargs.pop('progress', None)
+        on_configure = kwargs.pop('on_configure', None)
+
+        with mapped_file(video_data) as video_data:
+            if len(video_data) > 50 * 1024 * 1000:
+                raise ClientError('Video file is too big')
+            state = None
+            if state_file:
+                state = UploadState.open(state_file, video_data, params={
+                    'size': list(size), 'duration': duration, 'caption': caption, 'to_reel': to_reel,
+                    'location': location, 'disable_comments': disable_comments, 'is_sidecar': is_sidecar,
+                    'concurrency': concurrency, 'chunk_retries': chunk_retries, 'chunk_size': chunk_size,
+                })
+            if state is not None and state.is_uploaded:
+                upload_id, configure_delay = state.upload_id, 0
+            else:
+                upload_id, configure_delay = self._upload_video(
+                    video_data, size, duration, is_sidecar=is_sidecar,
+                    concurrency=concurrency, chunk_retries=chunk_retries, state=state,
+                    chunk_size=chunk_size, metrics=metrics, progress=progress)
+        # sent before returning, while the caller's thumbnail file is still open,
+        # so that only the configure requests are scheduled
+        self._upload_photo(thumbnail_data, upload_id, for_video=True, is_sidecar=is_sidecar)
+        uploaded = time.time()
+        # configure may be retried while the video is processing, but the
+        # thumbnail is configured only once
+        posted = []
+
+        def configure():
+            started = time.time()
+            if 'thumbnail_configure' not in posted and not is_sidecar:
+                if on_configure is not None:
+                    on_configure(upload_id)
+                if to_reel:
+                    self.configure_to_reel(upload_id, size)
+                else:
+                    self.configure(upload_id, size, caption=caption, location=location,
+                                   disable_comments=disable_comments)
+                posted.append('thumbnail_configure')
+            if not to_reel:
+                res = self.configure_video(
+                    upload_id, size, duration, None, caption=caption, location=location,
+                    disable_comments=disable_comments, is_sidecar=is_sidecar)
+            else:
+                res = self.configure_video_to_reel(upload_id, size, duration, None)
+            if metrics is not None:
+                # the configure delay and any retries while the video was still processing
+                metrics.phases['processing'] = started - uploaded
+                metrics.phases['configure'] = time.time() - started
+            if state is not None:
+                state.delete()
+            return res
+
+        task = ConfigureTask(configure, policy=configure_policy, upload_id=upload_id)
+        if scheduler is not None:
+            return scheduler.schedule(task, delay=configure_delay)
+        return task.run_sync(delay=configure_delay)
+
+    def resume_video_upload(self, state_file, video_data, thumbnail_data, **kwargs):
+        """
+        Resume an interrupted :meth:`post_video` with the parameters saved in its state file.
+        If the video had been uploaded completely, only the configure calls are made.
 
-    def post_photo_story(self, photo_data, size):
+        :param state_file: the state_file given to :meth:`post_video`
+        :param video_data: the same video as before, as bytes, a file path or a file object
+        :param thumbnail_data: byte string of the video thumbnail content, a file object or a file path
+        :param kwargs: options of :meth:`post_video` that are not saved, e.g. scheduler, metrics
+        :return:
+        """
+        state = UploadState.load(state_file)
+        if state is None or not state.params:
+            raise ClientError('No upload to resume in %s' % state_file)
+        params = dict(state.params)
+        params['size'] = tuple(params['size'])
+        params.update(kwargs)
+        return self.post_video(video_data, thumbnail_data=thumbnail_data, state_file=state_file, **params)
+
+    def post_photo_story(self, photo_data, size, **kwargs):
         """
         Upload a photo story
 
         :param photo_data: byte string of the image
         :param size: tuple of (width, height)
+        :param kwargs: upload options of :meth:`post_photo`, e.g. metrics
         :return:
         """
         return self.post_photo(
-            photo_data=photo_data, size=size, to_reel=True)
+            photo_data=photo_data, size=size, to_reel=True, **kwargs)
 
-    def post_video_story(self, video_data, size, duration, thumbnail_data):
+    def post_video_story(self, video_data, size, duration, thumbnail_data, **kwargs):
         """
         Upload a video story
 
-        :param video_data: byte string of the video content
+        :param video_data: byte string of the video content, a file path or a file object
         :param size: tuple of (width, height)
         :param duration: in seconds
-        :param thumbnail_data: byte string of the video thumbnail content
+        :param thumbnail_data: byte string of the video thumbnail content, a file object or a file path
+        :param kwargs: upload options of :meth:`post_video`, e.g. scheduler
         :return:
         """
         return self.post_video(
             video_data=video_data, size=size, duration=duration,
-            thumbnail_data=thumbnail_data, to_reel=True)
+            thumbnail_data=thumbnail_data, to_reel=True, **kwargs)
 
     def post_album(self, medias, caption='', location=None, **kwargs):
         """
@@ -611,12 +927,17 @@ class UploadEndpointsMixin(object):
 
         :param caption:
         :param location:
+        :param kwargs:
+             - **disable_comments**: bool to disable comments
+             - **concurrency**: number of photos/videos to upload at the same time. Default: 1
+             - **on_configure**: a callable called with the album's upload_id just before the
+               configure_sidecar request, after which the album may be posted even if the call fails
         :return:
         """
-        album_upload_id = str(int(time.time() * 1000))
-        children_metadata = []
+        album_upload_id = gen_upload_id()
+        children = []
         for media in medias:
-            if len(children_metadata) >= 10:
+            if len(children) >= 10:
                 continue
             if media.get('type', '') not in ['image', 'video']:
                 raise ClientError('Invalid media type: %s' % media.get('type', ''))
@@ -632,29 +953,40 @@ class UploadEndpointsMixin(object):
             aspect_ratio = (media['size'][0] * 1.0) / (media['size'][1] * 1.0)
             if aspect_ratio > 1.0 or aspect_ratio < 1.0:
                 raise ClientError('Invalid media aspect ratio')
+            children.append(media)
+        if len(children) <= 1:
+            raise ClientError('Invalid number of media objects: %d' % len(children))
 
+        def upload_child(media):
             if media['type'] == 'video':
-                metadata = self.post_video(
+                return self.post_video(
                     video_data=media['data'],
                     size=media['size'],
                     duration=media['duration'],
                     thumbnail_data=media['thumbnail'],
                     is_sidecar=True
                 )
-            else:
-                metadata = self.post_photo(
-                    photo_data=media['data'],
-                    size=media['size'],
-                    is_sidecar=True,
-                )
-                if media.get('usertags'):
-                    usertags = media['usertags']
-                    utags = {'in': [{'user_id': str(u['user_id']), 'position': u['position']} for u in usertags]}
-                    metadata['usertags'] = json.dumps(utags, separators=(',', ':'))
-            children_metadata.append(metadata)
-
-        if len(children_metadata) <= 1:
-            raise ClientError('Invalid number of media objects: %d' % len(children_metadata))
+            metadata = self.post_photo(
+                photo_data=media['data'],
+                size=media['size'],
+                is_sidecar=True,
+            )
+            if media.get('usertags'):
+                usertags = media['usertags']
+                utags = {'in': [{'user_id': str(u['user_id']), 'position': u['position']} for u in usertags]}
+                metadata['usertags'] = json.dumps(utags, separators=(',', ':'))
+            return metadata
+
+        concurrency = kwargs.pop('concurrency', 1)
+        if concurrency > 1:
+            # each child gets its own upload_id, and map() keeps the metadata in the album order
+            pool = ThreadPool(min(concurrency, len(children)))
+            try:
+                children_metadata = pool.map(upload_child, children)
+            finally:
+                pool.terminate()
+        else:
+            children_metadata = [upload_child(media) for media in children]
 
         # configure as sidecar
         endpoint = 'media/configure_sidecar/'
@@ -677,6 +1009,9 @@ class UploadEndpointsMixin(object):
         disable_comments = kwargs.pop('disable_comments', False)
         if disable_comments:
             params['disable_comments'] = '1'
+        on_configure = kwargs.pop('on_configure', None)
+        if on_configure is not None:
+            on_configure(album_upload_id)
 
         params.update(self.authenticated_params)
         res = self._call_api(endpoint, params=params)
@@ -1,9 +1,13 @@
 from io import BytesIO
+import os
 import sys
 import codecs
 import mimetypes
 import uuid
-from .compat import compat_cookiejar, compat_pickle
+import hmac
+import hashlib
+import json
+from .compat import compat_cookiejar, compat_pickle, compat_urllib_parse, compat_text_type
 
 
 class ClientCookieJar(compat_cookiejar.CookieJar):
@@ -12,15 +16,23 @@ class ClientCookieJar(compat_cookiejar.CookieJar):
     def __init__(self, cookie_string=None, policy=None):
         compat_cookiejar.CookieJar.__init__(self, policy)
         if cookie_string:
-            if isinstance(cookie_string, bytes):
-                self._cookies = compat_pickle.loads(cookie_string)
-            else:
-                self._cookies = compat_pickle.loads(cookie_string.encode('utf-8'))
+            self.load(cookie_string)
+
+    def load(self, cookie_string):
+        """Replace the cookies in the jar with the ones from a dumped cookie string"""
+        if isinstance(cookie_string, bytes):
+            cookies = compat_pickle.loads(cookie_string)
+        else:
+            cookies = compat_pickle.loads(cookie_string.encode('utf-8'))
+        with self._cookies_lock:
+            self._cookies = cookies
 
     @property
     def expires_earliest(self):
-        if len(self) > 0:
-            return min([cookie.expires for cookie in self])
+        # session cookies do not have an expiry
+        expiries = [cookie.expires for cookie in self if cookie.expires]
+        if expiries:
+            return min(expiries)
         return None
 
     def dump(self):
@@ -69,12 +81,196 @@ class MultipartFormDataEncoder(object):
                 contenttype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'))
             yield encoder('Content-Transfer-Encoding: binary\r\n')
             yield encoder('\r\n')
-            yield (fd, len(fd))
+            yield (fd, data_length(fd))
             yield encoder('\r\n')
         yield encoder('--{}--\r\n'.format(self.boundary))
 
     def encode(self, fields, files):
         body = BytesIO()
-        for chunk, chunk_len in self.iter(fields, files):
+        for chunk in self.stream(fields, files)[1]:
             body.write(chunk)
         return self.content_type, body.getvalue()
+
+    def stream(self, fields, files, chunk_size=None):
+        """
+        Like :meth:`encode` but the body is produced as it is sent, so that the
+        file data is not copied into memory. The file data can be bytes,
+        a file object (read from its current position) or a file path.
+
+        :param fields: sequence of (name, value) elements for regular form fields
+        :param files: sequence of (name, filename, contenttype, filedata) elements for data to be uploaded as files
+        :param chunk_size: max. size of the chunks read from files
+        :return: tuple of (content type, :class:`MultipartFormDataStream`)
+        """
+        file_data = [fd for (_, _, _, fd) in files]
+        parts = []
+        for chunk, chunk_len in self.iter(fields, files):
+            if any(chunk is fd for fd in file_data):
+                parts.append((chunk, chunk_len))
+            elif parts and is_bytes_like(parts[-1]):
+                # merge the small header parts
+                parts[-1] += chunk
+            else:
+                parts.append(chunk)
+        return self.content_type, MultipartFormDataStream(parts, chunk_size=chunk_size)
+
+
+def is_bytes_like(data):
+    return isinstance(data, (bytes, bytearray, memoryview))
+
+
+def is_file_path(data):
+    """
+    True if upload data is a file path rather than the data itself.
+    On Python 2, a native ``str`` is a path unless it has null bytes, which
+    image and video data always have in their headers.
+
+    :param data:
+    :return:
+    """
+    if isinstance(data, compat_text_type):
+        return True
+    return sys.hexversion < 0x03000000 and isinstance(data, str) and b'\0' not in data
+
+
+def data_length(data):
+    """
+    Length of upload data given as bytes, a file object (from its current position) or a file path
+
+    :param data:
+    :return:
+    """
+    if is_file_path(data):
+        return os.path.getsize(data)
+    if is_bytes_like(data):
+        return len(data)
+    position = data.tell()
+    data.seek(0, os.SEEK_END)
+    length = data.tell() - position
+    data.seek(position)
+    return length
+
+
+class MultipartFormDataStream(object):
+    """
+    A request body made of bytes and file parts that is read as it is sent.
+    It has a length for the ``Content-Length`` header and can be used as the data
+    of a :class:`urllib.request.Request`, which reads it with :meth:`read`.
+    Iterating over it yields the body in chunks.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, parts, chunk_size=None):
+        """
+
+        :param parts: sequence of bytes, or (file data, length) tuples with the data as bytes,
+            a file object or a file path, see :func:`is_file_path`
+        :param chunk_size: max. size of the chunks read from files
+        """
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.parts = []
+        for part in parts:
+            if isinstance(part, tuple) and not is_file_path(part[0]) and not is_bytes_like(part[0]):
+                # remember where to read the file object from
+                part = (part[0], part[1], part[0].tell())
+            self.parts.append(part)
+        self.length = sum(part[1] if isinstance(part, tuple) else len(part) for part in self.parts)
+        self._chunks = None
+        self._pending = None
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        chunk_size = self.chunk_size
+        for part in self.parts:
+            if not isinstance(part, tuple):
+                yield part
+            elif is_file_path(part[0]):
+                with open(part[0], 'rb') as f:
+                    for chunk in self._read_file(f, part[1], chunk_size):
+                        yield chunk
+            elif is_bytes_like(part[0]):
+                view = memoryview(part[0])
+                for i in range(0, len(view), chunk_size):
+                    yield view[i:i + chunk_size]
+            else:
+                part[0].seek(part[2])
+                for chunk in self._read_file(part[0], part[1], chunk_size):
+                    yield chunk
+
+    @staticmethod
+    def _read_file(f, length, chunk_size):
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                raise IOError('File is shorter than expected')
+            length -= len(chunk)
+            yield chunk
+
+    def read(self, size=-1):
+        """Read up to size bytes of the body, or the rest of it"""
+        if self._chunks is None:
+            self._chunks = iter(self)
+        remaining = self.length if size is None or size < 0 else size
+        data = []
+        while remaining > 0:
+            if not self._pending:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._pending = memoryview(chunk)
+            piece = self._pending[:remaining]
+            self._pending = self._pending[len(piece):]
+            remaining -= len(piece)
+            data.append(piece.tobytes())
+        return b''.join(data)
+
+
+class SignedBodyEncoder(object):
+    """
+    Signs and form-encodes the ``signed_body`` payloads used by the app api.
+
+    The HMAC is keyed once and copied for each payload so that the key
+    is not re-processed on every request, and the form body is built
+    directly instead of going through urlencode().
+    """
+    def __init__(self, signature_key, key_version):
+        self.signature_key = signature_key
+        self.key_version = key_version
+        self._hmac = hmac.new(signature_key.encode('ascii'), digestmod=hashlib.sha256)
+        self._body_prefix = 'ig_sig_key_version=%s&signed_body=' % compat_urllib_parse.quote_plus(
+            str(key_version))
+
+    def signature(self, data):
+        """
+        Generate the signature for a string
+
+        :param data: ascii string, usually a json dump of the request params
+        :return: hex digest
+        """
+        digest = self._hmac.copy()
+        digest.update(data.encode('ascii'))
+        return digest.hexdigest()
+
+    def encode(self, params):
+        """
+        Sign and encode request params into a form post body
+
+        :param params: dict of request params
+        :return: url-encoded bytes
+        """
+        json_params = json.dumps(params, separators=(',', ':'))
+        return (
+            self._body_prefix + self.signature(json_params) + '.' +
+            compat_urllib_parse.quote_plus(json_params)).encode('ascii')
+
+    def encode_many(self, params_list):
+        """
+        Sign and encode a batch of request params, for example queued write operations
+
+        :param params_list: iterable of dicts of request params
+        :return: list of url-encoded bytes, in the same order
+        """
+        encode = self.encode
+        return [encode(params) for params in params_list]
@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+"""
+Compact typed models for api objects.
+
+The plain dict responses are convenient but carry every key the api returns.
+These ``__slots__`` classes keep only the commonly used fields, and can be built
+from the app API payloads (raw or patched by :class:`ClientCompatPatch`)
+with ``from_app()``, or from the web API payloads (raw or patched) with ``from_web()``.
+
+.. code-block:: python
+
+    from instagram_private_api.models import Media
+
+    feed = [Media.from_app(m) for m in api.feed_timeline().get('items', [])]
+    feed[0].user.username
+    feed[0].to_dict()
+"""
+import numbers
+import threading
+from collections import OrderedDict
+
+from .compat import compat_intern
+
+MEDIA_TYPES = {
+    'image': 1,
+    'video': 2,
+    'carousel': 8,
+}
+
+
+def _int(value):
+    return int(value) if value is not None and value != '' else None
+
+
+def _count(obj, *keys):
+    """Get the first count found that is either a number (app) or a ``{'count': n}`` object (web, patched)"""
+    for key in keys:
+        value = obj.get(key)
+        if isinstance(value, dict):
+            value = value.get('count')
+        if isinstance(value, numbers.Number) and not isinstance(value, bool):
+            return value
+    return None
+
+
+def _first(*values):
+    for value in values:
+        if value is not None:
+            return value
+    return None
+
+
+def _intern(value):
+    try:
+        return compat_intern(value)
+    except TypeError:
+        # not a str, e.g. unicode in python 2
+        return value
+
+
+def _code_from_link(link):
+    return link.rstrip('/').rsplit('/', 1)[-1] if link else None
+
+
+class Model(object):
+    """Base for the slotted models"""
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError('Unknown fields for %s: %s' % (self.__class__.__name__, ', '.join(sorted(kwargs))))
+
+    def __repr__(self):
+        key = self.__slots__[0]
+        return '<%s %s=%r>' % (self.__class__.__name__, key, getattr(self, key))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def to_dict(self):
+        """
+        Get the model as a dict, leaving out empty fields. Field names follow the
+        app API keys so that code written for the raw responses can read it.
+        """
+        d = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            if isinstance(value, Model):
+                value = value.to_dict()
+            elif isinstance(value, tuple):
+                value = [v.to_dict() if isinstance(v, Model) else v for v in value]
+            d[name] = value
+        return d
+
+
+class User(Model):
+    __slots__ = (
+        'pk', 'username', 'full_name', 'profile_pic_url', 'is_private', 'is_verified',
+        'biography', 'external_url', 'follower_count', 'following_count', 'media_count')
+
+    @classmethod
+    def from_app(cls, user, identity_map=None):
+        """
+        Build from an app API user (raw, or patched by :meth:`ClientCompatPatch.user`)
+
+        :param user:
+        :param identity_map: optional :class:`IdentityMap` to get the shared model for the user pk
+        :return:
+        """
+        counts = user.get('counts') or {}
+        return cls._shared(identity_map, cls(
+            pk=_int(user.get('pk', user.get('id'))),
+            username=user.get('username'),
+            full_name=user.get('full_name'),
+            profile_pic_url=user.get('profile_pic_url') or user.get('profile_picture'),
+            is_private=user.get('is_private'),
+            is_verified=user.get('is_verified'),
+            biography=user.get('biography', user.get('bio')),
+            external_url=user.get('external_url', user.get('website')),
+            follower_count=user.get('follower_count', counts.get('followed_by')),
+            following_count=user.get('following_count', counts.get('follows')),
+            media_count=user.get('media_count', counts.get('media')),
+        ))
+
+    @classmethod
+    def from_web(cls, user, identity_map=None):
+        """Build from a web API user (raw, or patched by the web ClientCompatPatch)"""
+        counts = user.get('counts') or {}
+        return cls._shared(identity_map, cls(
+            pk=_int(user.get('id')),
+            username=user.get('username'),
+            full_name=user.get('full_name'),
+            profile_pic_url=user.get('profile_pic_url') or user.get('profile_picture'),
+            is_private=user.get('is_private'),
+            is_verified=user.get('is_verified'),
+            biography=user.get('biography', user.get('bio')),
+            external_url=user.get('external_url', user.get('website')),
+            follower_count=_first(_count(user, 'followed_by'), counts.get('followed_by')),
+            following_count=_first(_count(user, 'follows'), counts.get('follows')),
+            media_count=_first(_count(user, 'media'), counts.get('media')),
+        ))
+
+    @classmethod
+    def _shared(cls, identity_map, user):
+        return identity_map.user_model(user) if identity_map is not None else user
+
+
+class Location(Model):
+    __slots__ = ('pk', 'name', 'lat', 'lng', 'address', 'city')
+
+    @classmethod
+    def from_app(cls, location):
+        """Build from an app API location (raw or patched)"""
+        if not location:
+            return None
+        return cls(
+            pk=_int(location.get('pk', location.get('id'))),
+            name=location.get('name'),
+            lat=location.get('lat', location.get('latitude')),
+            lng=location.get('lng', location.get('longitude')),
+            address=location.get('address') or None,
+            city=location.get('city') or None,
+        )
+
+    @classmethod
+    def from_web(cls, location):
+        """Build from a web API location (raw or patched)"""
+        if not location:
+            return None
+        return cls(
+            pk=_int(location.get('id')),
+            name=location.get('name'),
+            lat=location.get('lat', location.get('latitude')),
+            lng=location.get('lng', location.get('longitude')),
+        )
+
+
+class Comment(Model):
+    __slots__ = ('pk', 'text', 'created_at', 'user', 'media_id')
+
+    @classmethod
+    def from_app(cls, comment, identity_map=None):
+        """Build from an app API comment or caption (raw, or patched by :meth:`ClientCompatPatch.comment`)"""
+        user = comment.get('user') or comment.get('from')
+        return cls(
+            pk=_int(comment.get('pk', comment.get('id'))),
+            text=comment.get('text'),
+            created_at=_int(comment.get('created_at', comment.get('created_time'))),
+            user=User.from_app(user, identity_map) if user else None,
+            media_id=_int(comment.get('media_id')),
+        )
+
+    @classmethod
+    def from_web(cls, comment, identity_map=None):
+        """Build from a web API comment (raw, or patched by the web ClientCompatPatch)"""
+        user = comment.get('user') or comment.get('from')
+        return cls(
+            pk=_int(comment.get('id')),
+            text=comment.get('text'),
+            created_at=_int(comment.get('created_at', comment.get('created_time'))),
+            user=User.from_web(user, identity_map) if user else None,
+        )
+
+
+class Media(Model):
+    __slots__ = (
+        'pk', 'id', 'code', 'media_type', 'taken_at', 'user', 'caption',
+        'like_count', 'comment_count', 'view_count', 'has_liked',
+        'display_url', 'original_width', 'original_height', 'video_url', 'video_duration',
+        'location', 'carousel_media')
+
+    @classmethod
+    def from_app(cls, media, identity_map=None):
+        """Build from an app API media (raw, or patched by :meth:`ClientCompatPatch.media`)"""
+        carousel_media = tuple(cls.from_app(m, identity_map) for m in media.get('carousel_media') or []) or None
+        candidates = media.get('image_versions2', {}).get('candidates') or []
+        display = (
+            max(candidates, key=lambda c: c['width']) if candidates
+            else (media.get('images') or {}).get('standard_resolution')) or {}
+        video_versions = media.get('video_versions') or []
+        video = (
+            max(video_versions, key=lambda v: v['width']) if video_versions
+            else (media.get('videos') or {}).get('standard_resolution')) or {}
+        media_type = media.get('media_type') or MEDIA_TYPES.get(media.get('type'))
+        # display_url/video_url are only there if media is from to_dict()
+        display_url = display.get('url') or media.get('display_url')
+        video_url = video.get('url') or media.get('video_url')
+        if carousel_media:
+            # same as the patched media: the first carousel item is the cover
+            media_type = 8
+            display_url = carousel_media[0].display_url
+            video_url = carousel_media[0].video_url
+        caption = media.get('caption')
+        user = media.get('user')
+        return cls(
+            pk=_int(media.get('pk')) or _int(str(media.get('id', '')).split('_')[0]),
+            id=media.get('id'),
+            code=media.get('code') or _code_from_link(media.get('link')),
+            media_type=media_type,
+            taken_at=_int(media.get('taken_at') or media.get('created_time')),
+            user=User.from_app(user, identity_map) if user else None,
+            caption=(caption.get('text') if isinstance(caption, dict) else caption) or None,
+            like_count=_count(media, 'like_count', 'likes'),
+            comment_count=_count(media, 'comment_count', 'comments'),
+            view_count=media.get('view_count'),
+            has_liked=media.get('has_liked', media.get('user_has_liked')),
+            display_url=display_url,
+            original_width=media.get('original_width') or display.get('width'),
+            original_height=media.get('original_height') or display.get('height'),
+            video_url=video_url,
+            video_duration=media.get('video_duration'),
+            location=Location.from_app(media.get('location')),
+            carousel_media=carousel_media,
+        )
+
+    @classmethod
+    def from_web(cls, media, identity_map=None):
+        """Build from a web API media (raw, or patched by the web ClientCompatPatch)"""
+        owner = media.get('owner') or media.get('user')
+        images = media.get('images') or {}
+        videos = media.get('videos') or {}
+        dimensions = media.get('dimensions') or images.get('standard_resolution') or {}
+        caption = media.get('caption')
+        if isinstance(caption, dict):
+            caption = caption.get('text')
+        if media.get('carousel_media') or media.get('edge_sidecar_to_children', {}).get('edges'):
+            media_type = 8
+        elif media.get('is_video', media.get('type') == 'video'):
+            media_type = 2
+        else:
+            media_type = 1
+        # patched media ids are '<media id>_<owner id>'
+        media_id = str(media.get('id', ''))
+        if owner and '_' not in media_id:
+            media_id = '%s_%s' % (media_id, owner.get('id'))
+        children = media.get('carousel_media') or [
+            edge.get('node', {}) for edge in media.get('edge_sidecar_to_children', {}).get('edges', [])]
+        return cls(
+            pk=_int(media_id.split('_')[0]),
+            id=media_id,
+            code=media.get('code') or media.get('shortcode') or _code_from_link(media.get('link')),
+            media_type=media_type,
+            taken_at=_int(media.get('date') or media.get('created_time')),
+            user=User.from_web(owner, identity_map) if owner else None,
+            caption=caption or None,
+            like_count=_count(media, 'likes'),
+            comment_count=_count(media, 'comments'),
+            view_count=media.get('video_views'),
+            has_liked=media.get('user_has_liked'),
+            display_url=(
+                media.get('display_src') or media.get('display_url') or
+                images.get('standard_resolution', {}).get('url')),
+            original_width=dimensions.get('width'),
+            original_height=dimensions.get('height'),
+            video_url=media.get('video_url') or videos.get('standard_resolution', {}).get('url'),
+            location=Location.from_web(media.get('location')),
+            carousel_media=tuple(cls.from_web(m, identity_map) for m in children) or None,
+        )
+
+
+class Broadcast(Model):
+    __slots__ = (
+        'id', 'broadcast_status', 'broadcast_owner', 'media_id', 'published_time',
+        'viewer_count', 'broadcast_message', 'cover_frame_url',
+        'dash_playback_url', 'dash_abr_playback_url', 'rtmp_playback_url')
+
+    @classmethod
+    def from_app(cls, broadcast, identity_map=None):
+        """Build from an app API broadcast, for example from :meth:`Client.broadcast_info`"""
+        owner = broadcast.get('broadcast_owner')
+        viewer_count = broadcast.get('viewer_count')
+        return cls(
+            id=_int(broadcast.get('id')),
+            broadcast_status=broadcast.get('broadcast_status'),
+            broadcast_owner=User.from_app(owner, identity_map) if owner else None,
+            media_id=broadcast.get('media_id'),
+            published_time=broadcast.get('published_time'),
+            viewer_count=int(viewer_count) if viewer_count is not None else None,
+            broadcast_message=broadcast.get('broadcast_message') or None,
+            cover_frame_url=broadcast.get('cover_frame_url'),
+            dash_playback_url=broadcast.get('dash_playback_url'),
+            dash_abr_playback_url=broadcast.get('dash_abr_playback_url'),
+            rtmp_playback_url=broadcast.get('rtmp_playback_url'),
+        )
+
+
+class IdentityMap(object):
+    """
+    Keeps one shared user object per user pk, so that a user who appears in many
+    places (feed items, comments, captions, usertags, likers) is held in memory once,
+    and the latest profile values seen in any response show up everywhere.
+
+    Use with the ``identity_map`` option of :class:`Client` for response dicts, or pass
+    it to the models' ``from_app()``/``from_web()`` builders.
+    Up to ``max_size`` users are kept, and the least recently seen ones are dropped first.
+
+    .. code-block:: python
+
+        identity_map = IdentityMap()
+        api = Client(user_name, password, identity_map=identity_map)
+    """
+    INTERN_KEYS = ('username', 'full_name', 'profile_pic_url')
+
+    def __init__(self, max_size=10000):
+        """
+
+        :param max_size: Max. number of user dicts, and of user models, to keep. None for no limit.
+        """
+        self.max_size = max_size
+        self._users = OrderedDict()
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._users) + len(self._models)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._models.clear()
+
+    def _shared(self, entries, key, value):
+        """Get the entry for the key, or add the value, and mark it as the most recently seen"""
+        with self._lock:
+            shared = entries.pop(key, value)
+            entries[key] = shared
+            if self.max_size is not None and len(entries) > self.max_size:
+                entries.popitem(last=False)
+        return shared
+
+    def user(self, user):
+        """
+        Get the shared dict for the user, updated with the values from this one
+
+        :param user: app (``pk``) or web (``id``) user dict
+        :return: the shared dict
+        """
+        pk = user.get('pk', user.get('id'))
+        if pk is None:
+            return user
+        for key in self.INTERN_KEYS:
+            value = user.get(key)
+            if value:
+                user[key] = _intern(value)
+        shared = self._shared(self._users, _int(pk), user)
+        if shared is not user:
+            shared.update(user)
+            # lazily patched views (see ClientCompatPatch.lazy_hook): recompute from the new values
+            for lazy_key in getattr(shared, 'LAZY_KEYS', ()):
+                if not dict.__contains__(user, lazy_key):
+                    dict.pop(shared, lazy_key, None)
+        return shared
+
+    def user_model(self, user):
+        """
+        Get the shared :class:`User` model, updated with the non-empty values from this one
+
+        :param user: :class:`User`
+        :return: the shared :class:`User`
+        """
+        if user.pk is None:
+            return user
+        for key in self.INTERN_KEYS:
+            value = getattr(user, key)
+            if value:
+                setattr(user, key, _intern(value))
+        shared = self._shared(self._models, user.pk, user)
+        if shared is not user:
+            for name in User.__slots__:
+                value = getattr(user, name)
+                if value is not None:
+                    setattr(shared, name, value)
+        return shared
+
+    def hook(self, obj):
+        """``object_hook`` for :func:`json.loads` that replaces user objects with the shared ones"""
+        if 'username' in obj and ('pk' in obj or 'id' in obj):
+            return self.user(obj)
+        return obj
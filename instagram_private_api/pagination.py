@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from .compatpatch import Projection
+
+
+class Paginator(object):
+    """
+    Iterate over the pages of a paginated endpoint by passing each page's
+    ``next_max_id`` on as the ``max_id`` of the next call.
+
+    .. code-block:: python
+
+        followers = Paginator(api.user_followers, user_id, projection=['users.pk', 'users.username'])
+        for user in followers.items('users'):
+            print(user['username'])
+    """
+    ITEM_KEYS = ('items', 'users', 'ranked_items', 'comments', 'feed_items')
+
+    def __init__(self, fn, *args, **kwargs):
+        """
+
+        :param fn: endpoint method, for example :meth:`Client.user_followers`
+        :param args: positional arguments for fn
+        :param kwargs: keyword arguments for fn, for example **projection**, and:
+            - **max_pages**: Stop after this many pages. Default: no limit
+            - **max_id**: Start from this page
+        """
+        self.fn = fn
+        self.args = args
+        self.max_pages = kwargs.pop('max_pages', None)
+        if kwargs.get('projection') is not None:
+            # compile once for all the pages
+            kwargs['projection'] = Projection.of(kwargs['projection'])
+        self.kwargs = kwargs
+        self.pages = 0
+        self.next_max_id = kwargs.get('max_id')
+
+    def __iter__(self):
+        kwargs = dict(self.kwargs)
+        while True:
+            if self.next_max_id:
+                kwargs['max_id'] = self.next_max_id
+            page = self.fn(*self.args, **kwargs)
+            self.pages += 1
+            self.next_max_id = page.get('next_max_id')
+            yield page
+            if (not self.next_max_id or page.get('more_available') is False or
+                    (self.max_pages and self.pages >= self.max_pages)):
+                return
+
+    def items(self, key=None):
+        """
+        Iterate over the items of every page
+
+        :param key: key of the page's items list. Default: the first of :attr:`ITEM_KEYS` found
+        """
+        for page in self:
+            item_key = key or next((k for k in self.ITEM_KEYS if k in page), None)
+            for item in page.get(item_key, []) if item_key else []:
+                yield item
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+
+from .client import Client
+
+
+class ClientSpec(object):
+    """
+    A small picklable description of a client that can be sent to worker processes
+    and used to rebuild a ready-to-use client there, since a :class:`Client` itself
+    holds an opener and cookie jar that cannot be pickled.
+
+    .. code-block:: python
+
+        spec = ClientSpec.from_client(api)
+        # in the worker process
+        api = spec.build()
+    """
+
+    # Client keyword arguments that are carried over by :meth:`from_client`
+    CLIENT_KWARGS = ('auto_patch', 'drop_incompat_keys', 'lazy_patch', 'timeout', 'proxy', 'api_url')
+
+    def __init__(self, username, password, settings=None, client_class=None, **kwargs):
+        """
+
+        :param username: Login username
+        :param password: Login password
+        :param settings: A dict of settings from a logged in client, see :attr:`Client.settings`
+        :param client_class: Client class to build. Default: :class:`Client`
+        :param kwargs: Other :class:`Client` keyword arguments, e.g. auto_patch, timeout, proxy.
+            Values must be picklable.
+        """
+        self.username = username
+        self.password = password
+        self.settings = settings or {}
+        self.client_class = client_class or Client
+        self.client_kwargs = kwargs
+
+    @classmethod
+    def from_client(cls, client, **kwargs):
+        """
+        Create a spec from a logged in client
+
+        :param client:
+        :param kwargs: Override or add to the client keyword arguments
+        :return:
+        """
+        client_kwargs = dict(
+            (k, getattr(client, k)) for k in cls.CLIENT_KWARGS if getattr(client, k, None) is not None)
+        client_kwargs.update(kwargs)
+        return cls(
+            client.username, client.password, settings=client.settings,
+            client_class=client.__class__, **client_kwargs)
+
+    def build(self):
+        """Build a client from the spec. Does not login if the settings have a valid cookie."""
+        return self.client_class(
+            self.username, self.password, settings=self.settings, **self.client_kwargs)
+
+
+# The client for the current worker process, built by _init_worker()
+_worker_client = None
+
+
+def _init_worker(spec):
+    global _worker_client
+    _worker_client = spec.build()
+
+
+def _call_worker(task):
+    fn, args = task
+    if callable(fn):
+        return fn(_worker_client, *args)
+    return getattr(_worker_client, fn)(*args)
+
+
+class ClientProcessPool(object):
+    """
+    Process pool where every worker has its own client built from a :class:`ClientSpec`,
+    so that endpoint calls together with the response patching, or other CPU heavy
+    processing of the results, are spread across cores.
+
+    .. code-block:: python
+
+        with ClientProcessPool(ClientSpec.from_client(api), processes=4) as pool:
+            feeds = pool.map('user_feed', user_ids)
+            infos = pool.starmap('media_info', [(media_id, ) for media_id in media_ids])
+
+    Functions passed instead of a method name must be picklable, i.e. defined at the
+    module level, and are called with the worker's client as the first argument.
+    """
+
+    def __init__(self, spec, processes=None, maxtasksperchild=None):
+        """
+
+        :param spec: :class:`ClientSpec`
+        :param processes: Number of worker processes. Default: number of cpus
+        :param maxtasksperchild: See :class:`multiprocessing.pool.Pool`
+        """
+        self.spec = spec
+        self._pool = multiprocessing.Pool(
+            processes=processes, initializer=_init_worker, initargs=(spec, ),
+            maxtasksperchild=maxtasksperchild)
+
+    def map(self, fn, iterable, chunksize=None):
+        """
+        Call a client method (or function) for each item, results are in the same order
+
+        :param fn: Client method name, e.g. 'user_feed', or a function ``fn(client, item)``
+        :param iterable: the single argument for each call
+        :param chunksize: See :meth:`multiprocessing.pool.Pool.map`
+        :return: list of results
+        """
+        return self._pool.map(_call_worker, [(fn, (item, )) for item in iterable], chunksize)
+
+    def starmap(self, fn, iterable, chunksize=None):
+        """
+        Like :meth:`map` but each item is a tuple of arguments
+
+        :param fn: Client method name or a function ``fn(client, *args)``
+        :param iterable: tuples of arguments
+        :param chunksize:
+        :return: list of results
+        """
+        return self._pool.map(_call_worker, [(fn, tuple(args)) for args in iterable], chunksize)
+
+    def imap(self, fn, iterable, chunksize=1):
+        """Lazy version of :meth:`map`"""
+        return self._pool.imap(_call_worker, ((fn, (item, )) for item in iterable), chunksize)
+
+    def apply(self, fn, *args):
+        """Make a single call in a worker process"""
+        return self._pool.apply(_call_worker, ((fn, args), ))
+
+    def close(self):
+        self._pool.close()
+
+    def join(self):
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.terminate()
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+Prepare photos and videos for upload in worker processes: probe their size and duration,
+crop or pad them to an allowed aspect ratio and width, and make video thumbnails.
+
+Photos require Pillow, videos require the ``ffmpeg`` and ``ffprobe`` programs.
+
+.. code-block:: python
+
+    from instagram_private_api.preprocessing import MediaPreprocessor
+
+    preprocessor = MediaPreprocessor(processes=4, output_dir='/var/tmp/myapp')
+    # the post_video_story arguments: video_data, size, duration and thumbnail_data
+    kwargs = preprocessor.prepare('post_video_story', 'clip.mov').get()
+    api.post_video_story(**kwargs)
+
+    # or prepare in the background and add to a publishing.PublishQueue when done
+    preprocessor.submit(queue, 'myaccount', 'post_photo', 'photo.png', key='photo-123', caption='...')
+"""
+import os
+import math
+import json
+import uuid
+import logging
+import tempfile
+import subprocess
+import multiprocessing
+
+from .endpoints.upload import UploadEndpointsMixin
+
+logger = logging.getLogger(__name__)
+
+# min, max widths accepted by post_photo and post_video
+PHOTO_WIDTHS = (320, 1080)
+VIDEO_WIDTHS = (612, 1080)
+
+# min, max video durations in seconds
+VIDEO_DURATIONS = (3.0, 60.0)
+STORY_VIDEO_DURATIONS = (3.0, 15.0)
+
+# post_album only accepts square media
+ALBUM_RATIOS = (1.0, 1.0)
+
+# EXIF orientation tag, and its values for images stored turned by 90 or 270 degrees
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+PHOTO_METHODS = ('post_photo', 'post_photo_story')
+VIDEO_METHODS = ('post_video', 'post_video_story')
+
+
+def target_size(size, ratios, widths, mode='crop', even=False):
+    """
+    Work out how to fit media into an aspect ratio and width range
+
+    :param size: tuple of (width, height)
+    :param ratios: tuple of (min. ratio, max. ratio) of width / height
+    :param widths: tuple of (min. width, max. width)
+    :param mode: ``crop`` to cut the sides or the top and bottom off, or ``pad`` to add borders
+    :param even: round to even sizes, e.g. for video encoders
+    :return: tuple of (size of the centered crop or padded canvas, final size after scaling)
+    """
+    if mode not in ('crop', 'pad'):
+        raise ValueError('Unknown mode: %s' % mode)
+    step = 2 if even else 1
+    width, height = size
+    min_ratio, max_ratio = ratios
+    ratio = 1.0 * width / height
+    # a crop must fit in the media and a padded canvas must contain it
+    if ratio < min_ratio:
+        # too tall
+        if mode == 'crop':
+            height = int(width / min_ratio)
+        else:
+            width = int(math.ceil(height * min_ratio))
+    elif ratio > max_ratio:
+        # too wide
+        if mode == 'crop':
+            width = int(height * max_ratio)
+        else:
+            height = int(math.ceil(width / max_ratio))
+    if mode == 'crop':
+        canvas = (width - width % step, height - height % step)
+    else:
+        canvas = (width + width % step, height + height % step)
+
+    min_width, max_width = widths
+    scale = 1.0
+    if canvas[0] > max_width:
+        scale = 1.0 * max_width / canvas[0]
+    elif canvas[0] < min_width:
+        scale = 1.0 * min_width / canvas[0]
+    width, height = [int(round(v * scale)) for v in canvas]
+    width, height = width - width % step, height - height % step
+    # rounding must not take the ratio out of the range, so adjust the height
+    # which, unlike the width, has no limits
+    while height > step and 1.0 * width / height < min_ratio:
+        height -= step
+    while 1.0 * width / height > max_ratio:
+        height += step
+    return canvas, (width, height)
+
+
+def _output_path(output_dir, path, ext):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output_dir, '%s.%s.%s' % (name, uuid.uuid4().hex[:8], ext))
+
+
+def probe_image(path):
+    """
+    Size of an image as it is displayed, i.e. after its EXIF orientation
+
+    :param path:
+    :return: tuple of (width, height)
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError('Photo preprocessing requires Pillow')
+
+    with Image.open(path) as image:
+        # getexif() only reads the header, the image is not decoded
+        orientation = getattr(image, 'getexif', dict)().get(EXIF_ORIENTATION)
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            return image.size[1], image.size[0]
+        return image.size
+
+
+def prepare_photo(path, output_dir, ratios=None, mode='crop', story=False):
+    """
+    Crop or pad a photo to an allowed aspect ratio and width, and save it as a jpeg
+
+    :param path: image file path
+    :param output_dir: directory for the prepared photo
+    :param ratios: tuple of (min. ratio, max. ratio). Default: the feed or story ratios
+    :param mode: ``crop`` or ``pad``
+    :param story: prepare for :meth:`post_photo_story`
+    :return: dict of the ``photo_data`` path and ``size``
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise ImportError('Photo preprocessing requires Pillow')
+
+    if ratios is None:
+        ratios = UploadEndpointsMixin.reel_ratios() if story else UploadEndpointsMixin.standard_ratios()
+    with Image.open(path) as image:
+        # turn the pixels upright, since the EXIF data is not kept in the jpeg saved below
+        if hasattr(ImageOps, 'exif_transpose'):
+            image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+    canvas, size = target_size(image.size, ratios, PHOTO_WIDTHS, mode=mode)
+    width, height = image.size
+    if canvas != image.size:
+        left, top = (width - canvas[0]) // 2, (height - canvas[1]) // 2
+        if mode == 'crop':
+            image = image.crop((left, top, left + canvas[0], top + canvas[1]))
+        else:
+            padded = Image.new('RGB', canvas, (255, 255, 255))
+            padded.paste(image, (-left, -top))
+            image = padded
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS)
+    photo_path = _output_path(output_dir, path, 'jpg')
+    image.save(photo_path, 'JPEG', quality=90)
+    return {'photo_data': photo_path, 'size': list(size)}
+
+
+def _run(args):
+    try:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        raise ImportError('Video preprocessing requires %s' % args[0])
+    out, err = process.communicate()
+    if process.returncode != 0:
+        raise ValueError('%s failed: %s' % (args[0], err.decode('utf-8', 'replace').strip()[-500:]))
+    return out
+
+
+def _stream_size(stream):
+    """
+    Displayed size of an ffprobe video stream. ffmpeg applies the rotation when it transcodes.
+
+    :param stream: dict of the stream entries
+    :return: tuple of (width, height)
+    """
+    size = (int(stream['width']), int(stream['height']))
+    # ffmpeg < 5 reports the rotation as a tag, later versions as display matrix side data
+    rotations = [(stream.get('tags') or {}).get('rotate', 0)]
+    rotations.extend(side_data.get('rotation', 0) for side_data in stream.get('side_data_list') or [])
+    if any(int(float(rotation)) % 180 for rotation in rotations):
+        size = (size[1], size[0])
+    return size
+
+
+def probe_video(path):
+    """
+    Size and duration of a video
+
+    :param path:
+    :return: tuple of ((width, height), duration in seconds)
+    """
+    info = json.loads(_run([
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+        'stream=width,height:stream_tags=rotate:stream_side_data=rotation:format=duration',
+        '-of', 'json', path]).decode('utf-8'))
+    return _stream_size(info['streams'][0]), float(info['format']['duration'])
+
+
+def prepare_video(path, output_dir, ratios=None, mode='crop', story=False):
+    """
+    Crop or pad a video to an allowed aspect ratio and width, shorten it to the max.
+    duration, and make a thumbnail from it
+
+    :param path: video file path
+    :param output_dir: directory for the prepared video and thumbnail
+    :param ratios: tuple of (min. ratio, max. ratio). Default: the feed or story ratios
+    :param mode: ``crop`` or ``pad``
+    :param story: prepare for :meth:`post_video_story`
+    :return: dict of the ``video_data`` path, ``size``, ``duration`` and ``thumbnail_data`` path
+    """
+    if ratios is None:
+        ratios = UploadEndpointsMixin.reel_ratios() if story else UploadEndpointsMixin.standard_ratios()
+    min_duration, max_duration = STORY_VIDEO_DURATIONS if story else VIDEO_DURATIONS
+    size, duration = probe_video(path)
+    if duration < min_duration:
+        raise ValueError('Video is shorter than %ss: %s' % (min_duration, path))
+    canvas, final = target_size(size, ratios, VIDEO_WIDTHS, mode=mode, even=True)
+
+    video_path = path
+    if canvas != size or final != size or duration > max_duration or not path.lower().endswith('.mp4'):
+        if mode == 'crop':
+            filters = 'crop=%d:%d' % canvas
+        else:
+            filters = 'pad=%d:%d:(ow-iw)/2:(oh-ih)/2:white' % canvas
+        filters += ',scale=%d:%d,setsar=1' % final
+        video_path = _output_path(output_dir, path, 'mp4')
+        _run([
+            'ffmpeg', '-v', 'error', '-y', '-i', path, '-t', '%.3f' % max_duration, '-vf', filters,
+            '-c:v', 'libx264', '-preset', 'fast', '-pix_fmt', 'yuv420p', '-c:a', 'aac',
+            '-movflags', '+faststart', video_path])
+        duration = min(duration, max_duration)
+
+    thumbnail_path = _output_path(output_dir, path, 'jpg')
+    _run([
+        'ffmpeg', '-v', 'error', '-y', '-ss', '%.3f' % min(1.0, duration / 2), '-i', video_path,
+        '-frames:v', '1', '-q:v', '2', thumbnail_path])
+    return {'video_data': video_path, 'size': list(final), 'duration': duration, 'thumbnail_data': thumbnail_path}
+
+
+def _prepare(task):
+    """Prepare one media in a worker process"""
+    kind, path, options = task
+    try:
+        if kind == 'video':
+            return True, prepare_video(path, **options)
+        return True, prepare_photo(path, **options)
+    except Exception as e:
+        # returned instead of raised so that callbacks also get the errors on Python 2
+        return False, '%s: %s' % (e.__class__.__name__, e)
+
+
+def _album_child(media, prepared):
+    child = dict((k, v) for k, v in media.items() if k != 'data')
+    if media['type'] == 'video':
+        child.update({
+            'data': prepared['video_data'], 'size': prepared['size'],
+            'duration': prepared['duration'], 'thumbnail': prepared['thumbnail_data']})
+    else:
+        child.update({'data': prepared['photo_data'], 'size': prepared['size']})
+    return child
+
+
+class MediaPreprocessor(object):
+    """
+    Prepares media for the upload methods in a process pool, so that the image and
+    video work runs on other cores while uploads are in progress.
+    """
+
+    def __init__(self, processes=None, output_dir=None, mode='crop', pool=None):
+        """
+
+        :param processes: number of worker processes. Default: the number of CPUs
+        :param output_dir: directory for the prepared files. Default: a new temporary directory
+        :param mode: ``crop`` to cut media to the nearest allowed aspect ratio, or ``pad`` to add borders
+        :param pool: an existing ``multiprocessing.Pool`` to use instead
+        """
+        self.output_dir = output_dir or tempfile.mkdtemp(prefix='igpreprocess')
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.mode = mode
+        self._own_pool = pool is None
+        self.pool = pool or multiprocessing.Pool(processes)
+
+    def _tasks(self, method, media):
+        options = {'output_dir': self.output_dir, 'mode': self.mode}
+        if method in PHOTO_METHODS or method in VIDEO_METHODS:
+            options['story'] = method.endswith('_story')
+            return [('video' if method in VIDEO_METHODS else 'photo', media, options)]
+        if method == 'post_album':
+            options['ratios'] = ALBUM_RATIOS
+            return [('video' if m['type'] == 'video' else 'photo', m['data'], options) for m in media]
+        raise ValueError('Unsupported method: %s' % method)
+
+    @staticmethod
+    def _kwargs(method, media, results):
+        errors = [result for ok, result in results if not ok]
+        if errors:
+            raise ValueError('; '.join(errors))
+        if method == 'post_album':
+            return {'medias': [_album_child(m, prepared) for m, (_, prepared) in zip(media, results)]}
+        return results[0][1]
+
+    def prepare(self, method, media):
+        """
+        Prepare media in the background
+
+        :param method: the upload method, e.g. ``post_photo``, ``post_video_story`` or ``post_album``
+        :param media: the file path, or for ``post_album`` a list of ``{'type': ..., 'data': path}``
+            dicts (other keys, e.g. usertags, are kept)
+        :return: a result with a ``get(timeout=None)`` method that returns the method's
+            media keyword arguments, e.g. ``photo_data`` and ``size``
+        """
+        return _PreparedResult(
+            self.pool.map_async(_prepare, self._tasks(method, media)),
+            lambda results: self._kwargs(method, media, results))
+
+    def submit(self, queue, account, method, media, key=None, on_error=None, **kwargs):
+        """
+        Prepare media in the background, then add it to a publishing queue
+
+        :param queue: :class:`publishing.PublishQueue`
+        :param account: account name
+        :param method: the upload method
+        :param media: the file path, or for ``post_album`` a list of media dicts, see :meth:`prepare`
+        :param key: idempotency key of the job
+        :param on_error: Callback ``fn(key, exception)`` if the media cannot be prepared or queued
+        :param kwargs: other arguments of the method, e.g. caption
+        :return:
+        """
+        def prepared(results):
+            try:
+                job_kwargs = dict(kwargs)
+                job_kwargs.update(self._kwargs(method, media, results))
+                queue.submit(account, method, key=key, **job_kwargs)
+            except Exception as e:
+                logger.warning('Unable to queue %s: %s' % (key or media, e))
+                if on_error:
+                    on_error(key, e)
+
+        return self.pool.map_async(_prepare, self._tasks(method, media), callback=prepared)
+
+    def close(self):
+        """Wait for the pending work and stop the worker processes if the pool was created here"""
+        if self._own_pool:
+            self.pool.close()
+            self.pool.join()
+
+
+class _PreparedResult(object):
+
+    def __init__(self, async_result, convert):
+        self._async_result = async_result
+        self._convert = convert
+
+    def ready(self):
+        return self._async_result.ready()
+
+    def get(self, timeout=None):
+        return self._convert(self._async_result.get(timeout))
@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+A persistent queue of posts to publish, with per-account pacing and concurrency.
+
+.. code-block:: python
+
+    from instagram_private_api.publishing import JobStore, PublishQueue
+
+    store = JobStore('/var/lib/myapp/jobs')
+    # only when no other process publishes from this store
+    store.recover()
+    queue = PublishQueue(store, {'myaccount': api}, min_interval=120)
+    queue.submit('myaccount', 'post_photo', key='photo-123', photo_data='photo.jpg', size=(1080, 1080),
+                 caption='...')
+    queue.start()
+    ...
+    queue.stop()
+"""
+import os
+import re
+import errno
+import json
+import time
+import uuid
+import socket
+import random
+import logging
+import threading
+
+from .compat import compat_urllib_error
+from .errors import ClientError, ClientThrottledError
+from .uploads import ConfigureTask, UploadScheduler
+
+logger = logging.getLogger(__name__)
+
+# errors of a connection that failed or timed out, which _call_api does not wrap
+try:
+    CONNECTION_ERRORS = (compat_urllib_error.URLError, socket.timeout, ConnectionError)
+except NameError:   # Python 2
+    CONNECTION_ERRORS = (compat_urllib_error.URLError, socket.error)
+
+
+class PublishJob(object):
+    """
+    A post to publish, saved as a json record by a :class:`JobStore`.
+    The media data should be given as file paths so that the record can be saved.
+    """
+    PENDING = 'pending'
+    # the endpoint has been called
+    RUNNING = 'running'
+    # the configure request has been sent, so the post may exist from now on
+    CONFIGURING = 'configuring'
+    PUBLISHED = 'published'
+    FAILED = 'failed'
+    # the process stopped while the job was running, or the configure request failed
+    # without a definitive answer, so it may have been published
+    UNKNOWN = 'unknown'
+
+    METHODS = ('post_photo', 'post_photo_story', 'post_video', 'post_video_story', 'post_album')
+    VIDEO_METHODS = ('post_video', 'post_video_story')
+
+    def __init__(self, record):
+        """
+
+        :param record: dict of saved job data
+        """
+        self.record = record
+
+    @classmethod
+    def create(cls, account, method, key=None, **kwargs):
+        """
+        New pending job
+
+        :param account: name of the account to publish with
+        :param method: client method, one of :attr:`METHODS`
+        :param key: idempotency key. A job with the same key is only published once.
+            Default: a random key
+        :param kwargs: the method's arguments. Must be json serializable.
+        :return:
+        """
+        if method not in cls.METHODS:
+            raise ValueError('Unsupported publishing method: %s' % method)
+        return cls({
+            'key': key or uuid.uuid4().hex,
+            'account': account,
+            'method': method,
+            'kwargs': kwargs,
+            'status': cls.PENDING,
+            'attempts': 0,
+            'not_before': 0,
+            'created': time.time(),
+            'updated': time.time(),
+            'error': None,
+            'media_id': None,
+        })
+
+    @property
+    def key(self):
+        return self.record['key']
+
+    @property
+    def account(self):
+        return self.record['account']
+
+    @property
+    def method(self):
+        return self.record['method']
+
+    @property
+    def kwargs(self):
+        return self.record.get('kwargs') or {}
+
+    @property
+    def status(self):
+        return self.record['status']
+
+    @property
+    def attempts(self):
+        return self.record.get('attempts', 0)
+
+    @property
+    def not_before(self):
+        """Timestamp before which the job is not retried"""
+        return self.record.get('not_before', 0)
+
+    @property
+    def error(self):
+        return self.record.get('error')
+
+    @property
+    def media_id(self):
+        return self.record.get('media_id')
+
+    @property
+    def is_done(self):
+        return self.status in (self.PUBLISHED, self.FAILED, self.UNKNOWN)
+
+    def update(self, **values):
+        self.record.update(values)
+        self.record['updated'] = time.time()
+
+    def __repr__(self):
+        return '<PublishJob %s %s %s>' % (self.key, self.method, self.status)
+
+
+class JobStore(object):
+    """
+    Saves :class:`PublishJob` records to a directory, one json file per job named after its key
+    """
+
+    def __init__(self, directory):
+        """
+
+        :param directory: Directory for the job files. Created if it does not exist.
+        """
+        self.directory = directory
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another process in the meantime
+                if not os.path.isdir(directory):
+                    raise
+
+    def path(self, key, ext='json'):
+        return os.path.join(self.directory, '%s.%s' % (re.sub(r'[^\w.-]', '_', key), ext))
+
+    def add(self, job):
+        """
+        Save a new job, unless there is already one with the same key
+
+        :param job: :class:`PublishJob`
+        :return: the saved job, which is the existing one if the key is not new
+        """
+        try:
+            fd = os.open(self.path(job.key), os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return self.load(job.key) or job
+        with os.fdopen(fd, 'w') as job_file:
+            json.dump(job.record, job_file)
+        return job
+
+    def save(self, job):
+        """Save a job. The file is replaced atomically."""
+        job_path = self.path(job.key)
+        temp_path = '%s.%d.tmp' % (job_path, os.getpid())
+        with open(temp_path, 'w') as job_file:
+            json.dump(job.record, job_file)
+        getattr(os, 'replace', os.rename)(temp_path, job_path)
+
+    def load(self, key):
+        """
+        Get a saved job
+
+        :param key:
+        :return: :class:`PublishJob` or None
+        """
+        try:
+            with open(self.path(key)) as job_file:
+                return PublishJob(json.load(job_file))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def jobs(self, status=None):
+        """
+        Saved jobs, oldest first
+
+        :param status: only the jobs with this status
+        :return: list of :class:`PublishJob`
+        """
+        jobs = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith('.json'):
+                continue
+            job = self.load(file_name[:-len('.json')])
+            if job is not None and (status is None or job.status == status):
+                jobs.append(job)
+        jobs.sort(key=lambda j: j.record.get('created', 0))
+        return jobs
+
+    def recover(self):
+        """
+        Mark the jobs that were running when the process stopped as :attr:`PublishJob.UNKNOWN`,
+        since they may have been published. They are not retried.
+
+        The store is not locked: call this at startup, before a :class:`PublishQueue` is started,
+        and only when no other process is publishing from the same directory, since its running
+        jobs would be marked unknown too.
+
+        :return: list of the recovered jobs
+        """
+        jobs = []
+        for job in self.jobs():
+            if job.status in (PublishJob.RUNNING, PublishJob.CONFIGURING):
+                job.update(status=PublishJob.UNKNOWN, error='Interrupted while publishing')
+                self.save(job)
+                jobs.append(job)
+        return jobs
+
+
+class PublishQueue(object):
+    """
+    Publishes the pending jobs of a :class:`JobStore` in background threads.
+
+    - Each account starts at most one job every ``min_interval`` seconds, and has at most
+      ``concurrency`` jobs uploading at the same time.
+    - Jobs that fail with a throttling, server or connection error are retried with a backoff,
+      and a throttled account is paused.
+    - A job is published once per key: published jobs, and jobs that were interrupted while
+      publishing and marked unknown with :meth:`JobStore.recover`, are never run again. Once
+      the configure request has been sent, a job is not retried either: a throttling, server
+      or connection error then leaves it :attr:`PublishJob.UNKNOWN`.
+    - Videos are uploaded with a resumable state file, and their configure step runs on an
+      :class:`uploads.UploadScheduler` so that the account can start its next upload meanwhile.
+    """
+
+    def __init__(self, store, clients, **kwargs):
+        """
+
+        :param store: :class:`JobStore`
+        :param clients: dict of account name -> logged in client
+        :param kwargs:
+            - **min_interval**: Min. seconds between the start of two jobs of an account. Default: 60
+            - **concurrency**: Max. number of jobs of an account uploading at the same time. Default: 1
+            - **max_attempts**: Max. number of attempts of a job. Default: 3
+            - **retry_interval**: Seconds before the first retry of a failed job, doubled for
+              every following retry. Default: 300
+            - **throttle_interval**: Seconds an account is paused after it has been throttled. Default: 900
+            - **poll_interval**: Seconds between checks for due jobs. Default: 1
+            - **scheduler**: :class:`uploads.UploadScheduler` for the video configure steps. Default: a new one
+            - **on_done**: Callback ``fn(job)`` when a job is published, has failed for good, or is unknown
+        """
+        self.store = store
+        self.clients = clients
+        self.min_interval = kwargs.pop('min_interval', 60)
+        self.concurrency = max(1, int(kwargs.pop('concurrency', 1)))
+        self.max_attempts = kwargs.pop('max_attempts', 3)
+        self.retry_interval = kwargs.pop('retry_interval', 300)
+        self.throttle_interval = kwargs.pop('throttle_interval', 900)
+        self.poll_interval = kwargs.pop('poll_interval', 1)
+        self.scheduler = kwargs.pop('scheduler', None) or UploadScheduler()
+        self.on_done = kwargs.pop('on_done', None)
+
+        self._lock = threading.RLock()
+        # account -> number of jobs uploading
+        self._running = {}
+        # account -> timestamp of the next allowed job start
+        self._next_start = {}
+        self._in_flight = set()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # key -> job, so that the store is not read on every check
+        self._pending = dict((job.key, job) for job in self.store.jobs(PublishJob.PENDING))
+
+    def submit(self, account, method, key=None, **kwargs):
+        """
+        Add a job. If a job with the same key exists, it is returned instead and nothing is added.
+
+        :param account: name of the account, a key of ``clients``
+        :param method: client method, e.g. ``post_photo`` or ``post_video_story``
+        :param key: idempotency key, e.g. the id of the post in your own system
+        :param kwargs: the method's arguments, with file paths for the media data
+        :return: :class:`PublishJob`
+        """
+        if account not in self.clients:
+            raise ValueError('Unknown account: %s' % account)
+        job = self.store.add(PublishJob.create(account, method, key=key, **kwargs))
+        if job.status == PublishJob.PENDING:
+            with self._lock:
+                self._pending.setdefault(job.key, job)
+        return job
+
+    @staticmethod
+    def is_transient(error):
+        """True if a failed job can be retried: it was throttled, or the server or the connection failed"""
+        if isinstance(error, ClientThrottledError):
+            return True
+        if isinstance(error, (ClientError, compat_urllib_error.HTTPError)):
+            return error.code == 429 or (error.code or 0) >= 500
+        return isinstance(error, CONNECTION_ERRORS)
+
+    def due(self, now=None):
+        """
+        Pending jobs that can be started now, oldest first and at most one per account
+
+        :param now: timestamp, defaults to the current time
+        :return: list of :class:`PublishJob`
+        """
+        now = now or time.time()
+        due_jobs = []
+        accounts = set()
+        with self._lock:
+            for job in sorted(self._pending.values(), key=lambda j: j.record.get('created', 0)):
+                if job.key in self._in_flight or job.account in accounts or job.not_before > now:
+                    continue
+                if (self._running.get(job.account, 0) >= self.concurrency or
+                        self._next_start.get(job.account, 0) > now):
+                    continue
+                accounts.add(job.account)
+                due_jobs.append(job)
+        return due_jobs
+
+    def check(self, now=None):
+        """
+        Start the jobs that are due. Returns immediately, the jobs run in worker threads.
+
+        :param now: timestamp, defaults to the current time
+        :return: list of threads started
+        """
+        threads = []
+        for job in self.due(now):
+            with self._lock:
+                self._pending.pop(job.key, None)
+                self._in_flight.add(job.key)
+                self._running[job.account] = self._running.get(job.account, 0) + 1
+                # a little jitter so that posts do not look scheduled
+                self._next_start[job.account] = (
+                    time.time() + self.min_interval + random.uniform(0, 0.1 * self.min_interval))
+            thread = threading.Thread(target=self._publish, args=(job, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _publish(self, job):
+        kwargs = dict(job.kwargs)
+        kwargs['on_configure'] = lambda upload_id: self._configuring(job, upload_id)
+        if job.method in PublishJob.VIDEO_METHODS:
+            kwargs.setdefault('state_file', self.store.path(job.key, 'upload'))
+            kwargs['scheduler'] = self.scheduler
+        job.update(status=PublishJob.RUNNING, attempts=job.attempts + 1)
+        try:
+            self.store.save(job)
+            logger.debug('Publishing %s with %s' % (job, job.account))
+            res = getattr(self.clients[job.account], job.method)(**kwargs)
+        except Exception as e:
+            self._failed(job, e)
+            return
+        finally:
+            with self._lock:
+                self._running[job.account] -= 1
+
+        if isinstance(res, ConfigureTask):
+            res.add_done_callback(lambda task: self._configured(job, task))
+        else:
+            self._published(job, res)
+
+    def _configuring(self, job, upload_id):
+        # saved before the configure request, so that a failure from now on is not retried
+        job.update(status=PublishJob.CONFIGURING, upload_id=upload_id)
+        self.store.save(job)
+
+    def _configured(self, job, task):
+        error = task.exception()
+        if error is not None:
+            self._failed(job, error)
+        else:
+            self._published(job, task.result())
+
+    def _published(self, job, res):
+        media = (res or {}).get('media') or {}
+        job.update(status=PublishJob.PUBLISHED, error=None, media_id=media.get('id') or media.get('pk'))
+        self._done(job)
+
+    def _failed(self, job, error):
+        logger.warning('Publishing %s failed: %s' % (job, error))
+        now = time.time()
+        if isinstance(error, ClientThrottledError) or getattr(error, 'code', None) == 429:
+            with self._lock:
+                self._next_start[job.account] = max(
+                    self._next_start.get(job.account, 0), now + self.throttle_interval)
+        if job.status == PublishJob.CONFIGURING and (
+                self.is_transient(error) or not isinstance(error, ClientError)):
+            # the configure request may have gone through
+            job.update(status=PublishJob.UNKNOWN, error=str(error))
+            self._done(job)
+            return
+        if self.is_transient(error) and job.attempts < self.max_attempts:
+            job.update(
+                status=PublishJob.PENDING, error=str(error),
+                not_before=now + self.retry_interval * 2 ** (job.attempts - 1))
+            self.store.save(job)
+            with self._lock:
+                self._in_flight.discard(job.key)
+                self._pending[job.key] = job
+            return
+        job.update(status=PublishJob.FAILED, error=str(error))
+        self._done(job)
+
+    def _done(self, job):
+        self.store.save(job)
+        with self._lock:
+            self._in_flight.discard(job.key)
+        if self.on_done:
+            try:
+                self.on_done(job)
+            except Exception as e:
+                logger.error('Publish callback failed: %s' % e)
+
+    @property
+    def pending(self):
+        """Number of jobs waiting to be started, including the ones waiting for a retry"""
+        with self._lock:
+            return len(self._pending)
+
+    @property
+    def in_flight(self):
+        """Number of jobs running or waiting for their configure step"""
+        with self._lock:
+            return len(self._in_flight)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.check()
+            except Exception as e:  # keep the queue alive
+                logger.error('Publish check failed: %s' % e)
+            self._stop_event.wait(self.poll_interval)
+
+    def start(self):
+        """Start publishing in a background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop starting jobs. Jobs that are already running are allowed to complete.
+
+        :param timeout: max. seconds to wait for them
+        :return:
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        deadline = None if timeout is None else time.time() + timeout
+        while self.in_flight and (deadline is None or time.time() < deadline):
+            time.sleep(0.05)
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+import random
+import os
+import re
+import json
+import codecs
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from .client import Client
+from .errors import ClientCookieExpiredError
+from .http import ClientCookieJar
+
+logger = logging.getLogger(__name__)
+
+
+class ClientSessionRefresher(object):
+    """
+    Watches the cookie expiry of a set of live clients and refreshes their
+    sessions in the background before they expire, so that long running
+    jobs do not stall on a ``ClientLoginRequiredError`` mid-crawl.
+
+    Refreshes run with bounded concurrency and are spaced out so that
+    logins for many accounts do not happen in a burst.
+
+    .. code-block:: python
+
+        refresher = ClientSessionRefresher(margin=2 * 24 * 60 * 60, concurrency=2)
+        for api in clients:
+            refresher.register(api)
+        refresher.start()
+        ...
+        refresher.stop()
+    """
+
+    def __init__(self, **kwargs):
+        """
+
+        :param kwargs:
+            - **margin**: Refresh sessions that expire within this many seconds. Default: 1 day
+            - **interval**: Seconds between expiry checks. Default: 60
+            - **concurrency**: Max. number of refreshes running at the same time. Default: 1
+            - **min_login_interval**: Min. seconds between the start of two refreshes. Default: 30
+            - **retry_interval**: Seconds to wait before retrying a failed refresh. Default: 600
+            - **refresh_handler**: Default handler, a callable that takes the expiring client and
+              refreshes it in place or returns a replacement client, e.g. for another account.
+              Default: :meth:`relogin`
+            - **on_refresh**: Callback ``fn(old_client, new_client)`` after a successful refresh
+            - **on_error**: Callback ``fn(client, exception)`` after a failed refresh
+        """
+        self.margin = kwargs.pop('margin', 24 * 60 * 60)
+        self.interval = kwargs.pop('interval', 60)
+        self.concurrency = max(1, int(kwargs.pop('concurrency', 1)))
+        self.min_login_interval = kwargs.pop('min_login_interval', 30)
+        self.retry_interval = kwargs.pop('retry_interval', 600)
+        self.refresh_handler = kwargs.pop('refresh_handler', None) or self.relogin
+        self.on_refresh = kwargs.pop('on_refresh', None)
+        self.on_error = kwargs.pop('on_error', None)
+
+        self._entries = []
+        self._in_flight = set()
+        self._retry_after = {}
+        self._lock = threading.RLock()
+        self._pace_lock = threading.Lock()
+        self._last_refresh_start = 0
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def clients(self):
+        """The currently registered clients, including any replacements from refreshes."""
+        with self._lock:
+            return [entry[0] for entry in self._entries]
+
+    def register(self, client, refresh_handler=None):
+        """
+        Start watching a client
+
+        :param client: a logged in client
+        :param refresh_handler: Optional handler for this client only, see :meth:`__init__`
+        :return:
+        """
+        with self._lock:
+            self.unregister(client)
+            self._entries.append([client, refresh_handler])
+
+    def unregister(self, client):
+        """Stop watching a client"""
+        with self._lock:
+            self._entries = [entry for entry in self._entries if entry[0] is not client]
+            self._retry_after.pop(id(client), None)
+
+    @classmethod
+    def relogin(cls, client):
+        """
+        Default refresh handler. Discards the client's cookies and logs in again.
+        The previous cookies are restored if the login fails.
+
+        :param client:
+        :return: the same client
+        """
+        cookie_string = client.cookie_jar.dump()
+        client.cookie_jar.clear()
+        try:
+            client.login()
+        except Exception:
+            client.cookie_jar.load(cookie_string)
+            raise
+        return client
+
+    def expires_in(self, client, now=None):
+        """Seconds until the earliest expiring cookie of the client, or None if unknown."""
+        expires_earliest = client.cookie_jar.expires_earliest
+        if not expires_earliest:
+            return None
+        return expires_earliest - (now or time.time())
+
+    def due(self, now=None):
+        """
+        Clients that should be refreshed now, soonest expiry first
+
+        :param now: timestamp, defaults to the current time
+        :return: list of clients
+        """
+        now = now or time.time()
+        due_clients = []
+        with self._lock:
+            for client, _ in self._entries:
+                if id(client) in self._in_flight or getattr(client, '_login_pending', False):
+                    continue
+                if self._retry_after.get(id(client), 0) > now:
+                    continue
+                expires_in = self.expires_in(client, now)
+                if expires_in is not None and expires_in <= self.margin:
+                    due_clients.append((expires_in, client))
+        due_clients.sort(key=lambda x: x[0])
+        return [client for _, client in due_clients]
+
+    def check(self, now=None):
+        """
+        Refresh all clients that are due. Returns immediately, the refreshes run in worker threads.
+
+        :param now: timestamp, defaults to the current time
+        :return: list of threads started
+        """
+        threads = []
+        for client in self.due(now):
+            with self._lock:
+                if id(client) in self._in_flight:
+                    continue
+                self._in_flight.add(id(client))
+            thread = threading.Thread(target=self._refresh, args=(client, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _pace(self):
+        """Space out the start of refreshes by at least ``min_login_interval`` seconds"""
+        with self._pace_lock:
+            wait = self._last_refresh_start + self.min_login_interval - time.time()
+            if wait > 0:
+                # a little jitter so that refreshes do not look scheduled
+                self._stop_event.wait(wait + random.uniform(0, 0.1 * self.min_login_interval))
+            self._last_refresh_start = time.time()
+
+    def _refresh(self, client):
+        try:
+            with self._slots:
+                if self._stop_event.is_set():
+                    return
+                self._pace()
+                if self._stop_event.is_set():
+                    return
+                with self._lock:
+                    handler = next(
+                        (entry[1] for entry in self._entries if entry[0] is client), None) or self.refresh_handler
+                logger.debug('Refreshing session expiring in %ss' % self.expires_in(client))
+                try:
+                    new_client = handler(client) or client
+                except Exception as e:
+                    logger.warning('Unable to refresh session: %s' % e)
+                    with self._lock:
+                        self._retry_after[id(client)] = time.time() + self.retry_interval
+                    if self.on_error:
+                        self.on_error(client, e)
+                    return
+
+                with self._lock:
+                    self._retry_after.pop(id(client), None)
+                    for entry in self._entries:
+                        if entry[0] is client:
+                            entry[0] = new_client
+                if self.on_refresh:
+                    self.on_refresh(client, new_client)
+        finally:
+            with self._lock:
+                self._in_flight.discard(id(client))
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.check()
+            except Exception as e:  # keep the refresher alive
+                logger.error('Session refresh check failed: %s' % e)
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        """Start checking for expiring sessions in a background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the background thread. Refreshes that are already running are allowed to complete."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+class ClientFileLock(object):
+    """
+    Exclusive lock on a file, shared between processes.
+
+    .. code-block:: python
+
+        with ClientFileLock('/tmp/myaccount.lock'):
+            ...
+    """
+
+    def __init__(self, path, timeout=None, poll_interval=0.1):
+        """
+
+        :param path: Path of the lock file. It is created if it does not exist.
+        :param timeout: Seconds to wait for the lock before raising an IOError. Default: wait forever
+        :param poll_interval: Seconds between attempts to acquire the lock
+        """
+        self.path = path
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._fd = None
+
+    def _try_lock(self, fd):
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except (IOError, OSError):
+            return False
+
+    def acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        started = time.time()
+        while not self._try_lock(fd):
+            if self.timeout is not None and time.time() - started >= self.timeout:
+                os.close(fd)
+                raise IOError('Timed out waiting for lock: %s' % self.path)
+            time.sleep(self.poll_interval)
+        self._fd = fd
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def _to_json(python_object):
+    if isinstance(python_object, bytes):
+        return {'__class__': 'bytes',
+                '__value__': codecs.encode(python_object, 'base64').decode()}
+    raise TypeError(repr(python_object) + ' is not JSON serializable')
+
+
+def _from_json(json_object):
+    if '__class__' in json_object and json_object['__class__'] == 'bytes':
+        return codecs.decode(json_object['__value__'].encode(), 'base64')
+    return json_object
+
+
+class SharedSessionStore(object):
+    """
+    Shares the login settings of accounts between processes through a directory,
+    so that when several workers use the same account only one of them logs in
+    while the others wait for and reuse the resulting :attr:`Client.settings`.
+
+    .. code-block:: python
+
+        store = SharedSessionStore('/var/run/myapp/sessions')
+        api = store.client('username', 'password', auto_patch=True)
+
+        # refresh through the store so that other processes pick up the new session
+        refresher = ClientSessionRefresher(refresh_handler=store.refresh)
+        refresher.register(api)
+    """
+
+    def __init__(self, directory, **kwargs):
+        """
+
+        :param directory: Directory for the settings and lock files. Created if it does not exist.
+        :param kwargs:
+            - **lock_timeout**: Seconds to wait for another process to finish logging in. Default: wait forever
+            - **margin**: Saved sessions expiring within this many seconds are not reused. Default: 0
+            - **client_class**: Client class to instantiate. Default: :class:`Client`
+        """
+        self.directory = directory
+        self.lock_timeout = kwargs.pop('lock_timeout', None)
+        self.margin = kwargs.pop('margin', 0)
+        self.client_class = kwargs.pop('client_class', None) or Client
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another process in the meantime
+                if not os.path.isdir(directory):
+                    raise
+
+    def _path(self, username, ext):
+        return os.path.join(self.directory, '%s.%s' % (re.sub(r'[^\w.-]', '_', username), ext))
+
+    def lock(self, username):
+        """The cross-process lock for an account"""
+        return ClientFileLock(self._path(username, 'lock'), timeout=self.lock_timeout)
+
+    def load_settings(self, username):
+        """
+        Get the saved settings for an account
+
+        :param username:
+        :return: settings dict or None
+        """
+        try:
+            with open(self._path(username, 'json')) as settings_file:
+                return json.load(settings_file, object_hook=_from_json)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save_settings(self, username, settings):
+        """Save the settings for an account. The file is replaced atomically."""
+        settings_path = self._path(username, 'json')
+        temp_path = '%s.%d.tmp' % (settings_path, os.getpid())
+        with open(temp_path, 'w') as settings_file:
+            json.dump(settings, settings_file, default=_to_json)
+        getattr(os, 'replace', os.rename)(temp_path, settings_path)
+
+    def _expires(self, settings):
+        if not settings or not settings.get('cookie'):
+            return None
+        return ClientCookieJar(cookie_string=settings['cookie']).expires_earliest
+
+    def _usable(self, settings):
+        expires = self._expires(settings)
+        return bool(expires and expires - self.margin > time.time())
+
+    def client(self, username, password, **kwargs):
+        """
+        Get a client for an account, reusing the saved session if there is one.
+        If not, log in while holding the account lock and save the new session.
+
+        :param username:
+        :param password:
+        :param kwargs: Other :class:`Client` keyword arguments
+        :return: a logged in client
+        """
+        for k in ('lazy_login', 'cookie', 'settings'):
+            kwargs.pop(k, None)
+        with self.lock(username):
+            settings = self.load_settings(username)
+            if self._usable(settings):
+                try:
+                    return self.client_class(username, password, settings=settings, **kwargs)
+                except ClientCookieExpiredError:
+                    pass
+            if settings:
+                # keep the same device identity, but without the old session
+                settings = dict(settings)
+                settings.pop('cookie', None)
+                kwargs['settings'] = settings
+            api = self.client_class(username, password, **kwargs)
+            self.save_settings(username, api.settings)
+            return api
+
+    def refresh(self, client):
+        """
+        Refresh the session of a client. If another process has already saved a newer
+        session for the account, that is reused instead of logging in again.
+        Can be used as the ``refresh_handler`` of a :class:`ClientSessionRefresher`.
+
+        :param client:
+        :return: the same client
+        """
+        with self.lock(client.username):
+            settings = self.load_settings(client.username)
+            current_expiry = client.cookie_jar.expires_earliest or 0
+            saved_expiry = self._expires(settings)
+            if (self._usable(settings) and saved_expiry >= current_expiry and
+                    settings['cookie'] != client.cookie_jar.dump()):
+                # another process has already logged in
+                client.cookie_jar.load(settings['cookie'])
+                return client
+            ClientSessionRefresher.relogin(client)
+            self.save_settings(client.username, client.settings)
+            return client
@@ -0,0 +1,610 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import heapq
+import hashlib
+import logging
+import itertools
+import threading
+
+from .errors import ClientError
+from .utils import ByteRanges, Chunk
+
+logger = logging.getLogger(__name__)
+
+
+class UploadState(object):
+    """
+    Progress of a video upload, saved to a json file after every chunk so that an
+    interrupted upload can be resumed by another process instead of starting over.
+
+    .. code-block:: python
+
+        api.post_video('video.mp4', size, duration, 'thumbnail.jpg', caption='...',
+                       state_file='video.mp4.upload')
+        # after a crash or a network failure, in a new process
+        api.resume_video_upload('video.mp4.upload', 'video.mp4', 'thumbnail.jpg')
+    """
+    # Do not resume uploads that were started longer ago than this, in seconds,
+    # since the upload urls expire
+    MAX_AGE = 12 * 60 * 60
+
+    # Bytes from the start and end of the data used to recognise it
+    FINGERPRINT_SIZE = 64 * 1024
+
+    def __init__(self, path, state=None):
+        """
+
+        :param path: state file path
+        :param state: dict of saved state
+        """
+        self.path = path
+        self.state = state or {}
+
+    @classmethod
+    def fingerprint(cls, data):
+        """
+        Identify the upload data by its length and a hash of its start and end
+
+        :param data: bytes or a mapped file
+        :return:
+        """
+        digest = hashlib.sha1()
+        digest.update(data[:cls.FINGERPRINT_SIZE])
+        digest.update(data[-cls.FINGERPRINT_SIZE:])
+        return '%d:%s' % (len(data), digest.hexdigest())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a saved state
+
+        :param path:
+        :return: :class:`UploadState` or None if there is no readable state file
+        """
+        try:
+            with open(path) as state_file:
+                return cls(path, json.load(state_file))
+        except (IOError, OSError, ValueError):
+            return None
+
+    @classmethod
+    def open(cls, path, data, params=None):
+        """
+        Load the saved state for the data, or start a new one if there is none,
+        or if it is for other data or too old
+
+        :param path: state file path
+        :param data: upload data, bytes or a mapped file
+        :param params: the upload parameters to save, e.g. for the configure call
+        :return: :class:`UploadState`
+        """
+        fingerprint = cls.fingerprint(data)
+        state = cls.load(path)
+        if (state is None or state.state.get('fingerprint') != fingerprint or
+                time.time() - state.state.get('started', 0) > cls.MAX_AGE):
+            state = cls(path, {'fingerprint': fingerprint, 'length': len(data)})
+        if params is not None:
+            state.state['params'] = params
+        return state
+
+    @property
+    def upload_id(self):
+        return self.state.get('upload_id')
+
+    @property
+    def upload_url(self):
+        return self.state.get('upload_url')
+
+    @property
+    def upload_job(self):
+        return self.state.get('upload_job')
+
+    @property
+    def chunk_count(self):
+        return self.state.get('chunk_count')
+
+    @property
+    def chunk_size(self):
+        return self.state.get('chunk_size')
+
+    @property
+    def params(self):
+        return self.state.get('params') or {}
+
+    @property
+    def is_started(self):
+        return bool(self.upload_id)
+
+    @property
+    def is_uploaded(self):
+        return self.state.get('uploaded', False)
+
+    @property
+    def ranges(self):
+        """:class:`utils.ByteRanges` of the data already sent"""
+        ranges = ByteRanges(self.state.get('length', 0), self.state.get('sent'))
+        ranges.acknowledged = self.state.get('acknowledged', 0)
+        return ranges
+
+    def start(self, upload_id, upload_url, upload_job, chunk_count, chunk_size=None):
+        """Record a new upload"""
+        self.state.update({
+            'upload_id': upload_id,
+            'upload_url': upload_url,
+            'upload_job': upload_job,
+            'chunk_count': chunk_count,
+            'chunk_size': chunk_size,
+            'started': time.time(),
+            'sent': [],
+            'acknowledged': 0,
+            'uploaded': False,
+        })
+        self.save()
+
+    def update(self, ranges, uploaded=False):
+        """
+        Record the progress
+
+        :param ranges: :class:`utils.ByteRanges`
+        :param uploaded: True when all the data has been sent
+        :return:
+        """
+        self.state['sent'] = ranges.to_list()
+        self.state['acknowledged'] = ranges.acknowledged
+        self.state['uploaded'] = uploaded
+        self.save()
+
+    def save(self):
+        """Save the state. The file is replaced atomically."""
+        temp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(temp_path, 'w') as state_file:
+            json.dump(self.state, state_file)
+        getattr(os, 'replace', os.rename)(temp_path, self.path)
+
+    def delete(self):
+        """Remove the state file, e.g. after the upload has been configured"""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class UploadMetrics(object):
+    """
+    Timings and throughput of a photo or video upload
+
+    .. code-block:: python
+
+        metrics = UploadMetrics()
+        api.post_video(video_data, size, duration, thumbnail_data, chunk_size='auto', metrics=metrics)
+        metrics.throughput, metrics.rtt, metrics.to_dict()
+    """
+
+    def __init__(self):
+        self.upload_id = None
+        self.total = 0
+        # list of dicts with the index, start, end, seconds and attempts of each chunk
+        self.chunks = []
+        self.retries = 0
+        # phase -> seconds: negotiate (upload session), transfer (chunks), processing
+        # (configure delay and retries while the server processes the video), configure
+        self.phases = {}
+
+    def add_chunk(self, chunk, seconds, attempts=1):
+        self.chunks.append({
+            'index': chunk.index, 'start': chunk.start, 'end': chunk.end,
+            'seconds': seconds, 'attempts': attempts,
+        })
+        self.retries += attempts - 1
+
+    @property
+    def sent(self):
+        """Bytes sent in successful chunk requests"""
+        return sum(c['end'] - c['start'] for c in self.chunks)
+
+    @property
+    def throughput(self):
+        """Bytes per second over the transfer phase"""
+        seconds = self.phases.get('transfer')
+        return self.sent / seconds if seconds else None
+
+    @property
+    def rtt(self):
+        """Round trip estimate in seconds from the negotiate call, the smallest request of an upload"""
+        return self.phases.get('negotiate')
+
+    def to_dict(self):
+        return {
+            'upload_id': self.upload_id,
+            'total': self.total,
+            'sent': self.sent,
+            'retries': self.retries,
+            'throughput': self.throughput,
+            'rtt': self.rtt,
+            'phases': dict(self.phases),
+            'chunks': list(self.chunks),
+        }
+
+
+class AdaptiveChunker(object):
+    """
+    Sizes video chunks from the measured throughput. A small probe chunk is sent first,
+    and each following chunk is sized to take :attr:`target_seconds`, which is long enough
+    for the per-request round trip to be a small part of it (:attr:`OVERHEAD_RATIO`) but
+    short enough that re-sending a failed chunk is cheap (:attr:`MAX_CHUNK_SECONDS`).
+
+    Iterating over the chunker yields the :class:`utils.Chunk` for the next range that
+    has not been sent. Call :meth:`record` with the time each chunk took.
+    """
+    PROBE_SIZE = 256 * 1024
+    MIN_CHUNK_SIZE = 128 * 1024
+    MAX_CHUNK_SIZE = 16 * 1024 * 1024
+    # max. share of a chunk's time spent on the request round trip
+    OVERHEAD_RATIO = 0.05
+    MIN_CHUNK_SECONDS = 0.5
+    MAX_CHUNK_SECONDS = 5.0
+    # weight of the latest throughput sample
+    SMOOTHING = 0.5
+
+    def __init__(self, ranges, rtt=None):
+        """
+
+        :param ranges: :class:`utils.ByteRanges` of the upload, updated by the caller as chunks are sent
+        :param rtt: round trip estimate in seconds
+        """
+        self.ranges = ranges
+        self.rtt = rtt or 0.0
+        self.throughput = None
+        self.index = 0
+
+    @property
+    def target_seconds(self):
+        return min(max(self.rtt / self.OVERHEAD_RATIO, self.MIN_CHUNK_SECONDS), self.MAX_CHUNK_SECONDS)
+
+    @property
+    def chunk_size(self):
+        """Size for the next chunk"""
+        if self.throughput is None:
+            return self.PROBE_SIZE
+        size = int(self.throughput * self.target_seconds)
+        return min(max(size, self.MIN_CHUNK_SIZE), self.MAX_CHUNK_SIZE)
+
+    def record(self, length, seconds):
+        """
+        Update the throughput estimate with a sent chunk
+
+        :param length: chunk size in bytes
+        :param seconds: time taken by the chunk request
+        :return:
+        """
+        # take out the round trip, but never count more than half the time as latency
+        transfer_seconds = max(seconds - self.rtt, seconds / 2.0, 1e-6)
+        sample = length / transfer_seconds
+        if self.throughput is None:
+            self.throughput = sample
+        else:
+            self.throughput = self.SMOOTHING * sample + (1 - self.SMOOTHING) * self.throughput
+
+    def record_failure(self):
+        """Halve the chunk size after a failed chunk"""
+        if self.throughput is not None:
+            self.throughput /= 2.0
+
+    def _chunk(self, start, end):
+        remaining = self.ranges.total - self.ranges.sent - (end - start)
+        size = self.chunk_size
+        total = self.index + 1 + (remaining + size - 1) // size
+        chunk = Chunk(self.index, start, end, total)
+        self.index += 1
+        return chunk
+
+    def __iter__(self):
+        while True:
+            gap = self.ranges.first_gap()
+            if gap is None:
+                return
+            start, end = gap
+            size = self.chunk_size
+            if end - start > min(size + size // 2, self.MAX_CHUNK_SIZE):
+                # otherwise send the rest of the range instead of leaving a small chunk
+                end = start + size
+            yield self._chunk(start, end)
+
+    def plan(self, min_count=1):
+        """
+        Split everything that has not been sent yet into chunks of about the current
+        chunk size, e.g. to send the rest concurrently after the probe chunk
+
+        :param min_count: min. number of chunks, e.g. the number of concurrent uploads
+        :return: list of :class:`utils.Chunk`
+        """
+        gaps = []
+        start = 0
+        for range_start, range_end in self.ranges.ranges + [(self.ranges.total, self.ranges.total)]:
+            if range_start > start:
+                gaps.append((start, range_start))
+            start = max(start, range_end)
+        remaining = sum(end - start for start, end in gaps)
+        if not remaining:
+            return []
+        # spread the data evenly instead of leaving a small last chunk
+        count = max((remaining + self.chunk_size - 1) // self.chunk_size, min_count)
+        size = max((remaining + count - 1) // count, 1)
+        bounds = [(s, min(s + size, end)) for start, end in gaps for s in range(start, end, size)]
+        chunks = []
+        for i, (start, end) in enumerate(bounds):
+            chunks.append(Chunk(self.index + i, start, end, self.index + len(bounds)))
+        self.index += len(bounds)
+        return chunks
+
+
+class ConfigurePolicy(object):
+    """
+    When to retry the configure call of an uploaded video. The server can answer
+    ``Transcode not finished yet.`` while it is still processing the video, in which
+    case the configure is tried again after an exponential backoff.
+    """
+
+    # messages of errors that mean that the video is still being processed
+    PROCESSING_MESSAGES = ('not finished yet', )
+
+    def __init__(self, max_attempts=6, interval=1.0, backoff=2.0, max_interval=30.0):
+        """
+
+        :param max_attempts: max. number of configure attempts
+        :param interval: seconds before the first retry
+        :param backoff: multiplier of the interval after each retry
+        :param max_interval: max. seconds between two attempts
+        """
+        self.max_attempts = max_attempts
+        self.interval = interval
+        self.backoff = backoff
+        self.max_interval = max_interval
+
+    def is_processing(self, error):
+        """True if the error means that the server has not finished processing the upload"""
+        if not isinstance(error, ClientError):
+            return False
+        message = str(error.msg).lower()
+        return error.code == 202 or any(m in message for m in self.PROCESSING_MESSAGES)
+
+    def retry_delay(self, error, attempts):
+        """
+        Seconds to wait before trying again after a failed attempt
+
+        :param error: the exception raised by the attempt
+        :param attempts: number of attempts made so far
+        :return: seconds, or None to give up
+        """
+        if attempts >= self.max_attempts or not self.is_processing(error):
+            return None
+        return min(self.interval * self.backoff ** (attempts - 1), self.max_interval)
+
+
+class ConfigureTask(object):
+    """
+    The configure step of an upload, run after the server's configure delay and retried
+    with a :class:`ConfigurePolicy`. It is returned by :meth:`UploadScheduler.schedule`
+    and can be waited on like a future.
+    """
+
+    def __init__(self, fn, policy=None, upload_id=None):
+        """
+
+        :param fn: callable that makes the configure call(s) and returns the response
+        :param policy: :class:`ConfigurePolicy`
+        :param upload_id:
+        """
+        self.fn = fn
+        self.policy = policy or ConfigurePolicy()
+        self.upload_id = upload_id
+        self.attempts = 0
+        self._result = None
+        self._error = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def run(self):
+        """
+        Make one attempt
+
+        :return: seconds to wait before the next attempt, or None when the task is done
+        """
+        self.attempts += 1
+        try:
+            result = self.fn()
+        except Exception as e:
+            delay = self.policy.retry_delay(e, self.attempts)
+            if delay is not None:
+                logger.debug('Retrying configure of %s in %.1fs: %s' % (self.upload_id, delay, e))
+                return delay
+            self._finish(error=e)
+        else:
+            self._finish(result=result)
+        return None
+
+    def run_sync(self, delay=0):
+        """
+        Run the task in the current thread, sleeping through the delays
+
+        :param delay: seconds to wait before the first attempt
+        :return: the configure response
+        """
+        while delay is not None:
+            if delay > 0:
+                time.sleep(delay)
+            delay = self.run()
+        return self.result()
+
+    def _finish(self, result=None, error=None):
+        with self._lock:
+            self._result = result
+            self._error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._callback(callback)
+
+    def _callback(self, callback):
+        try:
+            callback(self)
+        except Exception as e:
+            logger.error('Configure callback failed: %s' % e)
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the task and get the configure response, or raise its error
+
+        :param timeout: seconds to wait. Default: wait forever
+        :return:
+        """
+        if self.exception(timeout) is not None:
+            raise self._error
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the task and get its error, or None if it succeeded"""
+        if not self._done.wait(timeout):
+            raise ClientError('Configure of %s has not completed' % self.upload_id)
+        return self._error
+
+    def add_done_callback(self, callback):
+        """Call ``callback(task)`` when the task is done, from the thread that completes it"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        self._callback(callback)
+
+
+class UploadScheduler(object):
+    """
+    Runs the configure step of video uploads in background threads at the time the
+    server asks for (``configure_delay_ms``), retrying while the video is still being
+    processed. The thread that uploaded a video is free to upload the next one instead
+    of sleeping.
+
+    .. code-block:: python
+
+        scheduler = UploadScheduler(workers=2)
+        tasks = [api.post_video(video, size, duration, thumbnail, scheduler=scheduler)
+                 for video, thumbnail in videos]
+        results = [task.result() for task in tasks]
+        scheduler.stop()
+    """
+
+    def __init__(self, workers=1):
+        """
+
+        :param workers: number of threads running configure calls
+        """
+        self.workers = max(1, int(workers))
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._tasks = set()
+        self._threads = []
+        self._stopped = False
+
+    def __len__(self):
+        """Number of tasks that are not done"""
+        with self._condition:
+            return len(self._tasks)
+
+    def schedule(self, task, delay=0):
+        """
+        Run a task after a delay
+
+        :param task: :class:`ConfigureTask`
+        :param delay: seconds
+        :return: the task
+        """
+        with self._condition:
+            if self._stopped:
+                raise ClientError('Scheduler has been stopped')
+            self._tasks.add(task)
+        task.add_done_callback(self._discard)
+        self._push(task, delay)
+        self.start()
+        return task
+
+    def _discard(self, task):
+        with self._condition:
+            self._tasks.discard(task)
+
+    def _push(self, task, delay):
+        with self._condition:
+            heapq.heappush(self._queue, (time.time() + (delay or 0), next(self._counter), task))
+            self._condition.notify()
+
+    def _next(self):
+        with self._condition:
+            while not self._stopped:
+                if self._queue:
+                    wait = self._queue[0][0] - time.time()
+                    if wait <= 0:
+                        return heapq.heappop(self._queue)[2]
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+            return None
+
+    def _run(self):
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            delay = task.run()
+            if delay is not None:
+                self._push(task, delay)
+
+    def start(self):
+        """Start the worker threads. Called by :meth:`schedule`."""
+        with self._condition:
+            self._stopped = False
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def join(self, timeout=None):
+        """
+        Wait for the scheduled tasks to complete
+
+        :param timeout: max. seconds to wait. Default: wait forever
+        :return: True if all the tasks are done
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._condition:
+                tasks = list(self._tasks)
+            if not tasks:
+                return True
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            if not tasks[0]._done.wait(remaining) and remaining is not None:
+                return False
+
+    def stop(self, wait=True, timeout=None):
+        """
+        Stop the worker threads
+
+        :param wait: complete the scheduled tasks first
+        :param timeout: max. seconds to wait for them
+        :return:
+        """
+        if wait:
+            self.join(timeout)
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
@@ -1,9 +1,16 @@
+import os
 import time
 import hmac
+import mmap
 import base64
 import hashlib
+import threading
+from contextlib import contextmanager
 from random import randint
 
+from .errors import ClientError
+from .http import is_bytes_like, is_file_path
+
 
 def gen_user_breadcrumb(size):
     key = 'iN4$aGr0m'
@@ -22,6 +29,24 @@ def gen_user_breadcrumb(size):
         base64.b64encode(data))
 
 
+_upload_id_lock = threading.Lock()
+_last_upload_id = [0]
+
+
+def gen_upload_id():
+    """
+    Generate an upload id from the current time in milliseconds. The ids are unique
+    within the process, so uploads started in the same millisecond (e.g. concurrent
+    album children) do not share an id.
+
+    :return: string id
+    """
+    with _upload_id_lock:
+        upload_id = max(int(time.time() * 1000), _last_upload_id[0] + 1)
+        _last_upload_id[0] = upload_id
+    return str(upload_id)
+
+
 class Chunk(object):
     """
     Simple object class to encapulate an upload Chunk
@@ -45,16 +70,123 @@ class Chunk(object):
         return self.end - self.start
 
 
+class ByteRanges(object):
+    """
+    Byte ranges of an upload that have been sent, merged as they are added,
+    and the contiguous range acknowledged by the server in its chunk responses,
+    which look like ``0-199999/4062266``
+    """
+    def __init__(self, total, ranges=None):
+        """
+
+        :param total: upload length
+        :param ranges: list of (start, end) with end exclusive, e.g. from :meth:`to_list`
+        """
+        self.total = total
+        self.ranges = []
+        self.acknowledged = 0
+        for start, end in ranges or []:
+            self.add(start, end)
+
+    def add(self, start, end):
+        """
+        Add a sent range
+
+        :param start:
+        :param end: exclusive
+        :return:
+        """
+        merged = []
+        for range_start, range_end in self.ranges:
+            if range_end < start or range_start > end:
+                merged.append((range_start, range_end))
+            else:
+                start, end = min(start, range_start), max(end, range_end)
+        merged.append((start, end))
+        merged.sort()
+        self.ranges = merged
+
+    @staticmethod
+    def parse(response):
+        """
+        Parse a chunk upload response
+
+        :param response: e.g. ``0-199999/4062266``, or several comma separated ranges
+        :return: list of (start, end, total) with end exclusive, or None if it is not a range response
+        """
+        parsed = []
+        for byte_range in response.strip().split(','):
+            try:
+                start_end, total = byte_range.strip().split('/')
+                start, end = start_end.split('-')
+                parsed.append((int(start), int(end) + 1, int(total)))
+            except ValueError:
+                return None
+        return parsed
+
+    def acknowledge(self, response):
+        """
+        Update the acknowledged range from a chunk upload response
+
+        :param response:
+        :return: the parsed ranges, see :meth:`parse`
+        """
+        parsed = self.parse(response)
+        for start, end, _ in parsed or []:
+            if start == 0:
+                self.acknowledged = max(self.acknowledged, end)
+        return parsed
+
+    def contains(self, start, end):
+        """True if start to end (exclusive) has been sent"""
+        return any(range_start <= start and end <= range_end for range_start, range_end in self.ranges)
+
+    def first_gap(self):
+        """
+        The first range that has not been sent
+
+        :return: (start, end) with end exclusive, or None if the upload is complete
+        """
+        start = 0
+        for range_start, range_end in self.ranges:
+            if range_start > start:
+                return start, range_start
+            start = max(start, range_end)
+        if start < self.total:
+            return start, self.total
+        return None
+
+    @property
+    def sent(self):
+        """Number of bytes sent"""
+        return sum(end - start for start, end in self.ranges)
+
+    @property
+    def is_complete(self):
+        return self.contains(0, self.total)
+
+    def to_list(self):
+        return [list(r) for r in self.ranges]
+
+    def __repr__(self):
+        return '<ByteRanges %s/%d acknowledged: %d>' % (
+            ','.join('%d-%d' % (start, end - 1) for start, end in self.ranges), self.total, self.acknowledged)
+
+
 def chunk_generator(chunk_count, chunk_size, file_data):
     """
     Generic chunk generator logic
 
     :param chunk_count: Number of chunks wanted
     :param chunk_size: Size of each chunk
-    :param file_data: bytes to be split into chunk
-    :return:
+    :param file_data: bytes to be split into chunk, or a mapped file from :func:`mapped_file`
+    :return: (:class:`Chunk`, memoryview of the chunk data)
     """
     total_len = len(file_data)
+    try:
+        file_data = memoryview(file_data)
+    except TypeError:   # Python 2 mmap, slices are copied
+        pass
     for i in range(chunk_count):
         start_range = i * chunk_size
         end_range = (start_range + chunk_size) if i < (chunk_count - 1) else total_len
@@ -62,6 +194,60 @@ def chunk_generator(chunk_count, chunk_size, file_data):
         yield chunk_info, file_data[chunk_info.start: chunk_info.end]
 
 
+@contextmanager
+def mapped_file(data):
+    """
+    Get upload data as bytes, or as a read-only memory map of the file for
+    a file path or file object, so that it is not read into memory.
+    A file object is mapped from its current position to the end.
+
+    .. code-block:: python
+
+        with mapped_file('video.mp4') as video_data:
+            for chunk, data in max_chunk_count_generator(4, video_data):
+                ...
+
+    :param data: bytes, a file path (see :func:`http.is_file_path`) or a file object with a fileno()
+    :return:
+    """
+    if is_file_path(data):
+        position = 0
+        with open(data, 'rb') as f:
+            mapped = _map(f, position)
+    elif is_bytes_like(data):
+        yield data
+        return
+    else:
+        position = data.tell()
+        mapped = _map(data, position)
+    view = None
+    try:
+        if position:
+            try:
+                view = memoryview(mapped)[position:]
+            except TypeError:   # Python 2 mmap
+                view = buffer(mapped, position)  # noqa: F821
+            yield view
+        else:
+            yield mapped
+    finally:
+        try:
+            if isinstance(view, memoryview):
+                view.release()
+            mapped.close()
+        except BufferError:
+            # chunks are still referenced (e.g. by a traceback), the map
+            # is closed when they are released
+            pass
+
+
+def _map(f, position):
+    """Memory map a file, which must have data after the position"""
+    if os.fstat(f.fileno()).st_size <= position:
+        raise ClientError('No data to upload in %s' % getattr(f, 'name', f))
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
 def max_chunk_size_generator(chunk_size, file_data):
     """
     Generate chunks by defining a maximum chunk size
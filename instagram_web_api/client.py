@@ -33,6 +33,7 @@ class Client(object):
     API_URL = 'https://www.instagram.com/query/'
     USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/601.6.17 (KHTML, like Gecko) ' \
                  'Version/9.1.1 Safari/601.6.17'
+    MEDIA_ID_RE = re.compile(r'[0-9]+_[0-9]+')
 
     def __init__(self, user_agent=None, **kwargs):
         """
@@ -196,7 +197,7 @@ class Client(object):
 
     def _sanitise_media_id(self, media_id):
         """The web API uses the numeric media ID only, and not the formatted one where it's XXXXX_YYY"""
-        if re.match(r'[0-9]+_[0-9]+', media_id):    # endpoint uses the entirely numeric ID, not XXXX_YYY
+        if self.MEDIA_ID_RE.match(media_id):    # endpoint uses the entirely numeric ID, not XXXX_YYY
             media_id = media_id.split('_')[0]
         return media_id
 
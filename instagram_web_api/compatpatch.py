@@ -1,23 +1,62 @@
 # -*- coding: utf-8 -*-
 import re
 
+from instagram_private_api.compatpatch import BatchPatchMixin
 
-class ClientCompatPatch():
+
+class ClientCompatPatch(BatchPatchMixin):
     """Utility to make entities from the private api similar to the ones
     from the public one by adding the necessary properties, and if required,
     remove any incompatible properties (to save storage space for example).
     """
 
     IG_IMAGE_URL_EXPR = r'/((?P<crop>[a-z])[0-9]{3}x[0-9]{3}/)'
+    IG_IMAGE_URL_RE = re.compile(IG_IMAGE_URL_EXPR)
+    IG_IMAGE_EPARAM_RE = re.compile(r'(?P<eparam>/e[0-9]+/)')
+
+    # Max number of rewritten image urls remembered by _generate_image_url()
+    IMAGE_URL_CACHE_SIZE = 4096
+    _image_urls = {}
 
     @classmethod
-    def _generate_image_url(cls, url, size, crop):
-        mobj = re.search(cls.IG_IMAGE_URL_EXPR, url)
+    def _rewrite_image_url(cls, url, size, crop):
+        mobj = cls.IG_IMAGE_URL_RE.search(url)
         if not mobj:
-            replacement_expr = '\g<eparam>%(crop)s%(size)sx%(size)s/' % {'crop': crop, 'size': size}
-            return re.sub(r'(?P<eparam>/e[0-9]+/)', replacement_expr, url)
+            replacement_expr = r'\g<eparam>%(crop)s%(size)sx%(size)s/' % {'crop': crop, 'size': size}
+            return cls.IG_IMAGE_EPARAM_RE.sub(replacement_expr, url)
         replacement_expr = '/%(crop)s%(size)sx%(size)s/' % {'crop': mobj.group('crop') or crop, 'size': size}
-        return re.sub(cls.IG_IMAGE_URL_EXPR, replacement_expr, url)
+        return cls.IG_IMAGE_URL_RE.sub(replacement_expr, url)
+
+    @classmethod
+    def _generate_image_url(cls, url, size, crop):
+        key = (url, size, crop)
+        image_url = cls._image_urls.get(key)
+        if image_url is not None:
+            return image_url
+
+        # Splice in the size around the single match that CDN urls have,
+        # and leave anything else to the re.sub() in _rewrite_image_url()
+        pattern = cls.IG_IMAGE_URL_RE
+        mobj = pattern.search(url)
+        if mobj:
+            start, end = mobj.span()
+            replacement = '/%s%sx%s/' % (mobj.group('crop') or crop, size, size)
+        else:
+            pattern = cls.IG_IMAGE_EPARAM_RE
+            mobj = pattern.search(url)
+            start = end = mobj.end() if mobj else 0
+            replacement = '%s%sx%s/' % (crop, size, size)
+        if not mobj:
+            image_url = url
+        elif pattern.search(url, end):
+            image_url = cls._rewrite_image_url(url, size, crop)
+        else:
+            image_url = url[:start] + replacement + url[end:]
+
+        if len(cls._image_urls) >= cls.IMAGE_URL_CACHE_SIZE:
+            cls._image_urls.clear()
+        cls._image_urls[key] = image_url
+        return image_url
 
     @classmethod
     def _drop_keys(cls, obj, keys):
@@ -8,6 +8,8 @@ import sys
 import logging
 import re
 import warnings
+import hmac
+import hashlib
 try:
     # python 2.x
     from urllib2 import urlopen
@@ -18,13 +20,35 @@ try:
     from instagram_private_api import (
         __version__, Client, ClientError, ClientLoginError,
         ClientCookieExpiredError, ClientCompatPatch)
-    from instagram_private_api.utils import InstagramID
+    from instagram_private_api.utils import (
+        InstagramID, max_chunk_count_generator, mapped_file, ByteRanges, gen_upload_id)
+    from instagram_private_api.http import SignedBodyEncoder, MultipartFormDataEncoder, is_file_path
+    from instagram_private_api.compat import compat_urllib_parse
+    from instagram_private_api.compatpatch import CandidateIndex, Projection
+    from instagram_private_api.pagination import Paginator
+    from instagram_private_api.columnar import ColumnarCollector, USER_COLUMNS
+    from instagram_private_api.uploads import (
+        UploadState, UploadMetrics, AdaptiveChunker, ConfigurePolicy, ConfigureTask, UploadScheduler)
+    from instagram_private_api.models import Media, User, Comment, IdentityMap
+    from instagram_private_api.publishing import JobStore, PublishQueue, PublishJob
+    from instagram_private_api.preprocessing import target_size, MediaPreprocessor, ALBUM_RATIOS
 except ImportError:
     sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
     from instagram_private_api import (
         __version__, Client, ClientError, ClientLoginError,
         ClientCookieExpiredError, ClientCompatPatch)
-    from instagram_private_api.utils import InstagramID
+    from instagram_private_api.utils import (
+        InstagramID, max_chunk_count_generator, mapped_file, ByteRanges, gen_upload_id)
+    from instagram_private_api.http import SignedBodyEncoder, MultipartFormDataEncoder, is_file_path
+    from instagram_private_api.compat import compat_urllib_parse
+    from instagram_private_api.compatpatch import CandidateIndex, Projection
+    from instagram_private_api.pagination import Paginator
+    from instagram_private_api.columnar import ColumnarCollector, USER_COLUMNS
+    from instagram_private_api.uploads import (
+        UploadState, UploadMetrics, AdaptiveChunker, ConfigurePolicy, ConfigureTask, UploadScheduler)
+    from instagram_private_api.models import Media, User, Comment, IdentityMap
+    from instagram_private_api.publishing import JobStore, PublishQueue, PublishJob
+    from instagram_private_api.preprocessing import target_size, MediaPreprocessor, ALBUM_RATIOS
 
 
 class TestPrivateApi(unittest.TestCase):
@@ -740,6 +764,30 @@ class TestPrivateApi(unittest.TestCase):
         self.assertIsNotNone(user_patched.get('profile_picture'))
 
 
+def _pool_task(api, item):
+    # module level so that it can be sent to the pool's worker processes
+    return api.username, item * 2
+
+
+def _to_bytes(data):
+    # bytes() of a memoryview is its repr on Python 2
+    return data.tobytes() if isinstance(data, memoryview) else bytes(data)
+
+
+class _Response(object):
+    """An opener response with a json body"""
+    code = 200
+
+    def __init__(self, body):
+        self.body = body.encode('utf-8')
+
+    def info(self):
+        return {}
+
+    def read(self):
+        return self.body
+
+
 class TestPrivateApiUtils(unittest.TestCase):
 
     def __init__(self, testname):
@@ -761,6 +809,1012 @@ class TestPrivateApiUtils(unittest.TestCase):
         weblink = InstagramID.weblink_from_media_id('1470517649007430315_25025320')
         self.assertEqual(weblink, 'https://www.instagram.com/p/BRoVAK5B8qr/')
 
+    def test_signed_body_encoder(self):
+        encoder = SignedBodyEncoder(Client.IG_SIG_KEY, Client.SIG_KEY_VERSION)
+        params = {'_uuid': 'abc', 'caption': 'caf\u00e9 & cr\u00e8me = #1', 'extra': {'source_width': 1080}}
+        json_params = json.dumps(params, separators=(',', ':'))
+        self.assertEqual(
+            encoder.signature(json_params),
+            hmac.new(Client.IG_SIG_KEY.encode('ascii'), json_params.encode('ascii'),
+                     digestmod=hashlib.sha256).hexdigest())
+        expected = 'ig_sig_key_version=%s&signed_body=%s' % (
+            Client.SIG_KEY_VERSION,
+            compat_urllib_parse.quote_plus(encoder.signature(json_params) + '.' + json_params))
+        self.assertEqual(encoder.encode(params), expected.encode('ascii'))
+        self.assertEqual(encoder.encode_many([params, params]), [expected.encode('ascii')] * 2)
+
+    def test_lazy_login(self):
+        import threading
+        from multiprocessing.pool import ThreadPool
+        from instagram_private_api.compat import compat_cookiejar, compat_urllib_error
+
+        class Opener(object):
+            """Answers the login and warmup requests, and fails the sync warmup call"""
+            def __init__(self, cookie_jar):
+                self.cookie_jar = cookie_jar
+                self.lock = threading.Lock()
+                self.endpoints = []
+
+            def set_cookie(self, name, value):
+                self.cookie_jar.set_cookie(compat_cookiejar.Cookie(
+                    0, name, value, None, False, '.instagram.com', True, True, '/', True, False,
+                    int(time.time()) + 3600, False, None, None, {}))
+
+            def open(self, req, timeout=None):
+                endpoint = req.get_full_url().split('/api/v1/')[1].split('?')[0]
+                with self.lock:
+                    self.endpoints.append(endpoint)
+                if endpoint == 'si/fetch_headers/':
+                    self.set_cookie('csrftoken', 'token')
+                elif endpoint == 'accounts/login/':
+                    self.set_cookie('ds_user_id', '123')
+                    return _Response('{"status": "ok", "logged_in_user": {"pk": 123}}')
+                elif endpoint == 'qe/sync/':
+                    raise compat_urllib_error.URLError('Connection refused')
+                return _Response('{"status": "ok", "users": []}')
+
+        def lazy_client(**kwargs):
+            api = Client('user', 'password', lazy_login=True, **kwargs)
+            api.opener = Opener(api.opener.cookie_jar)
+            return api
+
+        api = lazy_client(warmup=True)
+        self.assertEqual(api.opener.endpoints, [])
+        pool = ThreadPool(4)
+        try:
+            pool.map(lambda _: api._ensure_login(), range(8))
+        finally:
+            pool.terminate()
+        # the warmup calls run in the background, and the failed sync does not fail the login
+        warmup = ['qe/sync/', 'friendships/autocomplete_user_list/', 'direct_v2/inbox/']
+        for _ in range(500):
+            if len(api.opener.endpoints) >= 2 + len(warmup):
+                break
+            time.sleep(0.01)
+        self.assertEqual(api.opener.endpoints[:2], ['si/fetch_headers/', 'accounts/login/'])
+        self.assertEqual(sorted(api.opener.endpoints[2:]), sorted(warmup))
+        self.assertEqual(api.authenticated_user_id, '123')
+
+        # a direct login completes the deferred one
+        api = lazy_client()
+        api.login()
+        api._ensure_login()
+        self.assertEqual(api.opener.endpoints, ['si/fetch_headers/', 'accounts/login/'])
+
+    @staticmethod
+    def _cookie_jar(expires):
+        from instagram_private_api.compat import compat_cookiejar
+        from instagram_private_api.http import ClientCookieJar
+
+        cookie_jar = ClientCookieJar()
+        cookie_jar.set_cookie(compat_cookiejar.Cookie(
+            0, 'sessionid', 'abc', None, False, '.instagram.com', True, True, '/', True, True,
+            int(expires), False, None, None, {}))
+        return cookie_jar
+
+    def test_session_refresher(self):
+        from instagram_private_api.session import ClientSessionRefresher
+
+        class Session(object):
+            def __init__(self, expires_in):
+                self.cookie_jar = TestPrivateApiUtils._cookie_jar(time.time() + expires_in)
+
+            def login(self):
+                self.cookie_jar.clear()
+                raise ClientLoginError('Unable to login.')
+
+        refreshed = []
+        errors = []
+
+        def refresh_handler(client):
+            refreshed.append(time.time())
+            if client is failing:
+                raise ClientError('Please wait a few minutes')
+
+        expiring, failing, fresh = Session(100), Session(50), Session(10000)
+        refresher = ClientSessionRefresher(
+            margin=1000, min_login_interval=0.2, retry_interval=60, concurrency=2,
+            refresh_handler=refresh_handler, on_error=lambda client, e: errors.append(client))
+        for client in (expiring, failing, fresh):
+            refresher.register(client)
+        self.assertEqual(refresher.due(), [failing, expiring])
+        for thread in refresher.check():
+            thread.join(5)
+        self.assertEqual((len(refreshed), errors), (2, [failing]))
+        # refreshes are spaced out, and a failed one waits for the retry interval
+        self.assertGreaterEqual(refreshed[1] - refreshed[0], 0.2)
+        self.assertEqual(refresher.due(), [expiring])
+        self.assertEqual(refresher.due(now=time.time() + 61), [failing, expiring])
+
+        # the previous cookies are restored after a failed relogin
+        cookies = [(c.name, c.expires) for c in failing.cookie_jar]
+        self.assertRaises(ClientLoginError, ClientSessionRefresher.relogin, failing)
+        self.assertEqual([(c.name, c.expires) for c in failing.cookie_jar], cookies)
+
+    def test_shared_session_store(self):
+        import tempfile
+        from instagram_private_api.session import SharedSessionStore
+
+        store = SharedSessionStore(tempfile.mkdtemp())
+        self.assertIsNone(store.load_settings('user'))
+        cookie = self._cookie_jar(time.time() + 3600).dump()
+        store.save_settings('user', {'uuid': 'abc', 'cookie': cookie})
+        self.assertEqual(store.load_settings('user'), {'uuid': 'abc', 'cookie': cookie})
+        self.assertEqual(os.listdir(store.directory), ['user.json'])
+
+        # a saved session is reused without logging in
+        api = store.client('user', 'password')
+        self.assertEqual((api.uuid, api.cookie_jar.dump()), ('abc', cookie))
+
+        # a newer session saved by another process is picked up instead of logging in again
+        api.cookie_jar.load(self._cookie_jar(time.time() + 60).dump())
+        self.assertIs(store.refresh(api), api)
+        self.assertEqual(api.cookie_jar.dump(), cookie)
+
+    def test_client_process_pool(self):
+        import pickle
+        from instagram_private_api.pool import ClientSpec, ClientProcessPool
+
+        # a saved session, so that the clients are built without logging in
+        settings = {'uuid': 'abc', 'cookie': self._cookie_jar(time.time() + 3600).dump()}
+        api = Client('user', 'password', settings=settings, auto_patch=True, timeout=5)
+        spec = ClientSpec.from_client(api)
+        spec = pickle.loads(pickle.dumps(spec))
+        self.assertEqual(spec.client_kwargs, {'auto_patch': True, 'drop_incompat_keys': False,
+                                              'lazy_patch': False, 'timeout': 5, 'api_url': api.api_url})
+        self.assertEqual(spec.build().uuid, 'abc')
+        with ClientProcessPool(spec, processes=2) as pool:
+            items = list(range(20))
+            self.assertEqual(pool.map(_pool_task, items, chunksize=3), [('user', i * 2) for i in items])
+            self.assertEqual(pool.starmap(_pool_task, [(i, ) for i in items]), [('user', i * 2) for i in items])
+
+    def test_compat_patch_lazy_views(self):
+        user = {'pk': 25025320, 'username': 'instagram', 'full_name': 'Instagram', 'profile_pic_url': 'https://x/p.jpg'}
+        raw = json.dumps({'items': [{
+            'pk': 1470654893538426156, 'id': '1470654893538426156_25025320', 'code': 'BRo0NV0jD0s',
+            'media_type': 1, 'taken_at': 1489984000, 'user': user, 'filter_type': 0, 'has_liked': False,
+            'image_versions2': {'candidates': [
+                {'url': 'https://x/%d.jpg' % w, 'width': w, 'height': w} for w in (1080, 640, 320, 150)]},
+            'caption': {'pk': 1, 'text': 'hello', 'created_at': 1489984000, 'user': user},
+            'usertags': {'in': [{'position': [0.5, 0.25], 'user': copy.deepcopy(user)}]},
+        }]})
+        eager = ClientCompatPatch.media(json.loads(raw)['items'][0])
+        lazy = json.loads(raw, object_hook=ClientCompatPatch.lazy_hook)['items'][0]
+        self.assertNotIn('link', list(lazy.keys()))
+        self.assertIs(ClientCompatPatch.media(lazy), lazy)
+        for k in ('link', 'created_time', 'type', 'images', 'users_in_photo', 'filter', 'user_has_liked'):
+            self.assertEqual(lazy[k], eager[k])
+        self.assertIs(lazy['images'], lazy['images'])
+        self.assertEqual(lazy['caption']['from'], eager['caption']['from'])
+        self.assertEqual(lazy['user'].get('id'), eager['user']['id'])
+        self.assertNotIn('videos', lazy)
+        self.assertIsNone(lazy.get('videos'))
+        self.assertEqual(json.loads(json.dumps(lazy.materialize()))['link'], eager['link'])
+
+    def test_compat_patch_lazy_carousel(self):
+        user = {'pk': 25025320, 'username': 'instagram', 'full_name': 'Instagram', 'profile_pic_url': 'https://x/p.jpg'}
+        candidates = {'candidates': [
+            {'url': 'https://x/%d.jpg' % w, 'width': w, 'height': w} for w in (1080, 640, 320, 150)]}
+        raw = json.dumps({
+            'pk': 1470654893538426156, 'id': '1470654893538426156_25025320', 'code': 'BRo0NV0jD0s',
+            'media_type': 8, 'taken_at': 1489984000, 'user': user, 'filter_type': 0, 'has_liked': False,
+            'original_width': 1080, 'caption': None,
+            'carousel_media': [{
+                'pk': 1, 'id': '1_25025320', 'media_type': 2, 'image_versions2': candidates,
+                'video_versions': [{'url': 'https://x/640.mp4', 'width': 640, 'height': 640, 'type': 101}],
+                'usertags': {'in': [{'position': [0.5, 0.25], 'user': user}]},
+            }, {
+                'pk': 2, 'id': '2_25025320', 'media_type': 1, 'image_versions2': candidates,
+            }],
+        })
+        eager = ClientCompatPatch.media(json.loads(raw))
+        lazy = json.loads(raw, object_hook=ClientCompatPatch.lazy_hook)
+        child = lazy['carousel_media'][1]
+        self.assertNotIn('link', child)
+        self.assertIsNone(child.get('created_time'))
+        self.assertNotIn('users_in_photo', child)
+        self.assertEqual(child['images'], eager['carousel_media'][1]['images'])
+        materialized = json.loads(json.dumps(lazy.materialize()))
+        self.assertEqual(materialized['carousel_media'], json.loads(json.dumps(eager['carousel_media'])))
+        for k in ('link', 'created_time', 'type', 'images', 'videos'):
+            self.assertEqual(materialized[k], eager[k])
+
+    @staticmethod
+    def _feed_items():
+        """Feed media of every shape, with and without the optional keys"""
+        def user(pk):
+            return {'pk': pk, 'username': 'user%d' % pk, 'full_name': 'User %d' % pk,
+                    'profile_pic_url': 'https://x/%d.jpg' % pk, 'is_private': False,
+                    'friendship_status': {'following': False}}
+
+        def comment(pk):
+            return {'pk': pk, 'user_id': 7, 'text': 'nice', 'type': 0, 'created_at': 1489984000 + pk,
+                    'content_type': 'comment', 'status': 'Active', 'bit_flags': 0, 'user': user(7)}
+
+        def media(pk, media_type, **values):
+            item = {
+                'pk': pk, 'id': '%d_25025320' % pk, 'code': 'BRo0NV0jD%d' % pk, 'media_type': media_type,
+                'taken_at': 1489984000 + pk, 'device_timestamp': 1489984000000, 'filter_type': 612,
+                'image_versions2': {'candidates': [
+                    {'url': 'https://x/%d_%d.jpg' % (pk, w), 'width': w, 'height': w} for w in (1080, 640, 320, 150)]},
+                'original_width': 1080, 'original_height': 1080, 'user': user(25025320), 'has_liked': True,
+                'like_count': 10 + pk, 'comment_count': 2, 'caption': comment(pk * 10),
+                'preview_comments': [comment(pk * 10 + 1), comment(pk * 10 + 2)],
+            }
+            if media_type == 2:
+                item.update({'video_duration': 12.5, 'view_count': 100, 'video_versions': [
+                    {'url': 'https://x/%d_%d.mp4' % (pk, w), 'width': w, 'height': w, 'type': t}
+                    for t, w in ((101, 640), (102, 480))]})
+            item.update(values)
+            return item
+
+        location = {'pk': 3, 'name': 'Somewhere', 'lat': 1.3, 'lng': 103.8, 'external_source': 'facebook_places'}
+        usertags = {'in': [{'position': [0.5, 0.25], 'user': user(11)}]}
+        child_keys = ('caption', 'preview_comments', 'user', 'comment_count', 'like_count')
+        children = [
+            dict((k, v) for k, v in media(21, 2, usertags=usertags, location=location).items() if k not in child_keys),
+            dict((k, v) for k, v in media(22, 1, location={'pk': 4, 'name': 'Nowhere'}).items()
+                 if k not in child_keys)]
+        return [
+            media(1, 1, location=location, usertags=usertags),
+            media(2, 2, caption=None, location={'pk': 4, 'name': 'Nowhere'}, comments=[comment(23)]),
+            media(3, 8, carousel_media=children, location=location),
+            media(4, 1, reel_mentions=[{'x': 0.5, 'y': 0.5, 'user': user(12)}], preview_comments=[]),
+        ]
+
+    def test_compat_patch_lazy_materialize(self):
+        raw = json.dumps({'items': self._feed_items(), 'status': 'ok'})
+        eager = [ClientCompatPatch.media(m) for m in json.loads(raw)['items']]
+        lazy = json.loads(raw, object_hook=ClientCompatPatch.lazy_hook)['items']
+        self.assertEqual((lazy[0]['likes']['count'], lazy[0]['comments']['count']), (11, 2))
+        self.assertEqual(lazy[0]['location']['latitude'], 1.3)
+        self.assertIsNone(lazy[1]['location'])
+        self.assertEqual(lazy[1]['comments']['data'][0]['id'], '23')
+        self.assertIsNone(lazy[3]['location'])
+        for lazy_media, eager_media in zip(lazy, eager):
+            self.assertEqual(json.loads(json.dumps(lazy_media.materialize())), json.loads(json.dumps(eager_media)))
+
+    def test_candidate_index(self):
+        candidates = [
+            {'url': 'https://x/%d.jpg' % i, 'width': w, 'height': h}
+            for i, (w, h) in enumerate([(1080, 1350), (640, 800), (640, 640), (480, 600), (320, 400), (150, 150)])]
+        index = CandidateIndex(candidates)
+        for width, height in ((320, 0), (150, 150), (1080, 0), (560, 0), (640, 640), (2000, 0), (0, 0)):
+            self.assertIs(index.closest(width, height), ClientCompatPatch._get_closest_size(candidates, width, height))
+        self.assertEqual(index.best(max_pixels=640 * 800)['url'], 'https://x/1.jpg')
+        self.assertEqual(index.best(max_bandwidth=500 * 500 * CandidateIndex.BITS_PER_PIXEL)['url'], 'https://x/4.jpg')
+        self.assertEqual(index.best(max_pixels=1)['url'], 'https://x/5.jpg')
+        self.assertEqual(
+            ClientCompatPatch.best_variant({'image_versions2': {'candidates': candidates}})['url'], 'https://x/0.jpg')
+        self.assertIsNone(CandidateIndex([]).closest(320))
+
+    def test_models(self):
+        user = {'pk': 25025320, 'username': 'instagram', 'full_name': 'Instagram', 'profile_pic_url': 'https://x/p.jpg'}
+        media = {
+            'pk': 1470654893538426156, 'id': '1470654893538426156_25025320', 'code': 'BRo0NV0jD0s',
+            'media_type': 1, 'taken_at': 1489984000, 'user': user, 'like_count': 10, 'comment_count': 2,
+            'image_versions2': {'candidates': [
+                {'url': 'https://x/%d.jpg' % w, 'width': w, 'height': w} for w in (640, 1080, 320)]},
+            'original_width': 1080, 'original_height': 1080,
+            'caption': {'pk': 1, 'text': 'hello', 'created_at': 1489984000, 'user': user},
+        }
+        model = Media.from_app(copy.deepcopy(media))
+        self.assertEqual(model.user.username, 'instagram')
+        self.assertEqual(model.display_url, 'https://x/1080.jpg')
+        self.assertEqual(model.caption, 'hello')
+        self.assertFalse(hasattr(model, '__dict__'))
+        patched = Media.from_app(ClientCompatPatch.media(copy.deepcopy(media), drop_incompat_keys=True))
+        for field in ('pk', 'id', 'code', 'media_type', 'taken_at', 'caption', 'like_count', 'display_url'):
+            self.assertEqual(getattr(patched, field), getattr(model, field))
+        self.assertEqual(model.to_dict()['user']['pk'], 25025320)
+        self.assertEqual(Media.from_app(model.to_dict()), model)
+        self.assertEqual(Comment.from_app(media['caption']).user, User.from_app(user))
+
+    def test_identity_map(self):
+        identity_map = IdentityMap()
+        feed = json.loads(json.dumps({'items': [
+            {'pk': 1, 'user': {'pk': 7, 'username': 'abc', 'full_name': 'Old name'}},
+            {'pk': 2, 'user': {'pk': 7, 'username': 'abc', 'full_name': 'Old name'}},
+        ]}), object_hook=identity_map.hook)
+        self.assertIs(feed['items'][0]['user'], feed['items'][1]['user'])
+        profile = json.loads(
+            json.dumps({'user': {'pk': 7, 'username': 'abc', 'full_name': 'New name', 'follower_count': 3}}),
+            object_hook=identity_map.hook)
+        self.assertIs(profile['user'], feed['items'][0]['user'])
+        self.assertEqual(feed['items'][1]['user']['full_name'], 'New name')
+        users = [User.from_app({'pk': 7, 'username': 'abc'}, identity_map),
+                 User.from_app({'pk': '7', 'full_name': 'New name'}, identity_map)]
+        self.assertIs(users[0], users[1])
+        self.assertEqual(users[0].full_name, 'New name')
+        identity_map.clear()
+        self.assertEqual(len(identity_map), 0)
+
+        # patching in place with a shared user that is also the caption user
+        user = {'pk': 7, 'username': 'abc', 'full_name': 'Abc', 'profile_pic_url': 'https://x/p.jpg'}
+        feed = json.loads(json.dumps({'items': [{
+            'pk': pk, 'id': '%d_7' % pk, 'code': 'BRo0NV0jD0s', 'media_type': 1, 'taken_at': 1489984000,
+            'user': user, 'image_versions2': {'candidates': []},
+            'caption': {'pk': pk, 'text': 'hello', 'created_at': 1489984000, 'user': user},
+        } for pk in (1, 2)]}), object_hook=identity_map.hook)
+        for item in feed['items']:
+            ClientCompatPatch.media(item)
+        self.assertIs(feed['items'][1]['caption']['user'], feed['items'][0]['user'])
+        self.assertEqual(feed['items'][1]['caption']['from']['id'], '7')
+        self.assertRaises(
+            ValueError, Client, 'user', 'password', lazy_login=True, identity_map=identity_map,
+            auto_patch=True, drop_incompat_keys=True)
+
+        # the least recently seen users are dropped
+        identity_map = IdentityMap(max_size=2)
+        first = identity_map.user({'pk': 1, 'username': 'a'})
+        second = identity_map.user({'pk': 2, 'username': 'b'})
+        self.assertIs(identity_map.user({'pk': 1, 'username': 'a'}), first)
+        identity_map.user({'pk': 3, 'username': 'c'})
+        self.assertEqual(len(identity_map), 2)
+        self.assertIs(identity_map.user({'pk': 1, 'username': 'a'}), first)
+        self.assertIsNot(identity_map.user({'pk': 2, 'username': 'b'}), second)
+
+    def test_projection(self):
+        page = {
+            'status': 'ok', 'next_max_id': 'abc', 'big_list': True,
+            'users': [{'pk': 1, 'username': 'a', 'is_private': False, 'friendship_status': {'following': True}}],
+            'reels': {'1': {'items': [{'pk': 2, 'code': 'x'}]}, '2': {'items': [{'pk': 3, 'code': 'y'}]}},
+        }
+        projected = Projection(['users.pk', 'users.username', 'reels.*.items.pk']).apply(copy.deepcopy(page))
+        self.assertEqual(projected, {
+            'status': 'ok', 'next_max_id': 'abc', 'big_list': True,
+            'users': [{'pk': 1, 'username': 'a'}],
+            'reels': {'1': {'items': [{'pk': 2}]}, '2': {'items': [{'pk': 3}]}},
+        })
+        excluded = Projection(exclude=['users.friendship_status', 'reels']).apply(copy.deepcopy(page))
+        self.assertEqual(excluded['users'], [{'pk': 1, 'username': 'a', 'is_private': False}])
+        self.assertNotIn('reels', excluded)
+        self.assertIsNone(Projection.of(None))
+
+    def test_paginator(self):
+        from instagram_private_api.compat import compat_cookiejar
+
+        calls = []
+
+        def endpoint(user_id, **kwargs):
+            calls.append(kwargs)
+            max_id = int(kwargs.get('max_id', 0))
+            page = {'status': 'ok', 'users': [{'pk': max_id}, {'pk': max_id + 1}]}
+            if max_id < 4:
+                page['next_max_id'] = str(max_id + 2)
+            return page
+
+        paginator = Paginator(endpoint, 123, projection=['users.pk'])
+        self.assertEqual([u['pk'] for u in paginator.items()], [0, 1, 2, 3, 4, 5])
+        self.assertEqual(paginator.pages, 3)
+        self.assertEqual([c.get('max_id') for c in calls], [None, '2', '4'])
+        self.assertIsInstance(calls[0]['projection'], Projection)
+        self.assertEqual(len(list(Paginator(endpoint, 123, max_pages=2))), 2)
+
+        # the auto patch only adds the keys it can derive from the projected ones
+        class Opener(object):
+            def __init__(self, cookie_jar):
+                self.cookie_jar = cookie_jar
+
+            def open(self, req, timeout=None):
+                match = re.search(r'max_id=(\d+)', req.get_full_url())
+                max_id = int(match.group(1)) if match else 0
+                return _Response(json.dumps({'status': 'ok', 'next_max_id': str(max_id + 2) if max_id < 2 else None,
+                                             'users': [{'pk': pk, 'username': 'user%d' % pk, 'full_name': '',
+                                                        'profile_pic_url': 'https://x/p.jpg', 'is_private': False}
+                                                       for pk in (max_id, max_id + 1)]}))
+
+        settings = {'uuid': 'abc', 'cookie': self._cookie_jar(time.time() + 3600).dump()}
+        for drop_incompat_keys in (False, True):
+            api = Client('user', 'password', settings=settings, auto_patch=True,
+                         drop_incompat_keys=drop_incompat_keys)
+            api.opener = Opener(api.cookie_jar)
+            api.cookie_jar.set_cookie(compat_cookiejar.Cookie(
+                0, 'ds_user_id', '123', None, False, '.instagram.com', True, True, '/', True, False,
+                int(time.time()) + 3600, False, None, None, {}))
+            users = list(Paginator(api.user_followers, 123, projection=['users.pk', 'users.username']).items())
+            self.assertEqual(users, [
+                dict({'username': 'user%d' % pk, 'id': str(pk)}, **({} if drop_incompat_keys else {'pk': pk}))
+                for pk in range(4)])
+
+    def test_columnar(self):
+        def endpoint(user_id, **kwargs):
+            max_id = int(kwargs.get('max_id', 0))
+            page = {'users': [
+                {'pk': max_id, 'username': 'u%d' % (max_id % 3), 'is_private': True},
+                {'id': str(max_id + 1), 'username': 'u%d' % ((max_id + 1) % 3), 'is_private': False}]}
+            if max_id < 4:
+                page['next_max_id'] = str(max_id + 2)
+            return page
+
+        collector = ColumnarCollector(USER_COLUMNS)
+        self.assertEqual(collector.consume(Paginator(endpoint, 123)), 6)
+        collector.append({'pk': 99})
+        self.assertEqual(len(collector), 7)
+        self.assertEqual(list(collector.column('pk')), [0, 1, 2, 3, 4, 5, 99])
+        self.assertEqual(list(collector.column('is_private')), [1, 0, 1, 0, 1, 0, -1])
+        self.assertEqual(collector.strings('username'), ['u0', 'u1', 'u2'])
+        self.assertEqual(collector.decode('username'), ['u0', 'u1', 'u2', 'u0', 'u1', 'u2', None])
+        self.assertEqual(collector.column('pk').itemsize, 8)
+        self.assertRaises(ValueError, lambda: ColumnarCollector([('x', 'x', 'decimal')]))
+
+    def _columnar_collector(self):
+        collector = ColumnarCollector(USER_COLUMNS + (('seen', 'seen', 'timestamp'), ('score', 'score', 'float64')))
+        collector.extend([
+            {'pk': 1, 'username': 'a', 'is_private': True, 'seen': 1489984000, 'score': 0.5},
+            {'id': '2', 'username': 'b', 'is_private': False},
+            {'pk': 3, 'username': 'a'},
+        ])
+        return collector
+
+    def test_columnar_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest('numpy is not installed')
+
+        collector = self._columnar_collector()
+        columns = collector.to_numpy()
+        self.assertEqual(columns['pk'].tolist(), [1, 2, 3])
+        self.assertEqual(columns['is_private'].tolist(), [1, 0, -1])
+        self.assertEqual(columns['username'].tolist(), [0, 1, 0])
+        self.assertTrue(numpy.isnan(columns['score'][1]))
+        # the arrays share the collector's buffers
+        self.assertEqual(columns['pk'].ctypes.data, collector.column('pk').buffer_info()[0])
+        self.assertRaises(BufferError, collector.append, {'pk': 4})
+
+    def test_columnar_arrow(self):
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+
+        collector = self._columnar_collector()
+        table = collector.to_arrow()
+        self.assertEqual(table.column('pk').to_pylist(), [1, 2, 3])
+        self.assertEqual(table.column('is_private').to_pylist(), [True, False, None])
+        self.assertEqual(table.column('username').to_pylist(), ['a', 'b', 'a'])
+        self.assertEqual(table.column('full_name').to_pylist(), [None, None, None])
+        self.assertEqual(table.column('score').to_pylist(), [0.5, None, None])
+        self.assertEqual(table.column('seen').type, pyarrow.timestamp('s'))
+        self.assertEqual(table.column('seen').null_count, 2)
+        # the value buffers are the collector's buffers
+        for name in ('pk', 'username', 'seen', 'score'):
+            self.assertEqual(table.column(name).chunk(0).buffers()[1].address, collector.column(name).buffer_info()[0])
+        self.assertIsNone(table.column('pk').chunk(0).buffers()[0])
+
+    def test_compat_patch_many(self):
+        user = {'pk': 25025320, 'username': 'instagram', 'full_name': 'Instagram', 'profile_pic_url': 'https://x/p.jpg'}
+        raw = json.dumps([{
+            'pk': pk, 'id': '%d_25025320' % pk, 'code': 'BRo0NV0jD0%d' % pk,
+            'media_type': 1, 'taken_at': 1489984000 + pk, 'user': user, 'filter_type': 0, 'has_liked': False,
+            'image_versions2': {'candidates': [
+                {'url': 'https://x/%d.jpg' % w, 'width': w, 'height': w} for w in (1080, 640, 320, 150)]},
+            'caption': {'pk': pk, 'text': 'hello', 'created_at': 1489984000, 'user': user},
+        } for pk in range(10)])
+        expected = [ClientCompatPatch.media(m, drop_incompat_keys=True) for m in json.loads(raw)]
+        medias = json.loads(raw)
+        self.assertEqual(ClientCompatPatch.media_many(medias, drop_incompat_keys=True), expected)
+        self.assertEqual(medias, expected)
+        # the objects are patched in place in worker processes too
+        medias = json.loads(raw)
+        patched = ClientCompatPatch.media_many(medias, drop_incompat_keys=True, processes=2, batch_size=3)
+        self.assertEqual((patched, medias), (expected, expected))
+        self.assertTrue(all(p is m for p, m in zip(patched, medias)))
+        comments = [m['caption'] for m in json.loads(raw)]
+        self.assertEqual(
+            ClientCompatPatch.comment_many(copy.deepcopy(comments), processes=2, batch_size=4),
+            [ClientCompatPatch.comment(c) for c in comments])
+
+        from instagram_web_api import ClientCompatPatch as WebClientCompatPatch
+        comments = [{'id': str(i), 'text': 'hi', 'created_at': 1489984000 + i,
+                     'user': {'id': '1', 'username': 'a', 'profile_pic_url': 'https://x/p.jpg'}} for i in range(5)]
+        patched = WebClientCompatPatch.comment_many(copy.deepcopy(comments), processes=2, batch_size=2)
+        self.assertEqual(patched, [WebClientCompatPatch.comment(c) for c in comments])
+
+    def test_compat_patch_copy(self):
+        user = {'pk': 25025320, 'username': 'instagram', 'full_name': 'Instagram', 'profile_pic_url': 'https://x/p.jpg'}
+        media = {
+            'pk': 1470654893538426156, 'id': '1470654893538426156_25025320', 'code': 'BRo0NV0jD0s',
+            'media_type': 2, 'taken_at': 1489984000, 'user': user, 'filter_type': 0, 'has_liked': False,
+            'image_versions2': {'candidates': [
+                {'url': 'https://x/%d.jpg' % w, 'width': w, 'height': w} for w in (1080, 640, 320, 150)]},
+            'video_versions': [{'url': 'https://x/%d.mp4' % w, 'width': w, 'height': w, 'type': 101}
+                               for w in (640, 480)],
+            'caption': {'pk': 1, 'text': 'hello', 'created_at': 1489984000, 'user': user},
+            'comments': [{'pk': 2, 'text': 'hi', 'created_at': 1489984001, 'user': user}],
+            'usertags': {'in': [{'position': [0.5, 0.25], 'user': copy.deepcopy(user)}]},
+            'location': {'pk': 3, 'lat': 1.0, 'lng': 2.0, 'name': 'x'},
+        }
+        raw = json.dumps(media, sort_keys=True)
+        for drop_incompat_keys in (False, True):
+            patched = ClientCompatPatch.media(media, drop_incompat_keys=drop_incompat_keys, inplace=False)
+            self.assertEqual(json.dumps(media, sort_keys=True), raw)
+            self.assertEqual(
+                patched, ClientCompatPatch.media(json.loads(raw), drop_incompat_keys=drop_incompat_keys))
+        self.assertIs(ClientCompatPatch.media(media, inplace=False)['image_versions2'], media['image_versions2'])
+        self.assertEqual(ClientCompatPatch.list_user(user, inplace=False)['id'], '25025320')
+        self.assertNotIn('id', user)
+
+    def test_multipart_stream(self):
+        import io
+        import tempfile
+
+        photo_data = os.urandom(200000)
+        fields = [('upload_id', '123'), ('_uuid', 'abc')]
+        content_type, body = MultipartFormDataEncoder('xyz').encode(
+            fields, [('photo', 'photo.jpg', 'application/octet-stream', photo_data)])
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+            f.write(photo_data)
+        try:
+            # a native str path too, which is bytes on Python 2
+            self.assertEqual([is_file_path(d) for d in (photo_data, f.name, u'' + f.name)], [False, True, True])
+            for data in (photo_data, io.BytesIO(photo_data), f.name, u'' + f.name):
+                stream_content_type, stream = MultipartFormDataEncoder('xyz').stream(
+                    fields, [('photo', 'photo.jpg', 'application/octet-stream', data)], chunk_size=8192)
+                self.assertEqual(stream_content_type, content_type)
+                self.assertEqual(len(stream), len(body))
+                chunks = []
+                chunk = stream.read(10000)
+                while chunk:
+                    self.assertLessEqual(len(chunk), 10000)
+                    chunks.append(chunk)
+                    chunk = stream.read(10000)
+                self.assertEqual(b''.join(chunks), body)
+                self.assertEqual(b''.join(_to_bytes(c) for c in stream), body)
+        finally:
+            os.remove(f.name)
+
+    def test_chunk_generator(self):
+        import tempfile
+
+        video_data = os.urandom(100003)
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as f:
+            f.write(video_data)
+        try:
+            for data in (video_data, f.name, u'' + f.name, open(f.name, 'rb')):
+                with mapped_file(data) as mapped:
+                    self.assertEqual(len(mapped), len(video_data))
+                    chunks = list(max_chunk_count_generator(4, mapped))
+                    self.assertEqual([c.length for c, _ in chunks], [25000, 25000, 25000, 25003])
+                    self.assertEqual(b''.join(_to_bytes(d) for _, d in chunks), video_data)
+                    if data is video_data:
+                        self.assertIsInstance(chunks[0][1], memoryview)
+                    del chunks
+                if hasattr(data, 'close'):
+                    data.close()
+            # a file object is mapped from its current position
+            with open(f.name, 'rb') as video_file:
+                video_file.seek(3)
+                with mapped_file(video_file) as mapped:
+                    self.assertEqual(_to_bytes(mapped), video_data[3:])
+                    self.assertEqual(len(list(max_chunk_count_generator(4, mapped))), 4)
+                video_file.seek(0, os.SEEK_END)
+                self.assertRaises(ClientError, mapped_file(video_file).__enter__)
+        finally:
+            os.remove(f.name)
+
+    def test_byte_ranges(self):
+        ranges = ByteRanges(1000)
+        ranges.add(500, 750)
+        ranges.add(0, 250)
+        self.assertFalse(ranges.is_complete)
+        ranges.add(250, 500)
+        self.assertEqual(ranges.to_list(), [[0, 750]])
+        self.assertEqual(ranges.sent, 750)
+        self.assertEqual(ranges.acknowledge('0-499/1000'), [(0, 500, 1000)])
+        self.assertEqual(ranges.acknowledged, 500)
+        self.assertIsNone(ranges.acknowledge('{"result": "ok"}'))
+        ranges.add(750, 1000)
+        self.assertTrue(ranges.is_complete)
+        self.assertTrue(ByteRanges(1000, ranges.to_list()).contains(100, 900))
+
+    def test_chunk_retry(self):
+        from instagram_private_api.compat import compat_urllib_error
+        from instagram_private_api.endpoints.upload import UploadEndpointsMixin
+
+        class Uploader(UploadEndpointsMixin):
+            logger = logging.getLogger('test')
+
+            def __init__(self, errors):
+                self.errors = errors
+
+            def _upload_video_chunk(self, *args, **kwargs):
+                if self.errors:
+                    raise self.errors.pop(0)
+                return {'status': 'ok'}
+
+        retried = []
+        uploader = Uploader([ClientError('Service Unavailable', code=503),
+                             compat_urllib_error.URLError('Connection reset')])
+        self.assertEqual(uploader._upload_video_chunk_with_retry(2, on_retry=retried.append), {'status': 'ok'})
+        self.assertEqual(len(retried), 2)
+        # client errors are not retried, and the retries are limited
+        self.assertRaises(
+            ClientError, Uploader([ClientError('Bad Request', code=400)])._upload_video_chunk_with_retry, 2)
+        self.assertRaises(compat_urllib_error.URLError, Uploader(
+            [compat_urllib_error.URLError('Connection reset')] * 3)._upload_video_chunk_with_retry, 2)
+
+    def test_upload_state(self):
+        import tempfile
+
+        video_data = os.urandom(100000)
+        state_file = os.path.join(tempfile.mkdtemp(), 'video.upload')
+        state = UploadState.open(state_file, video_data, params={'caption': 'x'})
+        self.assertFalse(state.is_started)
+        state.start('123', 'https://x/upload', 'job', 4)
+        ranges = state.ranges
+        ranges.add(0, 25000)
+        ranges.acknowledge('0-24999/100000')
+        state.update(ranges)
+
+        resumed = UploadState.open(state_file, video_data)
+        self.assertEqual((resumed.upload_id, resumed.upload_job, resumed.chunk_count), ('123', 'job', 4))
+        self.assertEqual(resumed.params, {'caption': 'x'})
+        self.assertTrue(resumed.ranges.contains(0, 25000))
+        self.assertEqual(resumed.ranges.acknowledged, 25000)
+        self.assertFalse(resumed.is_uploaded)
+        self.assertFalse(UploadState.open(state_file, video_data[::-1]).is_started)
+        resumed.delete()
+        self.assertIsNone(UploadState.load(state_file))
+
+    def test_adaptive_chunker(self):
+        ranges = ByteRanges(10 * 1024 * 1024)
+        chunker = AdaptiveChunker(ranges, rtt=0.1)
+        self.assertEqual(chunker.target_seconds, 2.0)
+        probe = next(iter(chunker))
+        self.assertEqual((probe.start, probe.end), (0, AdaptiveChunker.PROBE_SIZE))
+        ranges.add(probe.start, probe.end)
+        chunker.record(probe.length, 0.1 + probe.length / 1e6)
+        self.assertAlmostEqual(chunker.throughput, 1e6)
+        self.assertAlmostEqual(chunker.chunk_size, 2000000, delta=1)
+        chunker.record_failure()
+        self.assertAlmostEqual(chunker.chunk_size, 1000000, delta=1)
+
+        ranges.add(5000000, 6000000)
+        self.assertEqual(ranges.first_gap(), (probe.end, 5000000))
+        chunks = chunker.plan(min_count=12)
+        self.assertGreaterEqual(len(chunks), 12)
+        self.assertTrue(chunks[-1].is_last)
+        for chunk in chunks:
+            ranges.add(chunk.start, chunk.end)
+        self.assertTrue(ranges.is_complete)
+        self.assertIsNone(ranges.first_gap())
+        self.assertEqual(chunker.plan(), [])
+
+        metrics = UploadMetrics()
+        metrics.add_chunk(probe, 0.5, attempts=2)
+        metrics.phases['transfer'] = 0.5
+        self.assertEqual((metrics.sent, metrics.retries), (probe.length, 1))
+        self.assertEqual(metrics.throughput, probe.length / 0.5)
+
+    def test_gen_upload_id(self):
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(8)
+        try:
+            upload_ids = pool.map(lambda _: gen_upload_id(), range(1000))
+        finally:
+            pool.terminate()
+        self.assertEqual(len(set(upload_ids)), len(upload_ids))
+        self.assertGreater(int(gen_upload_id()), max(int(upload_id) for upload_id in upload_ids))
+
+    def test_upload_scheduler(self):
+        policy = ConfigurePolicy(max_attempts=3, interval=0.01)
+        self.assertEqual(policy.retry_delay(ClientError('Transcode not finished yet.'), 1), 0.01)
+        self.assertEqual(policy.retry_delay(ClientError('Transcode not finished yet.'), 2), 0.02)
+        self.assertIsNone(policy.retry_delay(ClientError('Transcode not finished yet.'), 3))
+        self.assertIsNone(policy.retry_delay(ClientError('Transcode timeout'), 1))
+
+        calls = []
+
+        def configure():
+            calls.append(time.time())
+            if len(calls) < 3:
+                raise ClientError('Transcode not finished yet.')
+            return {'status': 'ok'}
+
+        scheduler = UploadScheduler()
+        done = []
+        started = time.time()
+        task = scheduler.schedule(ConfigureTask(configure, policy, upload_id='1'), delay=0.05)
+        task.add_done_callback(done.append)
+        self.assertEqual(task.result(5), {'status': 'ok'})
+        self.assertEqual((task.attempts, done), (3, [task]))
+        self.assertGreaterEqual(calls[0] - started, 0.05)
+
+        task = scheduler.schedule(ConfigureTask(lambda: 1 / 0, policy))
+        self.assertIsInstance(task.exception(5), ZeroDivisionError)
+        self.assertTrue(scheduler.join(5))
+        scheduler.stop()
+        self.assertEqual(len(scheduler), 0)
+
+    def test_video_configure_retry(self):
+        import io
+        import tempfile
+        from instagram_private_api.endpoints.upload import UploadEndpointsMixin
+
+        class Uploader(UploadEndpointsMixin):
+            logger = logging.getLogger('test')
+
+            def __init__(self):
+                self.calls = []
+
+            def _upload_photo(self, photo_data, upload_id, **kwargs):
+                self.calls.append(('thumbnail', photo_data.read()))
+
+            def configure(self, upload_id, size, **kwargs):
+                self.calls.append(('configure', upload_id))
+
+            def configure_video(self, upload_id, size, duration, thumbnail_data, **kwargs):
+                self.calls.append(('configure_video', thumbnail_data))
+                if len(self.calls) < 5:
+                    raise ClientError('Transcode not finished yet.')
+                return {'status': 'ok'}
+
+        # an upload that has completed, so that only the configure step is left
+        video_data = os.urandom(1000)
+        state_file = os.path.join(tempfile.mkdtemp(), 'video.upload')
+        state = UploadState.open(state_file, video_data)
+        state.start('123', 'https://x/upload', 'job', 1)
+        ranges = state.ranges
+        ranges.add(0, len(video_data))
+        state.update(ranges, uploaded=True)
+
+        uploader = Uploader()
+        res = uploader.post_video(
+            video_data, (720, 720), 5.0, io.BytesIO(b'thumbnail'), state_file=state_file,
+            configure_policy=ConfigurePolicy(interval=0.01))
+        self.assertEqual(res, {'status': 'ok'})
+        self.assertEqual(uploader.calls, [
+            ('thumbnail', b'thumbnail'), ('configure', '123'),
+            ('configure_video', None), ('configure_video', None), ('configure_video', None)])
+
+        # with a scheduler, the thumbnail is sent before post_video returns
+        state = UploadState.open(state_file, video_data)
+        state.start('123', 'https://x/upload', 'job', 1)
+        state.update(ranges, uploaded=True)
+        uploader = Uploader()
+        scheduler = UploadScheduler()
+        try:
+            with io.BytesIO(b'thumbnail') as thumbnail:
+                task = uploader.post_video(
+                    video_data, (720, 720), 5.0, thumbnail, state_file=state_file, scheduler=scheduler,
+                    configure_policy=ConfigurePolicy(interval=0.01))
+                self.assertEqual(uploader.calls, [('thumbnail', b'thumbnail')])
+            self.assertEqual(task.result(5), {'status': 'ok'})
+        finally:
+            scheduler.stop()
+        self.assertEqual(len(uploader.calls), 5)
+
+    def test_publish_queue(self):
+        import socket
+        import tempfile
+        from instagram_private_api.errors import ClientThrottledError
+
+        class Account(object):
+            throttled = 1
+            timeouts = 0
+            posted = []
+
+            def post_photo(self, photo_data, size, caption='', on_configure=None):
+                if self.throttled:
+                    self.throttled -= 1
+                    raise ClientThrottledError('Please wait a few minutes', code=429)
+                if self.timeouts:
+                    # the connection failed while the photo was uploading
+                    self.timeouts -= 1
+                    raise socket.timeout('timed out')
+                on_configure('upload-%s' % photo_data)
+                self.posted.append(photo_data)
+                if photo_data.startswith('error'):
+                    # the configure request failed, but the photo may have been posted
+                    raise ClientError('Internal server error', code=int(photo_data[len('error'):-len('.jpg')]))
+                return {'status': 'ok', 'media': {'id': '%s_1' % photo_data}}
+
+        store = JobStore(tempfile.mkdtemp())
+        done = []
+        queue = PublishQueue(
+            store, {'account': Account()}, min_interval=0, retry_interval=0, throttle_interval=0,
+            poll_interval=0.01, on_done=done.append)
+        for i in range(3):
+            queue.submit('account', 'post_photo', key='photo/%d' % i, photo_data='%d.jpg' % i, size=[1080, 1080])
+        self.assertEqual(queue.submit('account', 'post_photo', key='photo/0', photo_data='x').kwargs['photo_data'],
+                         '0.jpg')
+        self.assertRaises(ValueError, queue.submit, 'account', 'delete_media', media_id='1')
+
+        queue.start()
+        for _ in range(500):
+            if len(done) == 3:
+                break
+            time.sleep(0.01)
+        queue.stop(timeout=5)
+        self.assertEqual(Account.posted, ['0.jpg', '1.jpg', '2.jpg'])
+        jobs = dict((job.key, job) for job in store.jobs())
+        self.assertEqual((jobs['photo/0'].status, jobs['photo/0'].attempts), (PublishJob.PUBLISHED, 2))
+        self.assertEqual(jobs['photo/2'].media_id, '2.jpg_1')
+
+        # published keys are not queued again, and interrupted jobs are not retried
+        job = jobs['photo/1']
+        job.update(status=PublishJob.RUNNING)
+        store.save(job)
+        # a queue leaves the running jobs alone, they may belong to another process
+        queue = PublishQueue(store, {'account': Account()})
+        self.assertEqual((store.load('photo/1').status, queue.pending), (PublishJob.RUNNING, 0))
+        self.assertEqual([j.key for j in store.recover()], ['photo/1'])
+        queue = PublishQueue(store, {'account': Account()})
+        self.assertEqual(queue.submit('account', 'post_photo', key='photo/2', photo_data='x').status,
+                         PublishJob.PUBLISHED)
+        self.assertEqual((store.load('photo/1').status, queue.pending), (PublishJob.UNKNOWN, 0))
+
+        # a configure failure is not retried as a new post
+        del done[:], Account.posted[:]
+        account = Account()
+        account.throttled = 0
+        queue = PublishQueue(store, {'account': account}, min_interval=0, retry_interval=0, on_done=done.append)
+        for code in (500, 400):
+            queue.submit('account', 'post_photo', key='error/%d' % code, photo_data='error%d.jpg' % code,
+                         size=[1080, 1080])
+            for thread in queue.check():
+                thread.join()
+        self.assertEqual(Account.posted, ['error500.jpg', 'error400.jpg'])
+        self.assertEqual([(job.status, job.attempts, job.record['upload_id']) for job in done], [
+            (PublishJob.UNKNOWN, 1, 'upload-error500.jpg'), (PublishJob.FAILED, 1, 'upload-error400.jpg')])
+        self.assertEqual(queue.pending, 0)
+
+        # a connection error before the configure request is retried
+        del done[:], Account.posted[:]
+        account.timeouts = 1
+        queue.submit('account', 'post_photo', key='timeout', photo_data='timeout.jpg', size=[1080, 1080])
+        for _ in range(2):
+            for thread in queue.check():
+                thread.join()
+        self.assertEqual(Account.posted, ['timeout.jpg'])
+        self.assertEqual([(job.status, job.attempts) for job in done], [(PublishJob.PUBLISHED, 2)])
+
+    def test_upload_progress(self):
+        from instagram_private_api.endpoints.upload import UploadEndpointsMixin
+        from instagram_private_api.utils import Chunk
+
+        class Uploader(UploadEndpointsMixin):
+            logger = logging.getLogger('test')
+
+        events = []
+        ranges = ByteRanges(1000)
+        ranges.add(0, 400)
+        ranges.acknowledge('0-399/1000')
+        Uploader()._upload_progress(events.append, '123', Chunk(0, 0, 400, 3), 0.2, 1, ranges)
+        self.assertEqual(events, [{
+            'upload_id': '123', 'index': 0, 'start': 0, 'end': 400, 'seconds': 0.2, 'attempts': 1,
+            'sent': 400, 'acknowledged': 400, 'total': 1000}])
+        # a failing callback does not fail the upload
+        Uploader()._upload_progress(lambda event: 1 / 0, '123', Chunk(0, 0, 400, 3), 0.2, 1, ranges)
+
+        metrics = UploadMetrics()
+        metrics.phases.update({'negotiate': 0.1, 'transfer': 2.0, 'processing': 1.5, 'configure': 0.3})
+        self.assertEqual(metrics.to_dict()['phases']['processing'], 1.5)
+        self.assertEqual(metrics.rtt, 0.1)
+
+    def test_media_preprocessing(self):
+        from multiprocessing.pool import ThreadPool
+
+        feed_ratios = (4.0 / 5.0, 90.0 / 47.0)
+        # too tall: crop the top and bottom off, or pad the sides
+        self.assertEqual(target_size((1000, 2000), feed_ratios, (320, 1080)), ((1000, 1250), (1000, 1250)))
+        self.assertEqual(target_size((1000, 2000), feed_ratios, (320, 1080), mode='pad'),
+                         ((1600, 2000), (1080, 1350)))
+        # too narrow for the min. width
+        canvas, size = target_size((3000, 200), feed_ratios, (612, 1080), even=True)
+        self.assertEqual(canvas, (382, 200))
+        self.assertTrue(size[0] >= 612 and size[1] % 2 == 0)
+        self.assertTrue(feed_ratios[0] <= 1.0 * size[0] / size[1] <= feed_ratios[1])
+        self.assertEqual(target_size((1280, 720), ALBUM_RATIOS, (320, 1080))[1], (720, 720))
+        self.assertRaises(ValueError, target_size, (1, 1), feed_ratios, (320, 1080), mode='stretch')
+
+        # portrait phone videos are stored landscape, with a rotate tag or display matrix side data
+        from instagram_private_api.preprocessing import _stream_size
+        self.assertEqual(_stream_size({'width': 1920, 'height': 1080}), (1920, 1080))
+        self.assertEqual(_stream_size({'width': 1920, 'height': 1080, 'tags': {'rotate': '90'}}), (1080, 1920))
+        self.assertEqual(_stream_size({'width': 1920, 'height': 1080, 'side_data_list': [
+            {'side_data_type': 'Display Matrix', 'rotation': -90}]}), (1080, 1920))
+        self.assertEqual(_stream_size({'width': 1920, 'height': 1080, 'side_data_list': [
+            {'side_data_type': 'Display Matrix', 'rotation': 180}]}), (1920, 1080))
+
+        pool = ThreadPool(2)
+        try:
+            preprocessor = MediaPreprocessor(pool=pool)
+            self.assertRaises(ValueError, preprocessor.prepare, 'edit_media', 'x.jpg')
+            # the errors of the workers, e.g. a missing file or optional dependency, are raised by get()
+            result = preprocessor.prepare('post_photo', os.path.join(preprocessor.output_dir, 'missing.jpg'))
+            self.assertRaises(ValueError, result.get, 5)
+            errors = []
+            preprocessor.submit(
+                None, 'account', 'post_album', [{'type': 'image', 'data': 'missing.jpg'}] * 2, key='album',
+                on_error=lambda key, e: errors.append(key)).wait(5)
+            self.assertEqual(errors, ['album'])
+        finally:
+            pool.terminate()
+
+    def test_media_preprocessing_photo(self):
+        try:
+            from PIL import Image
+        except ImportError:
+            self.skipTest('Pillow is not installed')
+        if not hasattr(Image, 'Exif'):
+            self.skipTest('Pillow is too old to write EXIF data')
+        import shutil
+        import tempfile
+        from instagram_private_api.preprocessing import probe_image, prepare_photo, EXIF_ORIENTATION
+
+        feed_ratios = (4.0 / 5.0, 90.0 / 47.0)
+        output_dir = tempfile.mkdtemp()
+        try:
+            # stored landscape with red on the left, and displayed rotated clockwise with red on top
+            path = os.path.join(output_dir, 'portrait.jpg')
+            image = Image.new('RGB', (200, 100), (0, 0, 255))
+            image.paste((255, 0, 0), (0, 0, 100, 100))
+            exif = Image.Exif()
+            exif[EXIF_ORIENTATION] = 6
+            image.save(path, 'JPEG', exif=exif.tobytes())
+            self.assertEqual(probe_image(path), (100, 200))
+
+            # too tall: the top and bottom are cropped off, and it is scaled up to the min. width
+            photo = prepare_photo(path, output_dir, ratios=feed_ratios)
+            self.assertEqual(photo['size'], [320, 400])
+            with Image.open(photo['photo_data']) as prepared:
+                self.assertEqual(prepared.size, (320, 400))
+                top, bottom = prepared.getpixel((160, 10)), prepared.getpixel((160, 390))
+            self.assertTrue(top[0] > 200 and top[2] < 60, top)
+            self.assertTrue(bottom[2] > 200 and bottom[0] < 60, bottom)
+
+            # or padded with white at the sides
+            photo = prepare_photo(path, output_dir, ratios=feed_ratios, mode='pad')
+            self.assertEqual(photo['size'], [320, 400])
+            with Image.open(photo['photo_data']) as prepared:
+                self.assertEqual(prepared.size, (320, 400))
+                side, top = prepared.getpixel((5, 200)), prepared.getpixel((160, 10))
+            self.assertTrue(min(side) > 200, side)
+            self.assertTrue(top[0] > 200 and top[2] < 60, top)
+        finally:
+            shutil.rmtree(output_dir)
+
+    def test_media_preprocessing_video(self):
+        try:
+            from shutil import which
+        except ImportError:     # Python 2
+            from distutils.spawn import find_executable as which
+        if not (which('ffmpeg') and which('ffprobe')):
+            self.skipTest('ffmpeg is not installed')
+        import shutil
+        import subprocess
+        import tempfile
+        from instagram_private_api.preprocessing import probe_video, prepare_video, VIDEO_WIDTHS
+
+        feed_ratios = (4.0 / 5.0, 90.0 / 47.0)
+        output_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(output_dir, 'wide.mp4')
+            subprocess.check_call([
+                'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc=size=800x200:rate=10', '-t', '4',
+                '-c:v', 'libx264', '-pix_fmt', 'yuv420p', path])
+            size, duration = probe_video(path)
+            self.assertEqual(size, (800, 200))
+            self.assertAlmostEqual(duration, 4.0, delta=0.5)
+
+            # too wide: cropped or padded to the max. ratio, and transcoded to the final size
+            for mode in ('crop', 'pad'):
+                video = prepare_video(path, output_dir, ratios=feed_ratios, mode=mode)
+                final = target_size(size, feed_ratios, VIDEO_WIDTHS, mode=mode, even=True)[1]
+                self.assertEqual(video['size'], list(final))
+                self.assertNotEqual(video['video_data'], path)
+                video_size, video_duration = probe_video(video['video_data'])
+                self.assertEqual(video_size, final)
+                self.assertTrue(feed_ratios[0] <= 1.0 * final[0] / final[1] <= feed_ratios[1])
+                self.assertAlmostEqual(video_duration, 4.0, delta=0.5)
+                self.assertTrue(os.path.getsize(video['thumbnail_data']) > 0)
+        finally:
+            shutil.rmtree(output_dir)
+
 
 if __name__ == '__main__':
 
@@ -1256,6 +2310,134 @@ if __name__ == '__main__':
         {
             'name': 'test_weblink_from_media_id',
             'test': TestPrivateApiUtils('test_weblink_from_media_id')
+        },
+        {
+            'name': 'test_signed_body_encoder',
+            'test': TestPrivateApiUtils('test_signed_body_encoder')
+        },
+        {
+            'name': 'test_lazy_login',
+            'test': TestPrivateApiUtils('test_lazy_login')
+        },
+        {
+            'name': 'test_session_refresher',
+            'test': TestPrivateApiUtils('test_session_refresher')
+        },
+        {
+            'name': 'test_shared_session_store',
+            'test': TestPrivateApiUtils('test_shared_session_store')
+        },
+        {
+            'name': 'test_client_process_pool',
+            'test': TestPrivateApiUtils('test_client_process_pool')
+        },
+        {
+            'name': 'test_compat_patch_lazy_views',
+            'test': TestPrivateApiUtils('test_compat_patch_lazy_views')
+        },
+        {
+            'name': 'test_compat_patch_lazy_carousel',
+            'test': TestPrivateApiUtils('test_compat_patch_lazy_carousel')
+        },
+        {
+            'name': 'test_compat_patch_lazy_materialize',
+            'test': TestPrivateApiUtils('test_compat_patch_lazy_materialize')
+        },
+        {
+            'name': 'test_candidate_index',
+            'test': TestPrivateApiUtils('test_candidate_index')
+        },
+        {
+            'name': 'test_models',
+            'test': TestPrivateApiUtils('test_models')
+        },
+        {
+            'name': 'test_identity_map',
+            'test': TestPrivateApiUtils('test_identity_map')
+        },
+        {
+            'name': 'test_projection',
+            'test': TestPrivateApiUtils('test_projection')
+        },
+        {
+            'name': 'test_paginator',
+            'test': TestPrivateApiUtils('test_paginator')
+        },
+        {
+            'name': 'test_columnar',
+            'test': TestPrivateApiUtils('test_columnar')
+        },
+        {
+            'name': 'test_columnar_numpy',
+            'test': TestPrivateApiUtils('test_columnar_numpy')
+        },
+        {
+            'name': 'test_columnar_arrow',
+            'test': TestPrivateApiUtils('test_columnar_arrow')
+        },
+        {
+            'name': 'test_compat_patch_many',
+            'test': TestPrivateApiUtils('test_compat_patch_many')
+        },
+        {
+            'name': 'test_compat_patch_copy',
+            'test': TestPrivateApiUtils('test_compat_patch_copy')
+        },
+        {
+            'name': 'test_multipart_stream',
+            'test': TestPrivateApiUtils('test_multipart_stream')
+        },
+        {
+            'name': 'test_chunk_generator',
+            'test': TestPrivateApiUtils('test_chunk_generator')
+        },
+        {
+            'name': 'test_byte_ranges',
+            'test': TestPrivateApiUtils('test_byte_ranges')
+        },
+        {
+            'name': 'test_chunk_retry',
+            'test': TestPrivateApiUtils('test_chunk_retry')
+        },
+        {
+            'name': 'test_upload_state',
+            'test': TestPrivateApiUtils('test_upload_state')
+        },
+        {
+            'name': 'test_adaptive_chunker',
+            'test': TestPrivateApiUtils('test_adaptive_chunker')
+        },
+        {
+            'name': 'test_gen_upload_id',
+            'test': TestPrivateApiUtils('test_gen_upload_id')
+        },
+        {
+            'name': 'test_upload_scheduler',
+            'test': TestPrivateApiUtils('test_upload_scheduler')
+        },
+        {
+            'name': 'test_video_configure_retry',
+            'test': TestPrivateApiUtils('test_video_configure_retry')
+        },
+        {
+            'name': 'test_publish_queue',
+            'test': TestPrivateApiUtils('test_publish_queue')
+        },
+        {
+            'name': 'test_upload_progress',
+            'test': TestPrivateApiUtils('test_upload_progress')
+        },
+        {
+            'name': 'test_media_preprocessing',
+            'test': TestPrivateApiUtils('test_media_preprocessing')
+        },
+        {
+            'name': 'test_media_preprocessing_photo',
+            'test': TestPrivateApiUtils('test_media_preprocessing_photo')
+        },
+        {
+            'name': 'test_media_preprocessing_video',
+            'test': TestPrivateApiUtils('test_media_preprocessing_video')
         }
     ]
 